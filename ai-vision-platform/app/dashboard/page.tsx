@@ -9,6 +9,7 @@ export default function DashboardPage() {
   const [user, setUser] = useState<any>(null);
   const [selectedImage, setSelectedImage] = useState<string | null>(null);
   const [detections, setDetections] = useState<Detection[]>([]);
+  const [detectionId, setDetectionId] = useState<string | null>(null);
   const [annotatedImage, setAnnotatedImage] = useState<string | null>(null);
   const [loading, setLoading] = useState(false);
   const [messages, setMessages] = useState<ChatMessage[]>([]);
@@ -45,6 +46,7 @@ export default function DashboardPage() {
       reader.onload = (e) => {
         setSelectedImage(e.target?.result as string);
         setDetections([]);
+        setDetectionId(null);
         setAnnotatedImage(null);
         setMessages([]);
       };
@@ -60,6 +62,7 @@ export default function DashboardPage() {
       reader.onload = (e) => {
         setSelectedImage(e.target?.result as string);
         setDetections([]);
+        setDetectionId(null);
         setAnnotatedImage(null);
         setMessages([]);
       };
@@ -95,6 +98,7 @@ export default function DashboardPage() {
           bbox: d.bbox
         }));
         setDetections(mappedDetections);
+        setDetectionId(data.detectionId || null);
         setAnnotatedImage(data.annotatedImage || selectedImage);
       } else {
         alert('Detection failed: ' + (data.error || 'Unknown error'));
@@ -122,16 +126,25 @@ export default function DashboardPage() {
     try {
       // Use Python Flask backend
       const API_BASE_URL = 'http://localhost:5000';
-      console.log('Sending Q&A request:', { question, detections });
+      console.log('Sending Q&A request:', { question, detectionId });
       
-      const response = await fetch(`${API_BASE_URL}/api/qa`, {
+      const askQa = (body: object) => fetch(`${API_BASE_URL}/api/qa`, {
         method: 'POST',
         headers: {
           'Content-Type': 'application/json',
           'Authorization': `Bearer ${token}`,
         },
-        body: JSON.stringify({ question, detections }),
+        body: JSON.stringify(body),
       });
+      
+      // Refer to the stored detection result; resend the detections if it expired
+      let response = detectionId
+        ? await askQa({ question, detectionId })
+        : await askQa({ question, detections });
+      if (response.status === 404 && detectionId) {
+        setDetectionId(null);
+        response = await askQa({ question, detections });
+      }
 
       console.log('Q&A response status:', response.status);
       const data = await response.json();
@@ -293,6 +306,7 @@ export default function DashboardPage() {
                   onClick={() => {
                     setSelectedImage(null);
                     setDetections([]);
+                    setDetectionId(null);
                     setAnnotatedImage(null);
                     setMessages([]);
                   }}
@@ -8,13 +8,30 @@ from flask_cors import CORS
 from dotenv import load_dotenv
 import os
 
+# Load environment variables before the project imports: their settings are
+# module-level os.getenv values read at import time
+load_dotenv()
+
 from routes.auth import auth_bp
 from routes.detect import detect_bp
 from routes.qa import qa_bp
+from routes.jobs import jobs_bp
+from routes.stream import stream_bp
 from utils.database import init_db
-
-# Load environment variables
-load_dotenv()
+from utils.cache import detection_cache
+from utils.near_duplicate import near_duplicate_index
+from utils.http_client import upstream_stats
+from utils.image_fetch import fetch_stats
+from utils.circuit_breaker import breaker_states
+from utils.gemini import answer_cache, batch_stats, stream_stats
+from utils.query_engine import local_answer_stats
+from utils.prompt_context import context_stats
+from utils.sessions import session_stats
+from utils.detectors import get_cascade_detector, get_detector
+from utils.jobs import start_job_workers
+from utils.warmup import readiness, start_warmup
+from utils.yolo import annotation_stats, cascade_stats
+from utils.render import render_stats
 
 app = Flask(__name__)
 
@@ -23,6 +40,8 @@ app.config['SECRET_KEY'] = os.getenv('JWT_SECRET', 'your-secret-key')
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
 app.config['SQLALCHEMY_DATABASE_URI'] = 'sqlite:///ai_vision.db'
 app.config['SQLALCHEMY_TRACK_MODIFICATIONS'] = False
+# Job workers in several processes write to the same SQLite file
+app.config['SQLALCHEMY_ENGINE_OPTIONS'] = {'connect_args': {'timeout': 15}}
 
 # Initialize database
 init_db(app)
@@ -34,11 +53,52 @@ CORS(app, origins=['http://localhost:3000', 'http://localhost:3001'])
 app.register_blueprint(auth_bp, url_prefix='/api/auth')
 app.register_blueprint(detect_bp, url_prefix='/api')
 app.register_blueprint(qa_bp, url_prefix='/api')
+app.register_blueprint(jobs_bp, url_prefix='/api')
+app.register_blueprint(stream_bp, url_prefix='/api')
+
+# Load the detector up front; under gunicorn preload this happens once in
+# the master, before workers are forked
+try:
+    get_detector()
+    get_cascade_detector()
+except Exception as e:
+    print(f"⚠️ Detector failed to load: {str(e)}")
+
+@app.before_request
+def start_background_workers():
+    """Start this process's job workers and warm-up (no-op after the first request)"""
+    start_job_workers(app)
+    start_warmup()
 
 @app.route('/health', methods=['GET'])
 def health_check():
     """Health check endpoint"""
-    return {'status': 'ok', 'message': 'AI Vision Platform API is running'}, 200
+    return {
+        'status': 'ok',
+        'message': 'AI Vision Platform API is running',
+        'readiness': readiness.snapshot(),
+        'detectionCache': detection_cache.stats(),
+        'nearDuplicates': near_duplicate_index.stats(),
+        'upstreams': upstream_stats(),
+        'imageFetch': fetch_stats(),
+        'circuitBreakers': breaker_states(),
+        'cascade': cascade_stats(),
+        'qaLocal': local_answer_stats(),
+        'qaCache': answer_cache.stats(),
+        'detectionSessions': session_stats(),
+        'qaStreaming': stream_stats(),
+        'qaBatch': batch_stats(),
+        'qaContext': context_stats(),
+        'annotation': annotation_stats(),
+        'renderer': render_stats()
+    }, 200
+
+@app.route('/health/ready', methods=['GET'])
+def readiness_check():
+    """Readiness probe: 503 until the detector has answered a warm-up ping"""
+    start_warmup()
+    snapshot = readiness.snapshot()
+    return snapshot, 200 if snapshot['ready'] else 503
 
 @app.errorhandler(404)
 def not_found(error):
@@ -54,8 +114,12 @@ if __name__ == '__main__':
     
     print(f"🚀 Starting AI Vision Platform API on port {port}")
     print(f"📍 Health check: http://localhost:{port}/health")
+    print(f"🔥 Readiness: http://localhost:{port}/health/ready")
     print(f"🔐 Auth endpoints: http://localhost:{port}/api/auth/*")
     print(f"🎯 Detection endpoint: http://localhost:{port}/api/detect")
+    print(f"📦 Batch detection: http://localhost:{port}/api/detect/batch")
+    print(f"🧵 Detection jobs: http://localhost:{port}/api/detect/jobs")
+    print(f"🎞️ Frame-stream detection: http://localhost:{port}/api/detect/stream")
     print(f"💬 Q&A endpoint: http://localhost:{port}/api/qa")
     
     app.run(host='0.0.0.0', port=port, debug=debug)
@@ -0,0 +1,41 @@
+"""
+Gunicorn configuration
+Preloads the app in the master so the detector model is loaded once and
+shared copy-on-write by every worker
+"""
+
+import os
+
+bind = f"0.0.0.0:{os.getenv('PORT', 5000)}"
+workers = int(os.getenv('WEB_CONCURRENCY', 4))
+preload_app = True
+# Threaded workers: job long-polls, job SSE and frame streams each hold a
+# thread while they wait, not a whole worker process. The default worker
+# timeout stays in force: gthread workers heartbeat from their main loop,
+# so a long stream on one thread does not get the worker killed.
+worker_class = 'gthread'
+threads = int(os.getenv('GUNICORN_THREADS', 8))
+
+def post_fork(server, worker):
+    """Reset per-process resources that must not be shared across fork"""
+    from app import app
+    from utils.database import db
+    from utils.detectors import get_cascade_detector, get_detector
+    from utils.jobs import start_job_workers
+    from utils.warmup import start_warmup
+
+    # Pooled SQLite connections opened by init_db belong to the master
+    with app.app_context():
+        db.engine.dispose(close=False)
+
+    try:
+        get_detector().load()
+        cascade = get_cascade_detector()
+        if cascade is not None:
+            cascade.load()
+    except Exception as e:
+        print(f"⚠️ Detector failed to load in worker {os.getpid()}: {str(e)}")
+
+    # Background threads never survive fork, so start them in each worker
+    start_job_workers(app)
+    start_warmup()
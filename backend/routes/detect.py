@@ -3,13 +3,137 @@ Object detection route
 YOLO-based image analysis
 """
 
-from flask import Blueprint, request, jsonify
+from concurrent.futures import ThreadPoolExecutor
+from flask import Blueprint, Response, current_app, request, jsonify
+from typing import Dict, Optional, Tuple
+from werkzeug.exceptions import RequestEntityTooLarge
+from PIL import UnidentifiedImageError
+import base64
+import math
+import os
+import requests
+import time
 
+from utils.annotations import load_for_annotation, parse_annotation_options, store_for_annotation
 from utils.auth import token_required
-from utils.yolo import detect_objects, draw_bounding_boxes
+from utils.circuit_breaker import CircuitOpenError
+from utils.detectors import ModelLoadingError
+from utils.image_fetch import ImageFetchError, fetch_image, is_image_url
+from utils.image_input import DecodedImage, ImageTooLargeError, MemoryTracker, as_bytes
+from utils.postprocess import apply_postprocess, parse_postprocess_options
+from utils.sessions import create_detection_session
+from utils.tiling import parse_tile_options
+from utils.warmup import WARMUP_RETRY_INTERVAL
+from utils.yolo import detect_objects, detect_tiled, render_annotation, run_detection
 
 detect_bp = Blueprint('detect', __name__)
 
+DETECT_BATCH_MAX_SIZE = int(os.getenv('DETECT_BATCH_MAX_SIZE', 50))
+# Keep at or below UPSTREAM_POOL_SIZE so every thread gets a pooled connection
+DETECT_BATCH_CONCURRENCY = int(os.getenv('DETECT_BATCH_CONCURRENCY', 8))
+
+# End-to-end budget for the detector call; clients may ask for less
+DETECT_LATENCY_BUDGET_MS = int(os.getenv('DETECT_LATENCY_BUDGET_MS', 25000))
+
+def request_deadline(params: Dict, started: float) -> Optional[float]:
+    """
+    Deadline (time.monotonic()) for this request's detector calls
+    
+    The client's budget comes from the X-Request-Budget-Ms header or the
+    budgetMs param and is capped by DETECT_LATENCY_BUDGET_MS.
+    
+    Raises:
+        ValueError: If the budget is not a positive number of milliseconds
+    """
+    budget_ms = request.headers.get('X-Request-Budget-Ms') or params.get('budgetMs')
+    if budget_ms not in (None, ''):
+        try:
+            budget_ms = float(budget_ms)
+        except (TypeError, ValueError):
+            raise ValueError('budgetMs must be a number of milliseconds')
+        if budget_ms <= 0:
+            raise ValueError('budgetMs must be positive')
+        if DETECT_LATENCY_BUDGET_MS > 0:
+            budget_ms = min(budget_ms, DETECT_LATENCY_BUDGET_MS)
+    elif DETECT_LATENCY_BUDGET_MS > 0:
+        budget_ms = DETECT_LATENCY_BUDGET_MS
+    else:
+        return None
+    return started + budget_ms / 1000
+
+def validate_image(image, allow_url: bool = False) -> Optional[str]:
+    """Return an error message if the image is not a base64 data URL (or an http(s) URL)"""
+    if not image:
+        return 'Image is required'
+    if allow_url and is_image_url(image):
+        return None
+    if not isinstance(image, str) or not image.startswith('data:image'):
+        if allow_url:
+            return 'Invalid image format. Expected base64 data URL or http(s) URL'
+        return 'Invalid image format. Expected base64 data URL'
+    return None
+
+def is_raw_image_type(mimetype: str) -> bool:
+    return mimetype == 'application/octet-stream' or mimetype.startswith('image/')
+
+def read_request_image() -> Tuple[DecodedImage, Dict]:
+    """
+    Read the image from a JSON, multipart/form-data or raw-bytes request,
+    or download it from the imageUrl field
+    
+    Returns:
+        (decoded image, other request params from the query string plus
+        the JSON body or form fields)
+    
+    Raises:
+        ValueError: If the image is missing or malformed
+        ImageFetchError: If imageUrl could not be downloaded
+    """
+    mimetype = request.mimetype
+    params = request.args.to_dict()
+    
+    # Multipart: werkzeug already spools large file parts to disk
+    if mimetype == 'multipart/form-data':
+        upload = request.files.get('image')
+        if upload is None:
+            if request.form.get('imageUrl'):
+                params.update(request.form.to_dict())
+                return DecodedImage(fetch_image(params.pop('imageUrl'))), params
+            raise ValueError('Image is required')
+        if upload.mimetype and not is_raw_image_type(upload.mimetype):
+            raise ValueError('Invalid image format. Expected an image file')
+        data = upload.read()
+        upload.close()
+        if not data:
+            raise ValueError('Image is required')
+        params.update(request.form.to_dict())
+        return DecodedImage(data), params
+    
+    # Raw bytes: stream straight into a size-capped buffer
+    if is_raw_image_type(mimetype):
+        max_bytes = current_app.config.get('MAX_CONTENT_LENGTH')
+        return DecodedImage.from_stream(request.stream, max_bytes), params
+    
+    # JSON with a base64 data URL. Parsed without caching so the request
+    # object does not pin the raw body; the string is dropped on return.
+    data = request.get_json(cache=False, silent=True)
+    if not data:
+        raise ValueError('Request body is required')
+    if not isinstance(data, dict):
+        raise ValueError('Request body must be a JSON object')
+    image = data.pop('image', None)
+    image_url = data.pop('imageUrl', None)
+    if image is None and image_url is not None:
+        if not is_image_url(image_url):
+            raise ValueError('imageUrl must be an http(s) URL')
+        params.update(data)
+        return DecodedImage(fetch_image(image_url)), params
+    error = validate_image(image)
+    if error:
+        raise ValueError(error)
+    params.update(data)
+    return DecodedImage.from_data_url(image), params
+
 @detect_bp.route('/detect', methods=['POST'])
 @token_required
 def detect():
@@ -19,10 +143,24 @@ def detect():
     Headers:
         Authorization: Bearer <token>
         
-    Request body:
-        {
-            "image": "data:image/jpeg;base64,..."
-        }
+    Request body, one of:
+        application/json:    { "image": "data:image/jpeg;base64,..." }
+                             or { "imageUrl": "https://..." }
+        multipart/form-data: file field "image" (or field "imageUrl")
+        application/octet-stream or image/*: the raw image bytes
+        
+    Options (JSON fields, form fields or query params):
+        annotate: full (default) | none | lazy
+        format: png (default) | jpeg | webp
+        quality: 1-100 for jpeg/webp (default 85)
+        maxSide: Thumbnail cap for the annotated image
+        tile: true to detect on overlapping tiles (large images)
+        tileSize, tileOverlap, tileParallelism: Tiling parameters
+        minScore: Drop detections below this score
+        labels / excludeLabels: Keep only / drop these labels (comma-separated)
+        nmsIou: Class-aware NMS IoU threshold
+        topK: Keep only the K highest-scored detections
+        budgetMs: Latency budget for detection (or X-Request-Budget-Ms header)
         
     Returns:
         {
@@ -33,35 +171,268 @@ def detect():
                     "bbox": { "x": 100, "y": 50, "width": 200, "height": 300 }
                 },
                 ...
-            ]
+            ],
+            "annotatedImage": "data:image/png;base64,..." or null,
+            "annotation": { "format", "width", "height", "bytes", "encodeMs" }
+                or { "url": "/api/detect/annotations/<token>" } when lazy,
+            "detectionId": "<id>"  (pass to /api/qa instead of the detections),
+            "partial": false, "failedTiles": 0  (tiled requests only; partial
+                when some tiles failed and their objects are missing)
         }
     """
     try:
+        started = time.monotonic()
+        with MemoryTracker() as memory:
+            try:
+                decoded, params = read_request_image()
+                options = parse_annotation_options(params)
+                tiling = parse_tile_options(params)
+                filters = parse_postprocess_options(params)
+                deadline = request_deadline(params, started)
+            except ImageTooLargeError as e:
+                return jsonify({'error': str(e)}), 413
+            except ImageFetchError as e:
+                return jsonify({'error': str(e)}), e.status
+            except ValueError as e:
+                return jsonify({'error': str(e)}), 400
+            
+            annotated_image = None
+            annotation = None
+            failed_tiles = None
+            with decoded:
+                # Detect objects on the encoded bytes (or tile by tile)
+                try:
+                    if tiling is not None:
+                        detections, failed_tiles, _ = detect_tiled(decoded, tiling, deadline)
+                    else:
+                        detections = detect_objects(decoded, deadline=deadline)
+                except Exception as e:
+                    return detector_error_response(e)
+                # Filter after the cache so cached results stay complete
+                detections = apply_postprocess(detections, filters)
+                
+                if options['mode'] == 'lazy':
+                    # Keep the upload so the client can ask for a rendering later
+                    token = store_for_annotation(request.user.get('userId'), as_bytes(decoded.data), detections)
+                    annotation = {'url': f"/api/detect/annotations/{token}"}
+                elif options['mode'] == 'full':
+                    # Decode pixels for the renderer, then drop the encoded bytes
+                    try:
+                        pil_image = decoded.image
+                    except Exception as e:
+                        print(f"⚠️ Could not decode image for annotation: {str(e)}")
+                        pil_image = None
+                    decoded.release_data()
+                    
+                    # Draw bounding boxes on the image
+                    if pil_image is not None:
+                        annotated_image, annotation = encode_annotation(pil_image, detections, options)
+                    del pil_image
+        
+        # Keep the result so follow-up questions can refer to it by ID
+        detection_id = None
+        try:
+            detection_id = create_detection_session(request.user.get('userId'), detections)
+        except Exception as e:
+            print(f"⚠️ Could not store detection session: {str(e)}")
+        
+        body = {
+            'detections': detections,
+            'annotatedImage': annotated_image,
+            'annotation': annotation,
+            'detectionId': detection_id
+        }
+        if failed_tiles is not None:
+            body['partial'] = failed_tiles > 0
+            body['failedTiles'] = failed_tiles
+        response = jsonify(body)
+        if memory.peak_bytes is not None:
+            print(f"📈 Peak request memory: {memory.peak_bytes / (1024 * 1024):.1f}MB")
+            response.headers['X-Peak-Memory-Bytes'] = str(memory.peak_bytes)
+        return response, 200
+        
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Image exceeds the upload size limit'}), 413
+    except Exception as e:
+        print(f"Error in detection: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def detector_error_response(error: Exception) -> Tuple[Response, int]:
+    """
+    Error response for a failed detection
+    
+    503 with Retry-After while the model is loading or the breaker is open,
+    504 when the latency budget ran out, 400 for an unreadable image and
+    502 for any other detector failure.
+    """
+    if isinstance(error, (ModelLoadingError, CircuitOpenError)):
+        print(f"⏳ Detector unavailable: {str(error)}")
+        retry_after = getattr(error, 'retry_after', 0.0) or WARMUP_RETRY_INTERVAL
+        response = jsonify({'error': 'Detection service is temporarily unavailable, try again shortly'})
+        response.headers['Retry-After'] = str(max(1, math.ceil(retry_after)))
+        return response, 503
+    if isinstance(error, requests.Timeout):
+        print(f"⌛ Detection timed out: {str(error)}")
+        return jsonify({'error': 'Detection did not finish within the latency budget'}), 504
+    if isinstance(error, UnidentifiedImageError):
+        return jsonify({'error': 'Invalid image data'}), 400
+    print(f"⚠️ Error in object detection: {str(error)}")
+    return jsonify({'error': 'Detection failed'}), 502
+
+def encode_annotation(image, detections, options: Dict) -> Tuple[Optional[str], Optional[Dict]]:
+    """Render the annotated image as a data URL plus its size/timing report"""
+    try:
+        annotation = render_annotation(
+            image, detections, options['format'], options['quality'], options['max_side']
+        )
+    except Exception as e:
+        print(f"⚠️ Error drawing bounding boxes: {str(e)}")
+        return None, None
+    data = annotation.pop('data')
+    mimetype = annotation.pop('mimetype')
+    return f"data:{mimetype};base64,{base64.b64encode(data).decode()}", annotation
+
+@detect_bp.route('/detect/annotations/<token>', methods=['GET'])
+@token_required
+def lazy_annotation(token):
+    """
+    Render the annotated image for an earlier annotate=lazy detection
+    
+    Headers:
+        Authorization: Bearer <token>
+        
+    Query params:
+        format: png (default) | jpeg | webp
+        quality: 1-100 for jpeg/webp
+        maxSide: Thumbnail cap for the longest side
+        
+    Returns:
+        The encoded image bytes, with X-Encode-Ms timing header
+    """
+    try:
+        try:
+            options = parse_annotation_options(request.args)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+        
+        stored = load_for_annotation(token, request.user.get('userId'))
+        if stored is None:
+            return jsonify({'error': 'Annotation not found or expired'}), 404
+        image_data, detections = stored
+        
+        with DecodedImage(image_data) as decoded:
+            annotation = render_annotation(
+                decoded.image, detections, options['format'], options['quality'], options['max_side']
+            )
+        
+        response = Response(annotation['data'], mimetype=annotation['mimetype'])
+        response.headers['X-Encode-Ms'] = str(annotation['encodeMs'])
+        response.headers['Cache-Control'] = 'private, max-age=3600'
+        return response
+        
+    except Exception as e:
+        print(f"Error rendering annotation: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def detect_one(index: int, image, filters: Optional[Dict] = None, deadline: Optional[float] = None) -> Dict:
+    """Run detection for a single batch item, capturing any failure"""
+    error = validate_image(image, allow_url=True)
+    if error:
+        return {'index': index, 'status': 'error', 'error': error}
+    try:
+        if is_image_url(image):
+            decoded = DecodedImage(fetch_image(image))
+        else:
+            decoded = DecodedImage.from_data_url(image)
+    except ValueError as e:
+        return {'index': index, 'status': 'error', 'error': str(e)}
+    except Exception as e:
+        print(f"Error loading batch detection item {index}: {str(e)}")
+        return {'index': index, 'status': 'error', 'error': 'Could not load image'}
+    
+    # The raising path, so a detector failure is reported for this item
+    # instead of being replaced by mock detections
+    try:
+        with decoded:
+            detections = apply_postprocess(run_detection(decoded.data, deadline), filters)
+        return {'index': index, 'status': 'ok', 'detections': detections}
+    except CircuitOpenError as e:
+        print(f"⚡ Batch detection item {index}: {str(e)}")
+        return {'index': index, 'status': 'error', 'error': 'Detection service unavailable'}
+    except Exception as e:
+        print(f"Error in batch detection item {index}: {str(e)}")
+        return {'index': index, 'status': 'error', 'error': 'Detection failed'}
+
+@detect_bp.route('/detect/batch', methods=['POST'])
+@token_required
+def detect_batch():
+    """
+    Detect objects in several images concurrently
+    
+    Headers:
+        Authorization: Bearer <token>
+        
+    Request body:
+        {
+            "images": ["data:image/jpeg;base64,...", "https://...", ...],
+            "minScore", "labels", "excludeLabels", "nmsIou", "topK": optional,
+                applied to every image as in /api/detect
+        }
+        
+        http(s) items are downloaded by the server; several requests for
+        the same URL at once share one download.
+        
+    Returns:
+        {
+            "results": [
+                { "index": 0, "status": "ok", "detections": [...] },
+                { "index": 1, "status": "error", "error": "..." },
+                ...
+            ],
+            "summary": { "total": 2, "succeeded": 1, "failed": 1 }
+        }
+        
+        Status is 200 when every item succeeded and 207 otherwise. Items
+        the detector failed on (upstream down, out of time) are errors, not
+        mock detections.
+    """
+    try:
+        started = time.monotonic()
         data = request.get_json()
         
         # Validate input
         if not data:
             return jsonify({'error': 'Request body is required'}), 400
         
-        image = data.get('image')
-        if not image:
-            return jsonify({'error': 'Image is required'}), 400
+        images = data.get('images')
+        if not isinstance(images, list) or not images:
+            return jsonify({'error': 'Images must be a non-empty array'}), 400
+        if len(images) > DETECT_BATCH_MAX_SIZE:
+            return jsonify({'error': f'Batch size exceeds limit of {DETECT_BATCH_MAX_SIZE} images'}), 400
         
-        # Validate base64 format
-        if not image.startswith('data:image'):
-            return jsonify({'error': 'Invalid image format. Expected base64 data URL'}), 400
+        try:
+            params = {**request.args.to_dict(), **data}
+            filters = parse_postprocess_options(params)
+            deadline = request_deadline(params, started)
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
         
-        # Detect objects
-        detections = detect_objects(image)
+        # Fan out to the upstream on a bounded pool; results keep request order
+        workers = max(1, min(DETECT_BATCH_CONCURRENCY, len(images)))
+        with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detect-batch') as pool:
+            results = list(pool.map(
+                detect_one, range(len(images)), images, [filters] * len(images), [deadline] * len(images)
+            ))
         
-        # Draw bounding boxes on the image
-        annotated_image = draw_bounding_boxes(image, detections)
+        failed = sum(1 for result in results if result['status'] != 'ok')
+        summary = {
+            'total': len(results),
+            'succeeded': len(results) - failed,
+            'failed': failed
+        }
         
-        return jsonify({
-            'detections': detections,
-            'annotatedImage': annotated_image
-        }), 200
+        return jsonify({'results': results, 'summary': summary}), 207 if failed else 200
         
     except Exception as e:
-        print(f"Error in detection: {str(e)}")
+        print(f"Error in batch detection: {str(e)}")
         return jsonify({'error': 'Internal server error'}), 500
@@ -0,0 +1,148 @@
+"""
+Detection job routes
+Enqueue detections and fetch results by polling, long-polling or SSE
+"""
+
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from werkzeug.exceptions import RequestEntityTooLarge
+import json
+import time
+
+from routes.detect import read_request_image
+from utils.auth import token_required
+from utils.database import db
+from utils.image_input import ImageTooLargeError, as_bytes
+from utils.jobs import (
+    JOB_MAX_WAIT, JOB_POLL_INTERVAL, LANES, TERMINAL_STATUSES,
+    enqueue_job, get_job, wait_for_job
+)
+
+jobs_bp = Blueprint('jobs', __name__)
+
+# Seconds between SSE keep-alive comments while a job is unchanged
+SSE_HEARTBEAT_INTERVAL = 10
+
+@jobs_bp.route('/detect/jobs', methods=['POST'])
+@token_required
+def create_job():
+    """
+    Queue an image for background detection
+
+    Headers:
+        Authorization: Bearer <token>
+
+    Query params:
+        lane: "interactive" (default) or "bulk"
+
+    Request body:
+        Same formats as /api/detect (JSON data URL, multipart or raw bytes)
+
+    Returns (202):
+        {
+            "jobId": "uuid",
+            "status": "queued",
+            "statusUrl": "/api/detect/jobs/<id>",
+            ...
+        }
+    """
+    try:
+        lane = request.args.get('lane', 'interactive')
+        if lane not in LANES:
+            return jsonify({'error': f"Invalid lane. Choose from: {', '.join(LANES)}"}), 400
+
+        try:
+            decoded, _ = read_request_image()
+        except ImageTooLargeError as e:
+            return jsonify({'error': str(e)}), 413
+        except ValueError as e:
+            return jsonify({'error': str(e)}), 400
+
+        with decoded:
+            job = enqueue_job(request.user.get('userId'), as_bytes(decoded.data), lane)
+
+        job['statusUrl'] = f"/api/detect/jobs/{job['jobId']}"
+        job['eventsUrl'] = f"/api/detect/jobs/{job['jobId']}/events"
+        return jsonify(job), 202
+
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Image exceeds the upload size limit'}), 413
+    except Exception as e:
+        print(f"Error enqueuing detection job: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@jobs_bp.route('/detect/jobs/<job_id>', methods=['GET'])
+@token_required
+def job_status(job_id):
+    """
+    Get a detection job's status and result
+
+    Headers:
+        Authorization: Bearer <token>
+
+    Query params:
+        wait: Seconds to long-poll for completion (max JOB_MAX_WAIT)
+
+    Returns:
+        {
+            "jobId": "uuid",
+            "status": "queued" | "running" | "done" | "failed",
+            "detections": [...],   # when done
+            "error": "..."         # when failed
+        }
+    """
+    try:
+        try:
+            wait = max(0.0, float(request.args.get('wait', 0)))
+        except ValueError:
+            return jsonify({'error': 'wait must be a number of seconds'}), 400
+
+        user_id = request.user.get('userId')
+        job = wait_for_job(job_id, user_id, wait) if wait else get_job(job_id, user_id)
+        if job is None:
+            return jsonify({'error': 'Job not found'}), 404
+
+        return jsonify(job), 200
+
+    except Exception as e:
+        print(f"Error fetching detection job: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+@jobs_bp.route('/detect/jobs/<job_id>/events', methods=['GET'])
+@token_required
+def job_events(job_id):
+    """
+    Stream a job's status changes as Server-Sent Events
+
+    Emits a "status" event whenever the job changes and closes the stream
+    once it is done or failed (or after JOB_MAX_WAIT seconds).
+    """
+    user_id = request.user.get('userId')
+    if get_job(job_id, user_id) is None:
+        return jsonify({'error': 'Job not found'}), 404
+
+    def generate():
+        deadline = time.monotonic() + JOB_MAX_WAIT
+        last_status = None
+        last_sent = time.monotonic()
+        while True:
+            db.session.expire_all()
+            job = get_job(job_id, user_id)
+            if job is None:
+                yield 'event: error\ndata: {"error": "Job not found"}\n\n'
+                return
+            if job['status'] != last_status:
+                last_status = job['status']
+                last_sent = time.monotonic()
+                yield f"event: status\ndata: {json.dumps(job)}\n\n"
+            elif time.monotonic() - last_sent >= SSE_HEARTBEAT_INTERVAL:
+                last_sent = time.monotonic()
+                yield ': keep-alive\n\n'
+            if job['status'] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+                return
+            time.sleep(JOB_POLL_INTERVAL)
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -3,13 +3,38 @@ Q&A route
 AI-powered question answering with detection context
 """
 
-from flask import Blueprint, request, jsonify
+from flask import Blueprint, Response, request, jsonify, stream_with_context
+from typing import Dict, List, Optional, Tuple
+import json
+import time
 
 from utils.auth import token_required
-from utils.gemini import ask_gemini
+from utils.gemini import QA_BATCH_MAX_QUESTIONS, ask_gemini, ask_gemini_batch, stream_gemini
+from utils.sessions import get_detection_session
 
 qa_bp = Blueprint('qa', __name__)
 
+def request_detections(data: Dict) -> Tuple[List[Dict], Optional[str]]:
+    """
+    Detections a Q&A request is about
+    
+    A stored detection result (detectionId) replaces the posted detections.
+    
+    Returns:
+        (detections, fingerprint if already known)
+    
+    Raises:
+        LookupError: If detectionId is unknown, expired or someone else's
+    """
+    detection_id = data.get('detectionId')
+    if not detection_id:
+        return data.get('detections', []), None
+    session = get_detection_session(str(detection_id), request.user.get('userId'))
+    if session is None:
+        print(f"❌ Detection session {detection_id} not found")
+        raise LookupError('Detection session not found or expired')
+    return session.detections, session.fingerprint
+
 @qa_bp.route('/qa', methods=['POST'])
 @token_required
 def qa():
@@ -18,10 +43,13 @@ def qa():
     
     Headers:
         Authorization: Bearer <token>
+        Accept: application/json (default) or text/event-stream
         
     Request body:
         {
             "question": "What objects do you see?",
+            "stream": false,  (optional, true streams like Accept: text/event-stream)
+            "detectionId": "<id from /api/detect>",  (instead of detections)
             "detections": [
                 {
                     "label": "person",
@@ -36,6 +64,11 @@ def qa():
         {
             "answer": "I can see a person, a car, and a dog in the image..."
         }
+        
+        When streaming, Server-Sent Events as the answer is generated:
+        event: token   data: {"text": "I can see"}
+        event: done    data: {"answer": "<full text>", "firstTokenMs": 412.3, "totalMs": 1830.9}
+        event: error   data: {"error": "..."} if the stream breaks midway
     """
     try:
         data = request.get_json()
@@ -46,7 +79,10 @@ def qa():
             return jsonify({'error': 'Request body is required'}), 400
         
         question = data.get('question', '').strip()
-        detections = data.get('detections', [])
+        try:
+            detections, fingerprint = request_detections(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
         
         print(f"📝 Q&A Request - Question: {question}")
         print(f"📝 Q&A Request - Detections count: {len(detections)}")
@@ -59,9 +95,13 @@ def qa():
             print("❌ Detections is not a list")
             return jsonify({'error': 'Detections must be an array'}), 400
         
+        if data.get('stream') is True or request.accept_mimetypes.best_match(
+                ['application/json', 'text/event-stream']) == 'text/event-stream':
+            return stream_answer(question, detections, fingerprint)
+        
         # Get AI answer
         print(f"🤖 Calling ask_gemini...")
-        answer = ask_gemini(question, detections)
+        answer = ask_gemini(question, detections, fingerprint)
         print(f"✅ Answer generated: {answer[:100]}...")
         
         return jsonify({'answer': answer}), 200
@@ -71,3 +111,89 @@ def qa():
         import traceback
         traceback.print_exc()
         return jsonify({'error': f'Internal server error: {str(e)}'}), 500
+
+@qa_bp.route('/qa/batch', methods=['POST'])
+@token_required
+def qa_batch():
+    """
+    Ask several questions about the same detections in one request
+    
+    Headers:
+        Authorization: Bearer <token>
+        
+    Request body:
+        {
+            "questions": ["How many people are there?", "What is the scene about?", ...],
+            "detectionId": "<id from /api/detect>"  (or "detections": [...] as for /api/qa)
+        }
+        
+    Returns:
+        {
+            "answers": [
+                { "question": "How many people are there?", "answer": "...", "source": "local" },
+                ...
+            ]
+        }
+        
+        Answers are in question order. source is local, cache, batch,
+        single or fallback.
+    """
+    try:
+        data = request.get_json(silent=True)
+        if not data:
+            return jsonify({'error': 'Request body is required'}), 400
+        
+        questions = data.get('questions')
+        if not isinstance(questions, list) or not questions:
+            return jsonify({'error': 'questions must be a non-empty array'}), 400
+        if len(questions) > QA_BATCH_MAX_QUESTIONS:
+            return jsonify({'error': f'At most {QA_BATCH_MAX_QUESTIONS} questions per batch'}), 400
+        if not all(isinstance(question, str) and question.strip() for question in questions):
+            return jsonify({'error': 'Every question must be a non-empty string'}), 400
+        questions = [question.strip() for question in questions]
+        
+        try:
+            detections, fingerprint = request_detections(data)
+        except LookupError as e:
+            return jsonify({'error': str(e)}), 404
+        if not isinstance(detections, list):
+            return jsonify({'error': 'Detections must be an array'}), 400
+        
+        print(f"📝 Batch Q&A Request - {len(questions)} questions, {len(detections)} detections")
+        started = time.monotonic()
+        answers = ask_gemini_batch(questions, detections, fingerprint)
+        print(f"✅ Batch answered in {(time.monotonic() - started) * 1000:.0f}ms")
+        
+        return jsonify({'answers': answers}), 200
+        
+    except Exception as e:
+        print(f"❌ Error in batch Q&A: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+def stream_answer(question: str, detections: List[Dict], fingerprint: Optional[str] = None) -> Response:
+    """Stream the answer to a question as Server-Sent Events"""
+    started = time.monotonic()
+    
+    def generate():
+        chunks = []
+        first_token_ms = None
+        try:
+            for text in stream_gemini(question, detections, fingerprint):
+                if first_token_ms is None:
+                    first_token_ms = round((time.monotonic() - started) * 1000, 1)
+                chunks.append(text)
+                yield f"event: token\ndata: {json.dumps({'text': text})}\n\n"
+        except Exception as e:
+            print(f"❌ Error in streaming Q&A: {str(e)}")
+            yield f"event: error\ndata: {json.dumps({'error': 'Answer generation failed'})}\n\n"
+            return
+        total_ms = round((time.monotonic() - started) * 1000, 1)
+        print(f"✅ Streamed answer: first token {first_token_ms}ms, total {total_ms}ms")
+        done = {'answer': ''.join(chunks), 'firstTokenMs': first_token_ms, 'totalMs': total_ms}
+        yield f"event: done\ndata: {json.dumps(done)}\n\n"
+    
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,181 @@
+"""
+Frame-stream detection route
+Detects objects across video frames and streams results per frame
+"""
+
+from flask import Blueprint, Response, current_app, request, jsonify, stream_with_context
+from io import BytesIO
+from typing import Dict, Iterator, List
+from werkzeug.exceptions import RequestEntityTooLarge
+from werkzeug.wsgi import get_input_stream
+import json
+
+from routes.detect import is_raw_image_type
+from utils.auth import token_required
+from utils.image_input import DecodedImage, ImageTooLargeError, as_bytes
+from utils.postprocess import apply_postprocess, parse_postprocess_options
+from utils.video import (
+    STREAM_DIFF_THRESHOLD, STREAM_MAX_BYTES, STREAM_MAX_FRAMES, STREAM_SAMPLE_EVERY,
+    Frame, iter_encoded_frames, iter_image_frames, iter_mjpeg_frames, process_frames
+)
+from utils.yolo import run_detection
+
+stream_bp = Blueprint('stream', __name__)
+
+# Bodies read incrementally as concatenated JPEG frames
+MJPEG_TYPES = ('image/jpeg', 'video/x-motion-jpeg', 'multipart/x-mixed-replace')
+
+def parse_stream_options(params) -> Dict:
+    """
+    Read frame sampling options from request params
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    try:
+        sample_every = int(params.get('sampleEvery', STREAM_SAMPLE_EVERY))
+        diff_threshold = float(params.get('diffThreshold', STREAM_DIFF_THRESHOLD))
+        max_frames = int(params.get('maxFrames', STREAM_MAX_FRAMES))
+    except (TypeError, ValueError):
+        raise ValueError('sampleEvery and maxFrames must be integers, diffThreshold a number')
+    if sample_every < 1:
+        raise ValueError('sampleEvery must be at least 1')
+    if not 0 <= diff_threshold <= 1:
+        raise ValueError('diffThreshold must be between 0 and 1')
+    if max_frames < 1:
+        raise ValueError('maxFrames must be at least 1')
+    return {
+        'sample_every': sample_every,
+        'diff_threshold': diff_threshold,
+        'max_frames': min(max_frames, STREAM_MAX_FRAMES)
+    }
+
+def frames_from_bytes(data: bytes) -> Iterator[Frame]:
+    """Frames of an in-memory upload: concatenated JPEGs or a multi-frame image"""
+    if data[:2] == b'\xff\xd8':
+        return iter_mjpeg_frames(BytesIO(data), len(data))
+    return iter_image_frames(data)
+
+def open_frame_source() -> Iterator[Frame]:
+    """
+    Pick the frame source for the request body
+
+    Raises:
+        ValueError: If no frames were sent or the content type is unsupported
+    """
+    mimetype = request.mimetype
+    max_frame_bytes = current_app.config.get('MAX_CONTENT_LENGTH')
+
+    if mimetype == 'multipart/form-data':
+        uploads = request.files.getlist('frames')
+        if uploads:
+            return iter_encoded_frames(_read_uploads(uploads))
+        upload = request.files.get('video') or request.files.get('image')
+        if upload is None:
+            raise ValueError('Send frames as "frames" parts or one "video" file')
+        data = upload.read()
+        upload.close()
+        if not data:
+            raise ValueError('Video is required')
+        return frames_from_bytes(data)
+
+    # MJPEG: frames are split off as they arrive, so the body may be far
+    # larger than MAX_CONTENT_LENGTH (which still caps each frame)
+    if mimetype in MJPEG_TYPES:
+        body = get_input_stream(request.environ, max_content_length=STREAM_MAX_BYTES)
+        return iter_mjpeg_frames(body, max_frame_bytes)
+
+    # Multi-frame images have to be complete before they can be decoded
+    if is_raw_image_type(mimetype):
+        with DecodedImage.from_stream(request.stream, max_frame_bytes) as decoded:
+            return frames_from_bytes(as_bytes(decoded.data))
+
+    raise ValueError('Unsupported content type. Send multipart frames, MJPEG or a multi-frame image')
+
+def _read_uploads(uploads) -> Iterator[bytes]:
+    for upload in uploads:
+        data = upload.read()
+        upload.close()
+        if data:
+            yield data
+
+@stream_bp.route('/detect/stream', methods=['POST'])
+@token_required
+def detect_stream():
+    """
+    Detect objects across the frames of a video or camera feed
+
+    Headers:
+        Authorization: Bearer <token>
+        Accept: application/x-ndjson (default) or text/event-stream
+
+    Request body, one of:
+        multipart/form-data: repeated "frames" file parts, or one "video" file
+        image/jpeg, video/x-motion-jpeg, multipart/x-mixed-replace:
+            concatenated JPEG frames (MJPEG), may be sent chunked
+        image/gif, image/tiff, image/webp: a multi-frame image
+
+    Query params:
+        sampleEvery: Only consider every Nth frame (default STREAM_SAMPLE_EVERY)
+        diffThreshold: Minimum change (0-1) before the detector runs again
+        maxFrames: Stop after this many frames
+        minScore, labels, excludeLabels, nmsIou, topK: Result filters, as in
+            /api/detect, applied before tracking
+
+    Returns:
+        One JSON object per frame, then a summary:
+        {"frame": 0, "status": "detected", "diff": 1.0, "detections": [{..., "trackId": 1}]}
+        {"frame": 1, "status": "unchanged", "diff": 0.003, "detections": [...]}
+        {"summary": {"frames": 2, "detected": 1, "unchanged": 1, "unsampled": 0, "error": 0}}
+        
+        A frame the detector fails on is sent as an "error" event:
+        {"frame": 2, "status": "error", "diff": 0.1, "error": "Detection failed"}
+    """
+    try:
+        params = request.args.to_dict()
+        if request.mimetype == 'multipart/form-data':
+            params.update(request.form.to_dict())
+        options = parse_stream_options(params)
+        filters = parse_postprocess_options(params)
+        frames = open_frame_source()
+    except ImageTooLargeError as e:
+        return jsonify({'error': str(e)}), 413
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    except RequestEntityTooLarge:
+        return jsonify({'error': 'Upload exceeds the size limit'}), 413
+    except Exception as e:
+        print(f"Error opening frame stream: {str(e)}")
+        return jsonify({'error': 'Internal server error'}), 500
+
+    use_sse = request.accept_mimetypes.best_match(['application/x-ndjson', 'text/event-stream']) == 'text/event-stream'
+
+    def encode(event: str, payload: Dict) -> str:
+        if use_sse:
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(payload) + '\n'
+
+    def detect_frame(data: bytes) -> List[Dict]:
+        # Raises on detector failure, so no mock boxes reach the tracker
+        return apply_postprocess(run_detection(data), filters)
+
+    def generate():
+        counts = {'frames': 0, 'detected': 0, 'unchanged': 0, 'unsampled': 0, 'error': 0}
+        try:
+            for result in process_frames(frames, detect_frame, **options):
+                counts['frames'] += 1
+                counts[result['status']] += 1
+                yield encode('error' if result['status'] == 'error' else 'frame', result)
+        except (ImageTooLargeError, RequestEntityTooLarge) as e:
+            yield encode('error', {'error': str(e) or 'Stream exceeds the size limit'})
+        except Exception as e:
+            print(f"Error in frame stream detection: {str(e)}")
+            yield encode('error', {'error': 'Could not decode frame stream'})
+        print(f"🎞️ Frame stream: {counts['frames']} frames, {counts['detected']} detector calls")
+        yield encode('summary', {'summary': counts})
+
+    return Response(
+        stream_with_context(generate()),
+        mimetype='text/event-stream' if use_sse else 'application/x-ndjson',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'}
+    )
@@ -0,0 +1,15 @@
+"""
+Shared test setup
+Tests run against the stub detector, with no caches or background threads
+"""
+
+import os
+import sys
+
+# Config is read at import time, so this must happen before any utils import
+os.environ.setdefault('DETECTOR_BACKEND', 'stub')
+os.environ.setdefault('DETECTION_CACHE_ENABLED', 'false')
+os.environ.setdefault('WARMUP_ENABLED', 'false')
+os.environ.setdefault('BREAKER_ENABLED', 'true')
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
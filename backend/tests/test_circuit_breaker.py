@@ -0,0 +1,102 @@
+"""Circuit breaker: closed, open and half-open transitions"""
+
+import pytest
+
+from utils import circuit_breaker
+from utils.circuit_breaker import CLOSED, HALF_OPEN, OPEN, CircuitBreaker, CircuitOpenError
+
+class Clock:
+    """Controllable stand-in for time.monotonic"""
+
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+@pytest.fixture
+def clock(monkeypatch):
+    clock = Clock()
+    monkeypatch.setattr(circuit_breaker.time, 'monotonic', clock)
+    return clock
+
+def make_breaker(**kwargs):
+    options = {'window': 4, 'min_calls': 4, 'failure_rate': 0.5, 'slow_call_seconds': 5,
+               'open_seconds': 30, 'half_open_probes': 1, 'enabled': True}
+    options.update(kwargs)
+    return CircuitBreaker('test', **options)
+
+def call(breaker, ok=True, seconds=0.1):
+    breaker.allow()
+    breaker.record(seconds, ok)
+
+def test_stays_closed_below_failure_rate(clock):
+    breaker = make_breaker()
+    for ok in (True, True, True, False):
+        call(breaker, ok)
+    assert breaker.state == CLOSED
+
+def test_needs_min_calls_before_opening(clock):
+    breaker = make_breaker()
+    for _ in range(3):
+        call(breaker, ok=False)
+    assert breaker.state == CLOSED
+    call(breaker, ok=False)
+    assert breaker.state == OPEN
+
+def test_slow_calls_count_as_failures(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, seconds=6)
+    assert breaker.state == OPEN
+
+def test_open_rejects_with_retry_after(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, ok=False)
+    clock.now += 10
+    with pytest.raises(CircuitOpenError) as raised:
+        breaker.allow()
+    assert raised.value.retry_after == pytest.approx(20)
+    assert breaker.snapshot()['rejected'] == 1
+
+def test_half_open_probe_closes_on_success(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, ok=False)
+    clock.now += 30
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+    # Only half_open_probes calls are let through while probing
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+    breaker.record(0.1, ok=True)
+    assert breaker.state == CLOSED
+    breaker.allow()
+
+def test_half_open_probe_reopens_on_failure(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, ok=False)
+    clock.now += 30
+    call(breaker, ok=False)
+    assert breaker.state == OPEN
+    assert breaker.snapshot()['timesOpened'] == 2
+    with pytest.raises(CircuitOpenError):
+        breaker.allow()
+
+def test_cancel_returns_probe_slot(clock):
+    breaker = make_breaker()
+    for _ in range(4):
+        call(breaker, ok=False)
+    clock.now += 30
+    breaker.allow()
+    breaker.cancel()
+    breaker.allow()
+    assert breaker.state == HALF_OPEN
+
+def test_disabled_breaker_never_opens(clock):
+    breaker = make_breaker(enabled=False)
+    for _ in range(10):
+        call(breaker, ok=False)
+    assert breaker.state == CLOSED
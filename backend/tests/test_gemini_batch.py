@@ -0,0 +1,95 @@
+"""Batched Gemini Q&A: parsing the JSON answers and the fallbacks around it"""
+
+import json
+
+import pytest
+
+from utils import gemini
+from utils.gemini import ask_gemini_batch, parse_batch_answers
+
+DETECTIONS = [
+    {'label': 'person', 'score': 0.9, 'bbox': {'x': 10, 'y': 10, 'width': 100, 'height': 200}},
+    {'label': 'car', 'score': 0.8, 'bbox': {'x': 150, 'y': 40, 'width': 200, 'height': 100}}
+]
+# Open-ended, so the local query engine leaves them to the model
+QUESTIONS = ['What color is the car?', 'Is the person smiling?', 'What is the weather like?']
+
+def test_parse_answers_object():
+    text = json.dumps({'answers': [{'id': 2, 'answer': ' Red. '}, {'id': 1, 'answer': 'Yes.'}]})
+    assert parse_batch_answers(text, 2) == {1: 'Yes.', 2: 'Red.'}
+
+def test_parse_bare_list_in_code_fence():
+    text = '```json\n["Red.", "Yes."]\n```'
+    assert parse_batch_answers(text, 2) == {1: 'Red.', 2: 'Yes.'}
+
+def test_parse_skips_unusable_items():
+    text = json.dumps({'answers': [
+        {'id': 1, 'answer': 'Red.'},
+        {'id': 7, 'answer': 'Out of range.'},
+        {'id': 'two', 'answer': 'Bad id.'},
+        {'id': 3, 'answer': '   '},
+        {'id': 2}
+    ]})
+    assert parse_batch_answers(text, 3) == {1: 'Red.'}
+
+@pytest.mark.parametrize('text', ['not json', '{"text": "Red."}', '"Red."'])
+def test_parse_rejects_responses_without_answers(text):
+    with pytest.raises(ValueError):
+        parse_batch_answers(text, 2)
+
+@pytest.fixture
+def model(monkeypatch):
+    """Stand-in for Gemini: records prompts and answers from a queue of replies"""
+    monkeypatch.setattr(gemini, 'GOOGLE_GEMINI_API_KEY', 'test-key')
+    monkeypatch.setattr(gemini, 'answer_cache', gemini.AnswerCache(enabled=False))
+    prompts, replies = [], []
+
+    def generate_text(prompt, **kwargs):
+        prompts.append(prompt)
+        reply = replies.pop(0)
+        if isinstance(reply, Exception):
+            raise reply
+        return reply
+
+    monkeypatch.setattr(gemini, 'generate_text', generate_text)
+    return prompts, replies
+
+def test_batch_answers_in_one_call(model):
+    prompts, replies = model
+    replies.append(json.dumps({'answers': [{'id': n, 'answer': f'Answer {n}.'} for n in (1, 2, 3)]}))
+    results = ask_gemini_batch(QUESTIONS, DETECTIONS)
+    assert len(prompts) == 1
+    assert [r['answer'] for r in results] == ['Answer 1.', 'Answer 2.', 'Answer 3.']
+    assert {r['source'] for r in results} == {'batch'}
+
+def test_missing_answers_are_asked_again_singly(model):
+    prompts, replies = model
+    replies += [json.dumps({'answers': [{'id': 1, 'answer': 'Red.'}, {'id': 3, 'answer': 'Sunny.'}]}), 'Yes.']
+    results = ask_gemini_batch(QUESTIONS, DETECTIONS)
+    assert len(prompts) == 2
+    assert [(r['answer'], r['source']) for r in results] == [('Red.', 'batch'), ('Yes.', 'single'), ('Sunny.', 'batch')]
+
+def test_unparseable_batch_falls_back_to_single_questions(model):
+    prompts, replies = model
+    replies += ['Sorry, I cannot answer in JSON.', 'Red.', 'Yes.', 'Sunny.']
+    results = ask_gemini_batch(QUESTIONS, DETECTIONS)
+    assert len(prompts) == 4
+    assert [r['source'] for r in results] == ['single'] * 3
+
+def test_failed_batch_call_falls_back_without_retrying(model):
+    prompts, replies = model
+    replies.append(RuntimeError('upstream error'))
+    results = ask_gemini_batch(QUESTIONS, DETECTIONS)
+    assert len(prompts) == 1
+    assert [r['source'] for r in results] == ['fallback'] * 3
+    assert all(r['answer'] for r in results)
+
+def test_local_and_repeated_questions_skip_the_model(model):
+    prompts, replies = model
+    replies.append(json.dumps({'answers': ['Red.', 'Yes.']}))
+    questions = ['How many people are there?', 'What color is the car?', 'what color is the car',
+                 'Is the person smiling?']
+    results = ask_gemini_batch(questions, DETECTIONS)
+    assert len(prompts) == 1
+    assert [r['source'] for r in results] == ['local', 'batch', 'batch', 'batch']
+    assert results[1]['answer'] == results[2]['answer'] == 'Red.'
@@ -0,0 +1,72 @@
+"""Local Q&A: intent parsing and the answers built from it"""
+
+import pytest
+
+from utils.query_engine import DetectionIndex, answer_locally, parse_question
+
+DETECTIONS = [
+    {'label': 'person', 'score': 0.95, 'bbox': {'x': 10, 'y': 10, 'width': 100, 'height': 200}},
+    {'label': 'person', 'score': 0.55, 'bbox': {'x': 500, 'y': 400, 'width': 80, 'height': 150}},
+    {'label': 'car', 'score': 0.80, 'bbox': {'x': 115, 'y': 20, 'width': 200, 'height': 100}},
+    {'label': 'dog', 'score': 0.40, 'bbox': {'x': 520, 'y': 420, 'width': 40, 'height': 30}}
+]
+
+@pytest.fixture
+def index():
+    return DetectionIndex(DETECTIONS)
+
+@pytest.mark.parametrize('question, intent, label', [
+    ('How many people are there?', 'count', 'person'),
+    ('Is there a giraffe?', 'presence', 'giraffe'),
+    ('Which object has the highest confidence?', 'highest', None),
+    ('What is the lowest confidence person?', 'lowest', 'person'),
+    ('What is the largest object?', 'largest', None),
+    ('Where is the car?', 'location', 'car'),
+    ('What objects are in the image?', 'list', None)
+])
+def test_parse_intent_and_label(index, question, intent, label):
+    query = parse_question(question, index)
+    assert (query.intent, query.label, query.residual) == (intent, label, [])
+
+def test_parse_threshold(index):
+    query = parse_question('How many objects have confidence above 50%?', index)
+    assert query.intent == 'count_threshold'
+    assert (query.op, query.threshold) == ('>', 0.5)
+
+    query = parse_question('How many cars are at least 0.75 confidence?', index)
+    assert (query.label, query.op, query.threshold) == ('car', '>=', 0.75)
+
+def test_parse_region(index):
+    query = parse_question('How many objects are in the top-left?', index)
+    assert (query.intent, query.region) == ('count', 'top-left')
+
+def test_parse_spatial_reference(index):
+    query = parse_question('What is next to the person?', index)
+    assert (query.intent, query.label, query.reference) == ('near', None, 'person')
+
+def test_unaccounted_words_are_left_over(index):
+    query = parse_question('How many people are wearing hats?', index)
+    assert query.residual == ['wearing', 'hats']
+
+def test_declines_questions_it_cannot_answer():
+    assert answer_locally('How many people are wearing hats?', DETECTIONS) is None
+    assert answer_locally('What is the weather like?', DETECTIONS) is None
+
+def test_count_answers_agree_in_number():
+    assert answer_locally('How many people are there?', DETECTIONS) == 'There are 2 people in the image.'
+    assert answer_locally('How many dogs are there?', DETECTIONS) == 'There is 1 dog in the image.'
+    single = DETECTIONS[2:3]
+    assert answer_locally('How many objects are there?', single) == 'I can see 1 object in the image: car.'
+    assert answer_locally('How many objects have confidence above 50%?', single).startswith('There is 1 object ')
+
+def test_threshold_count():
+    answer = answer_locally('How many objects have confidence above 50%?', DETECTIONS)
+    assert answer.startswith('There are 3 objects detected with confidence above 50%')
+
+def test_presence():
+    assert answer_locally('Is there a giraffe?', DETECTIONS) == 'No, no giraffe was detected in the image.'
+    assert answer_locally('Is there a dog?', DETECTIONS).startswith('Yes, I can see 1 dog.')
+
+def test_region_scope():
+    answer = answer_locally('How many objects are in the top-left?', DETECTIONS)
+    assert answer == 'I can see 2 objects in the top-left of the image: person and car.'
@@ -0,0 +1,78 @@
+"""Tiled inference: seam detection, merging across tiles and failed tiles"""
+
+import pytest
+from PIL import Image
+
+from utils.detectors import DetectorError
+from utils.tiling import at_seam, detect_tiles, merge_tile_detections, tile_grid
+
+OPTIONS = {'tile_size': 100, 'overlap': 0.2, 'parallelism': 2}
+
+def box(label, score, x, y, width, height):
+    return {'label': label, 'score': score, 'bbox': {'x': x, 'y': y, 'width': width, 'height': height}}
+
+def test_tile_grid_covers_image_with_full_tiles():
+    tiles = tile_grid(250, 100, 100, 0.2)
+    assert tiles[0] == (0, 0, 100, 100)
+    assert tiles[-1] == (150, 0, 250, 100)
+    assert all(right - left == 100 for left, _, right, _ in tiles)
+
+def test_at_seam_ignores_image_edges():
+    tile = (0, 0, 100, 100)
+    # Touches the right edge of a tile that is not at the right of the image
+    assert at_seam({'x': 60, 'y': 20, 'width': 40, 'height': 20}, tile, 300, 100)
+    # Same box, but that edge is the image edge
+    assert not at_seam({'x': 60, 'y': 20, 'width': 40, 'height': 20}, tile, 100, 100)
+    assert not at_seam({'x': 30, 'y': 30, 'width': 20, 'height': 20}, tile, 300, 300)
+
+def test_merge_drops_iou_duplicates():
+    detections = [box('car', 0.9, 0, 0, 100, 100), box('car', 0.8, 5, 5, 100, 100)]
+    merged = merge_tile_detections(detections, [0, 1], [False, False])
+    assert merged == detections[:1]
+
+def test_merge_joins_object_cut_by_seam():
+    # The whole-image pass sees the car; a tile sees the half left of its edge
+    whole = box('car', 0.9, 60, 10, 80, 40)
+    half = box('car', 0.7, 60, 10, 40, 40)
+    assert merge_tile_detections([whole, half], [0, 1], [False, True]) == [whole]
+
+def test_merge_keeps_small_object_inside_larger_box():
+    # Same label, fully contained, but no seam explains the overlap
+    crowd = box('person', 0.9, 0, 0, 200, 200)
+    child = box('person', 0.6, 50, 50, 30, 60)
+    assert merge_tile_detections([crowd, child], [0, 1], [False, False]) == [crowd, child]
+    assert merge_tile_detections([crowd, child], [0, 0], [True, True]) == [crowd, child]
+
+def test_merge_is_per_label():
+    detections = [box('car', 0.9, 0, 0, 100, 100), box('truck', 0.8, 0, 0, 100, 100)]
+    assert merge_tile_detections(detections, [0, 1], [False, False]) == detections
+
+def test_detect_tiles_maps_boxes_to_image_coordinates():
+    image = Image.new('RGB', (250, 100))
+
+    def detect(data):
+        return [box('dot', 0.9, 40, 40, 10, 10)]
+
+    result = detect_tiles(image, OPTIONS, detect)
+    assert result.failed == 0 and not result.partial
+    assert sorted(d['bbox']['x'] for d in result.detections) == [40, 120, 190]
+
+def test_detect_tiles_reports_failed_passes():
+    image = Image.new('RGB', (250, 100))
+    calls = []
+
+    def detect(data):
+        calls.append(data)
+        if len(calls) == 2:
+            raise DetectorError('upstream error')
+        return []
+
+    result = detect_tiles(image, OPTIONS, detect, full_image_data=b'full')
+    assert (result.failed, result.passes, result.partial) == (1, 4, True)
+
+def test_detect_tiles_raises_when_every_tile_fails():
+    def detect(data):
+        raise DetectorError('upstream error')
+
+    with pytest.raises(DetectorError):
+        detect_tiles(Image.new('RGB', (250, 100)), OPTIONS, detect)
@@ -0,0 +1,96 @@
+"""
+Annotated image options
+Request option parsing and the short-lived store behind lazy annotation
+"""
+
+import json
+import os
+import uuid
+from typing import Dict, List, Mapping, Optional, Tuple
+
+from utils.cache import DETECTION_CACHE_DIR, DiskCache
+from utils.yolo import ANNOTATION_FORMATS
+
+ANNOTATION_TTL = int(os.getenv('ANNOTATION_TTL', 60 * 60))  # seconds
+ANNOTATION_STORE_MAX_MB = int(os.getenv('ANNOTATION_STORE_MAX_MB', 512))
+ANNOTATION_DEFAULT_QUALITY = 85
+
+ANNOTATE_MODES = ('full', 'none', 'lazy')
+
+# Shared by all workers so the follow-up request can land anywhere
+annotation_store = DiskCache(
+    os.path.join(DETECTION_CACHE_DIR, 'annotations'),
+    ttl=ANNOTATION_TTL,
+    max_bytes=ANNOTATION_STORE_MAX_MB * 1024 * 1024
+)
+
+def parse_annotation_options(params: Mapping) -> Dict:
+    """
+    Read annotation options from request params
+
+    Args:
+        params: JSON body, form fields or query args with optional
+            annotate (full | none | lazy), format (png | jpeg | webp),
+            quality (1-100) and maxSide (pixels)
+
+    Returns:
+        {"mode", "format", "quality", "max_side"}
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    mode = str(params.get('annotate', 'full')).lower()
+    if mode in ('false', '0'):
+        mode = 'none'
+    if mode not in ANNOTATE_MODES:
+        raise ValueError(f"annotate must be one of: {', '.join(ANNOTATE_MODES)}")
+
+    fmt = str(params.get('format', 'png')).lower()
+    if fmt == 'jpg':
+        fmt = 'jpeg'
+    if fmt not in ANNOTATION_FORMATS:
+        raise ValueError(f"format must be one of: {', '.join(ANNOTATION_FORMATS)}")
+
+    try:
+        quality = int(params.get('quality', ANNOTATION_DEFAULT_QUALITY))
+        max_side = params.get('maxSide')
+        max_side = int(max_side) if max_side not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('quality and maxSide must be integers')
+    if not 1 <= quality <= 100:
+        raise ValueError('quality must be between 1 and 100')
+    if max_side is not None and max_side < 16:
+        raise ValueError('maxSide must be at least 16 pixels')
+
+    return {'mode': mode, 'format': fmt, 'quality': quality, 'max_side': max_side}
+
+def store_for_annotation(user_id: str, image_data: bytes, detections: List[Dict]) -> str:
+    """
+    Keep an image and its detections so it can be annotated on request
+
+    Returns:
+        Token for GET /api/detect/annotations/<token>
+    """
+    token = uuid.uuid4().hex
+    meta = {'userId': user_id, 'detections': detections}
+    annotation_store.set(f"{token}-meta", json.dumps(meta).encode('utf-8'))
+    annotation_store.set(f"{token}-image", image_data)
+    return token
+
+def load_for_annotation(token: str, user_id: str) -> Optional[Tuple[bytes, List[Dict]]]:
+    """
+    Fetch a stored image and detections for the owning user
+
+    Returns:
+        (image bytes, detections), or None if missing, expired or not owned
+    """
+    if not token.isalnum():
+        return None
+    meta = annotation_store.get(f"{token}-meta")
+    image_data = annotation_store.get(f"{token}-image")
+    if meta is None or image_data is None:
+        return None
+    meta = json.loads(meta)
+    if meta.get('userId') != user_id:
+        return None
+    return image_data, meta.get('detections', [])
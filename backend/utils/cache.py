@@ -0,0 +1,272 @@
+"""
+Detection result cache
+Content-addressed two-tier cache: in-process LRU backed by an on-disk
+tier that is shared by every gunicorn worker on the host
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Union
+
+DETECTION_CACHE_ENABLED = os.getenv('DETECTION_CACHE_ENABLED', 'true').lower() == 'true'
+DETECTION_CACHE_DIR = os.getenv(
+    'DETECTION_CACHE_DIR',
+    os.path.join(tempfile.gettempdir(), 'ai_vision_cache')
+)
+DETECTION_CACHE_TTL = int(os.getenv('DETECTION_CACHE_TTL', 24 * 60 * 60))  # seconds
+DETECTION_CACHE_MEMORY_ITEMS = int(os.getenv('DETECTION_CACHE_MEMORY_ITEMS', 256))
+DETECTION_CACHE_DISK_MAX_MB = int(os.getenv('DETECTION_CACHE_DISK_MAX_MB', 256))
+
+# Run a disk sweep (expiry + size eviction) every N writes
+DISK_SWEEP_INTERVAL = 50
+
+def make_cache_key(*parts: Union[bytes, bytearray, memoryview, str]) -> str:
+    """
+    Build a content-addressed cache key
+
+    Args:
+        parts: Byte buffers or strings that identify the cached value
+
+    Returns:
+        Hex SHA-256 digest of all parts
+    """
+    digest = hashlib.sha256()
+    for part in parts:
+        if isinstance(part, str):
+            part = part.encode('utf-8')
+        digest.update(len(part).to_bytes(8, 'big'))
+        digest.update(part)
+    return digest.hexdigest()
+
+class LRUCache:
+    """Thread-safe in-process LRU cache with per-entry TTL"""
+
+    def __init__(self, max_items: int, ttl: float):
+        self.max_items = max_items
+        self.ttl = ttl
+        self._items = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[Any]:
+        with self._lock:
+            entry = self._items.get(key)
+            if entry is None:
+                return None
+            expires_at, value = entry
+            if expires_at < time.time():
+                del self._items[key]
+                return None
+            self._items.move_to_end(key)
+            return value
+
+    def set(self, key: str, value: Any):
+        if self.max_items <= 0:
+            return
+        with self._lock:
+            self._items[key] = (time.time() + self.ttl, value)
+            self._items.move_to_end(key)
+            while len(self._items) > self.max_items:
+                self._items.popitem(last=False)
+
+    def delete(self, key: str):
+        with self._lock:
+            self._items.pop(key, None)
+
+    def clear(self):
+        with self._lock:
+            self._items.clear()
+
+    def __len__(self) -> int:
+        return len(self._items)
+
+class DiskCache:
+    """
+    File-per-entry cache directory shared between processes
+
+    Writes go to a temp file and are renamed into place, so readers in
+    other workers never see a partial entry. Expiry uses the file mtime;
+    size eviction removes the oldest entries first.
+    """
+
+    def __init__(self, directory: str, ttl: float, max_bytes: int):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._writes = 0
+        self._lock = threading.Lock()
+
+    def _path(self, key: str) -> str:
+        return os.path.join(self.directory, key[:2], key)
+
+    def get(self, key: str) -> Optional[bytes]:
+        path = self._path(key)
+        try:
+            if os.path.getmtime(path) + self.ttl < time.time():
+                self._remove(path)
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except OSError:
+            return None
+
+    def set(self, key: str, value: bytes):
+        path = self._path(key)
+        try:
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), suffix='.tmp')
+            with os.fdopen(fd, 'wb') as f:
+                f.write(value)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            print(f"⚠️ Disk cache write failed: {str(e)}")
+            return
+
+        with self._lock:
+            self._writes += 1
+            should_sweep = self._writes % DISK_SWEEP_INTERVAL == 0
+        if should_sweep:
+            self.sweep()
+
+    def delete(self, key: str):
+        self._remove(self._path(key))
+
+    def sweep(self):
+        """Drop expired entries, then the oldest ones until under the size cap"""
+        now = time.time()
+        entries = []
+        total = 0
+        try:
+            shards = list(os.scandir(self.directory))
+        except OSError:
+            return
+        for shard in shards:
+            if not shard.is_dir():
+                continue
+            try:
+                files = list(os.scandir(shard.path))
+            except OSError:
+                continue
+            for entry in files:
+                try:
+                    stat = entry.stat()
+                except OSError:
+                    continue
+                if entry.name.endswith('.tmp'):
+                    # Leftover from a crashed writer
+                    if stat.st_mtime + 60 < now:
+                        self._remove(entry.path)
+                    continue
+                if stat.st_mtime + self.ttl < now:
+                    self._remove(entry.path)
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, entry.path))
+                total += stat.st_size
+
+        if total <= self.max_bytes:
+            return
+        # Evict down to 90% of the cap so we don't sweep on every write
+        target = int(self.max_bytes * 0.9)
+        for _, size, path in sorted(entries):
+            if total <= target:
+                break
+            self._remove(path)
+            total -= size
+
+    @staticmethod
+    def _remove(path: str):
+        try:
+            os.remove(path)
+        except OSError:
+            pass
+
+class TwoTierCache:
+    """
+    JSON value cache with an in-process LRU tier in front of a shared disk tier
+
+    Values are stored serialized in both tiers, so every hit hands back a
+    fresh copy that callers are free to mutate.
+    """
+
+    def __init__(self, name: str, directory: str, ttl: float, memory_items: int,
+                 disk_max_bytes: int, enabled: bool = True):
+        self.name = name
+        self.enabled = enabled
+        self.memory = LRUCache(memory_items, ttl)
+        self.disk = DiskCache(directory, ttl, disk_max_bytes)
+        self._stats = {'memoryHits': 0, 'diskHits': 0, 'misses': 0, 'writes': 0}
+        self._stats_lock = threading.Lock()
+
+    def _count(self, counter: str):
+        with self._stats_lock:
+            self._stats[counter] += 1
+
+    def get(self, key: str, record_stats: bool = True) -> Optional[Any]:
+        """
+        Look up a value
+
+        Args:
+            key: Cache key
+            record_stats: Count this lookup in the hit/miss counters; off for
+                secondary lookups (e.g. near-duplicates) that report their own
+        """
+        if not self.enabled:
+            return None
+
+        payload = self.memory.get(key)
+        if payload is not None:
+            if record_stats:
+                self._count('memoryHits')
+            return json.loads(payload)
+
+        payload = self.disk.get(key)
+        if payload is not None:
+            try:
+                value = json.loads(payload)
+            except ValueError:
+                self.disk.delete(key)
+            else:
+                self.memory.set(key, payload)
+                if record_stats:
+                    self._count('diskHits')
+                return value
+
+        if record_stats:
+            self._count('misses')
+        return None
+
+    def set(self, key: str, value: Any):
+        if not self.enabled:
+            return
+        payload = json.dumps(value, separators=(',', ':')).encode('utf-8')
+        self.memory.set(key, payload)
+        self.disk.set(key, payload)
+        self._count('writes')
+
+    def delete(self, key: str):
+        self.memory.delete(key)
+        self.disk.delete(key)
+
+    def stats(self) -> Dict:
+        """Hit/miss counters for this worker process"""
+        with self._stats_lock:
+            stats = dict(self._stats)
+        lookups = stats['memoryHits'] + stats['diskHits'] + stats['misses']
+        hits = stats['memoryHits'] + stats['diskHits']
+        stats['hitRate'] = round(hits / lookups, 4) if lookups else 0.0
+        stats['memoryItems'] = len(self.memory)
+        stats['enabled'] = self.enabled
+        return stats
+
+detection_cache = TwoTierCache(
+    'detections',
+    directory=os.path.join(DETECTION_CACHE_DIR, 'detections'),
+    ttl=DETECTION_CACHE_TTL,
+    memory_items=DETECTION_CACHE_MEMORY_ITEMS,
+    disk_max_bytes=DETECTION_CACHE_DISK_MAX_MB * 1024 * 1024,
+    enabled=DETECTION_CACHE_ENABLED
+)
@@ -0,0 +1,153 @@
+"""
+Circuit breakers for upstream services
+Fail fast while an upstream is down or too slow, and probe for recovery
+"""
+
+import os
+import threading
+import time
+from collections import deque
+from typing import Dict
+
+BREAKER_ENABLED = os.getenv('BREAKER_ENABLED', 'true').lower() == 'true'
+BREAKER_WINDOW = int(os.getenv('BREAKER_WINDOW', 20))  # recent calls considered
+BREAKER_MIN_CALLS = int(os.getenv('BREAKER_MIN_CALLS', 5))
+BREAKER_FAILURE_RATE = float(os.getenv('BREAKER_FAILURE_RATE', 0.5))
+# Calls slower than this count as failures even when they succeed
+BREAKER_SLOW_CALL_SECONDS = float(os.getenv('BREAKER_SLOW_CALL_SECONDS', 10))
+BREAKER_OPEN_SECONDS = float(os.getenv('BREAKER_OPEN_SECONDS', 30))
+BREAKER_HALF_OPEN_PROBES = int(os.getenv('BREAKER_HALF_OPEN_PROBES', 1))
+
+CLOSED, OPEN, HALF_OPEN = 'closed', 'open', 'half_open'
+
+class CircuitOpenError(Exception):
+    """Raised instead of calling an upstream whose breaker is open"""
+
+    def __init__(self, message: str, retry_after: float = 0.0):
+        super().__init__(message)
+        self.retry_after = retry_after  # seconds until the breaker probes again
+
+class CircuitBreaker:
+    """
+    Rolling-window circuit breaker
+
+    Closed: calls go through; once at least min_calls of the last window
+    calls are recorded and the failure (or slow-call) rate reaches
+    failure_rate, the breaker opens. Open: calls fail immediately with
+    CircuitOpenError for open_seconds. Half-open: up to half_open_probes
+    calls are let through; a successful probe closes the breaker, a failed
+    one opens it again.
+    """
+
+    def __init__(self, name: str, window: int = BREAKER_WINDOW, min_calls: int = BREAKER_MIN_CALLS,
+                 failure_rate: float = BREAKER_FAILURE_RATE,
+                 slow_call_seconds: float = BREAKER_SLOW_CALL_SECONDS,
+                 open_seconds: float = BREAKER_OPEN_SECONDS,
+                 half_open_probes: int = BREAKER_HALF_OPEN_PROBES,
+                 enabled: bool = BREAKER_ENABLED):
+        self.name = name
+        self.min_calls = min_calls
+        self.failure_rate = failure_rate
+        self.slow_call_seconds = slow_call_seconds
+        self.open_seconds = open_seconds
+        self.half_open_probes = half_open_probes
+        self.enabled = enabled
+        self.state = CLOSED
+        self._outcomes = deque(maxlen=window)  # True = failed or slow
+        self._opened_at = 0.0
+        self._probes = 0
+        self._rejected = 0
+        self._times_opened = 0
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """
+        Reserve a call slot
+
+        Raises:
+            CircuitOpenError: If the breaker is open, or half-open with all
+                probe slots taken
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            if self.state == OPEN and time.monotonic() - self._opened_at >= self.open_seconds:
+                self.state = HALF_OPEN
+                self._probes = 0
+                print(f"🟡 Circuit {self.name} half-open, probing upstream")
+            if self.state == CLOSED:
+                return
+            if self.state == HALF_OPEN and self._probes < self.half_open_probes:
+                self._probes += 1
+                return
+            self._rejected += 1
+            retry_in = max(0.0, self.open_seconds - (time.monotonic() - self._opened_at))
+        raise CircuitOpenError(f"Circuit for {self.name} is open (retry in {retry_in:.0f}s)", retry_in)
+
+    def record(self, seconds: float, ok: bool):
+        """Record the outcome of a call that allow() let through"""
+        if not self.enabled:
+            return
+        failed = not ok or seconds >= self.slow_call_seconds
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+                if failed:
+                    self._open()
+                else:
+                    self.state = CLOSED
+                    self._outcomes.clear()
+                    print(f"🟢 Circuit {self.name} closed, upstream recovered")
+                return
+            if self.state == OPEN:
+                return
+            self._outcomes.append(failed)
+            if len(self._outcomes) >= self.min_calls:
+                rate = sum(self._outcomes) / len(self._outcomes)
+                if rate >= self.failure_rate:
+                    self._open()
+
+    def cancel(self):
+        """Give back a slot from allow() when the call was never made"""
+        with self._lock:
+            if self.state == HALF_OPEN:
+                self._probes = max(0, self._probes - 1)
+
+    def _open(self):
+        self.state = OPEN
+        self._opened_at = time.monotonic()
+        self._times_opened += 1
+        self._outcomes.clear()
+        print(f"🔴 Circuit {self.name} opened for {self.open_seconds:.0f}s")
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            snapshot = {
+                'state': self.state,
+                'recentCalls': len(self._outcomes),
+                'recentFailures': sum(self._outcomes),
+                'rejected': self._rejected,
+                'timesOpened': self._times_opened,
+                'enabled': self.enabled
+            }
+            if self.state == OPEN:
+                remaining = self.open_seconds - (time.monotonic() - self._opened_at)
+                snapshot['retryInSeconds'] = round(max(0.0, remaining), 1)
+        return snapshot
+
+_breakers: Dict[str, CircuitBreaker] = {}
+_breakers_lock = threading.Lock()
+
+def get_breaker(name: str) -> CircuitBreaker:
+    """Get (or create) the circuit breaker for an upstream"""
+    with _breakers_lock:
+        breaker = _breakers.get(name)
+        if breaker is None:
+            breaker = _breakers[name] = CircuitBreaker(name)
+        return breaker
+
+def breaker_states() -> Dict[str, Dict]:
+    """Breaker state for every upstream seen by this worker"""
+    with _breakers_lock:
+        names = list(_breakers)
+    return {name: get_breaker(name).snapshot() for name in names}
@@ -34,6 +34,40 @@ class User(db.Model):
             'createdAt': self.created_at.isoformat() if self.created_at else None
         }
 
+class DetectionJob(db.Model):
+    """Queued detection job, processed by background workers"""
+    __tablename__ = 'detection_jobs'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), nullable=False, index=True)
+    status = db.Column(db.String(16), nullable=False, default='queued', index=True)  # queued | running | done | failed
+    priority = db.Column(db.Integer, nullable=False, default=0)  # lower runs first
+    image = db.Column(db.LargeBinary, nullable=True)  # cleared once the job finishes
+    result = db.Column(db.Text, nullable=True)  # JSON-encoded detections
+    error = db.Column(db.Text, nullable=True)
+    attempts = db.Column(db.Integer, nullable=False, default=0)
+    lease_expires_at = db.Column(db.DateTime, nullable=True)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow, index=True)
+    started_at = db.Column(db.DateTime, nullable=True)
+    finished_at = db.Column(db.DateTime, nullable=True)
+    
+    def __repr__(self):
+        return f'<DetectionJob {self.id} {self.status}>'
+
+class DetectionSession(db.Model):
+    """Stored detection result that Q&A requests refer to by ID"""
+    __tablename__ = 'detection_sessions'
+    
+    id = db.Column(db.String(36), primary_key=True, default=lambda: str(uuid.uuid4()))
+    user_id = db.Column(db.String(36), nullable=False, index=True)
+    detections = db.Column(db.Text, nullable=False)  # JSON-encoded detections
+    fingerprint = db.Column(db.String(64), nullable=False)
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+    
+    def __repr__(self):
+        return f'<DetectionSession {self.id}>'
+
 def init_db(app):
     """
     Initialize database with Flask app
@@ -0,0 +1,367 @@
+"""
+Object detector backends
+Remote Hugging Face inference, in-process ONNX inference on CPU, and a
+deterministic stub, selected with DETECTOR_BACKEND
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+from typing import Dict, List, Optional, Union
+
+from PIL import Image
+
+from utils.http_client import get_client
+from utils.image_input import as_bytes
+from utils.postprocess import nms
+
+DETECTOR_BACKEND = os.getenv('DETECTOR_BACKEND', 'huggingface')  # huggingface | local | stub
+# Heavier second-stage backend for uncertain results; empty = no cascade
+CASCADE_BACKEND = os.getenv('CASCADE_BACKEND', '')
+# Hugging Face model id or ONNX path for the cascade backend
+CASCADE_MODEL = os.getenv('CASCADE_MODEL', '')
+# Seconds before a cascade backend that failed to load is tried again
+CASCADE_RETRY_SECONDS = float(os.getenv('CASCADE_RETRY_SECONDS', 60))
+
+HUGGINGFACE_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
+HUGGINGFACE_MODEL_ID = os.getenv('HUGGINGFACE_MODEL_ID', 'hustvl/yolos-tiny')
+
+LOCAL_MODEL_PATH = os.getenv('LOCAL_MODEL_PATH', 'models/yolov8n.onnx')
+LOCAL_MODEL_INPUT_SIZE = int(os.getenv('LOCAL_MODEL_INPUT_SIZE', 640))
+LOCAL_MODEL_SCORE_THRESHOLD = float(os.getenv('LOCAL_MODEL_SCORE_THRESHOLD', 0.25))
+LOCAL_MODEL_IOU_THRESHOLD = float(os.getenv('LOCAL_MODEL_IOU_THRESHOLD', 0.45))
+LOCAL_MODEL_THREADS = int(os.getenv('LOCAL_MODEL_THREADS', 0))  # 0 = onnxruntime default
+
+# Class names for COCO-trained YOLO exports without embedded metadata
+COCO_LABELS = [
+    'person', 'bicycle', 'car', 'motorcycle', 'airplane', 'bus', 'train', 'truck', 'boat',
+    'traffic light', 'fire hydrant', 'stop sign', 'parking meter', 'bench', 'bird', 'cat',
+    'dog', 'horse', 'sheep', 'cow', 'elephant', 'bear', 'zebra', 'giraffe', 'backpack',
+    'umbrella', 'handbag', 'tie', 'suitcase', 'frisbee', 'skis', 'snowboard', 'sports ball',
+    'kite', 'baseball bat', 'baseball glove', 'skateboard', 'surfboard', 'tennis racket',
+    'bottle', 'wine glass', 'cup', 'fork', 'knife', 'spoon', 'bowl', 'banana', 'apple',
+    'sandwich', 'orange', 'broccoli', 'carrot', 'hot dog', 'pizza', 'donut', 'cake', 'chair',
+    'couch', 'potted plant', 'bed', 'dining table', 'toilet', 'tv', 'laptop', 'mouse',
+    'remote', 'keyboard', 'cell phone', 'microwave', 'oven', 'toaster', 'sink',
+    'refrigerator', 'book', 'clock', 'vase', 'scissors', 'teddy bear', 'hair drier',
+    'toothbrush'
+]
+
+class DetectorError(Exception):
+    """Raised when a detector backend cannot produce detections"""
+
+class ModelLoadingError(DetectorError):
+    """Raised while a remote model is still being loaded (cold start)"""
+
+class Detector:
+    """
+    Base class for detector backends
+
+    Backends take encoded image bytes (or a memoryview over them) and
+    return detections in the API format:
+    {"label", "score", "bbox": {"x", "y", "width", "height"}}.
+    """
+
+    name = 'base'
+    model_id = ''
+
+    def load(self):
+        """Prepare per-process resources; called once per worker after fork"""
+
+    def detect(self, image_data: Union[bytes, memoryview], deadline: Optional[float] = None) -> List[Dict]:
+        """
+        Detect objects in encoded image bytes
+
+        Args:
+            image_data: Encoded image
+            deadline: time.monotonic() value remote backends must answer by
+        """
+        raise NotImplementedError
+
+class HuggingFaceDetector(Detector):
+    """Remote inference through the Hugging Face Inference API"""
+
+    name = 'huggingface'
+
+    def __init__(self, model_id: str = HUGGINGFACE_MODEL_ID):
+        self.model_id = model_id
+        self.api_url = f"https://api-inference.huggingface.co/models/{model_id}"
+        # Other models get their own pool, stats and circuit breaker
+        self.upstream = 'huggingface' if model_id == HUGGINGFACE_MODEL_ID else f"huggingface:{model_id}"
+
+    def detect(self, image_data: Union[bytes, memoryview], deadline: Optional[float] = None) -> List[Dict]:
+        # Call Hugging Face API with or without key
+        headers = {}
+        if HUGGINGFACE_API_KEY:
+            headers["Authorization"] = f"Bearer {HUGGINGFACE_API_KEY}"
+            print(f"✅ Using API key: {HUGGINGFACE_API_KEY[:10]}...")
+        else:
+            print("⚠️ No API key, trying public inference...")
+        response = get_client(self.upstream).post(
+            self.api_url,
+            headers=headers,
+            data=as_bytes(image_data),
+            deadline=deadline
+        )
+
+        if response.status_code != 200:
+            error_msg = f"⚠️ Hugging Face API error: {response.status_code}"
+            try:
+                error_detail = response.json()
+                print(f"{error_msg} - {error_detail}")
+            except ValueError:
+                print(f"{error_msg} - {response.text[:200]}")
+
+            if response.status_code == 401:
+                print("❌ Authentication failed! Check your HUGGINGFACE_API_KEY")
+            elif response.status_code == 503:
+                print("⏳ Model is loading, please wait and try again...")
+                raise ModelLoadingError(f"Hugging Face model {self.model_id} is loading")
+
+            raise DetectorError(f"Hugging Face API returned {response.status_code}")
+
+        # Parse response
+        detections = response.json()
+
+        # Debug: Print raw API response
+        print(f"🔍 Raw API response: {detections}")
+
+        # Format detections
+        formatted_detections = []
+        for detection in detections:
+            # Get label with better fallback
+            label = detection.get('label', 'Unknown')
+            if label == 'Unknown' or not label:
+                print(f"⚠️ Detection missing label: {detection}")
+
+            box = detection.get('box') or {}
+            xmin, ymin = box.get('xmin', 0), box.get('ymin', 0)
+            formatted_detections.append({
+                'label': label,
+                'score': detection.get('score', 0.0),
+                'bbox': {
+                    'x': xmin,
+                    'y': ymin,
+                    'width': box.get('xmax', 0) - xmin,
+                    'height': box.get('ymax', 0) - ymin
+                }
+            })
+
+        return formatted_detections
+
+class LocalOnnxDetector(Detector):
+    """
+    In-process CPU inference on an exported YOLO ONNX model
+
+    Expects the standard YOLOv8 export layout: one input of shape
+    (1, 3, S, S) and one output of shape (1, 4 + classes, anchors).
+
+    The model file is read in the constructor so that, with gunicorn
+    preload, the weights are loaded once in the master and shared
+    copy-on-write. The onnxruntime session itself owns a thread pool that
+    does not survive fork, so it is built lazily in each worker.
+    """
+
+    name = 'local'
+
+    def __init__(self, model_path: str = LOCAL_MODEL_PATH, input_size: int = LOCAL_MODEL_INPUT_SIZE):
+        try:
+            with open(model_path, 'rb') as f:
+                self.model_bytes = f.read()
+        except OSError as e:
+            raise DetectorError(f"Cannot read local model {model_path}: {str(e)}")
+        self.model_path = model_path
+        self.model_id = f"local:{os.path.basename(model_path)}"
+        self.input_size = input_size
+        self.labels = COCO_LABELS
+        self._session = None
+        self._session_pid = None
+        self._lock = threading.Lock()
+
+    def load(self):
+        self._get_session()
+
+    def _get_session(self):
+        if self._session is not None and self._session_pid == os.getpid():
+            return self._session
+        with self._lock:
+            if self._session is None or self._session_pid != os.getpid():
+                try:
+                    import onnxruntime as ort
+                except ImportError:
+                    raise DetectorError("onnxruntime is required for DETECTOR_BACKEND=local")
+                options = ort.SessionOptions()
+                if LOCAL_MODEL_THREADS:
+                    options.intra_op_num_threads = LOCAL_MODEL_THREADS
+                session = ort.InferenceSession(
+                    self.model_bytes,
+                    sess_options=options,
+                    providers=['CPUExecutionProvider']
+                )
+                self.labels = self._read_labels(session) or COCO_LABELS
+                self._session = session
+                self._session_pid = os.getpid()
+                print(f"✅ Loaded local detector {self.model_path} in worker {os.getpid()}")
+        return self._session
+
+    @staticmethod
+    def _read_labels(session) -> Optional[List[str]]:
+        """Ultralytics exports store class names as a dict literal in metadata"""
+        import ast
+        names = session.get_modelmeta().custom_metadata_map.get('names')
+        if not names:
+            return None
+        try:
+            parsed = ast.literal_eval(names)
+        except (ValueError, SyntaxError):
+            return None
+        if isinstance(parsed, dict):
+            return [str(parsed[i]) for i in sorted(parsed)]
+        return [str(name) for name in parsed]
+
+    def detect(self, image_data: Union[bytes, memoryview], deadline: Optional[float] = None) -> List[Dict]:
+        import numpy as np
+
+        session = self._get_session()
+
+        # Letterbox into a square input, keeping aspect ratio
+        image = Image.open(BytesIO(as_bytes(image_data))).convert('RGB')
+        width, height = image.size
+        scale = self.input_size / max(width, height)
+        resized = image.resize((max(1, round(width * scale)), max(1, round(height * scale))), Image.BILINEAR)
+        canvas = Image.new('RGB', (self.input_size, self.input_size), (114, 114, 114))
+        canvas.paste(resized, (0, 0))
+        tensor = np.asarray(canvas, dtype=np.float32).transpose(2, 0, 1)[None] / 255.0
+
+        input_name = session.get_inputs()[0].name
+        output = session.run(None, {input_name: tensor})[0][0]  # (4 + classes, anchors)
+
+        predictions = output.T
+        class_scores = predictions[:, 4:]
+        class_ids = class_scores.argmax(axis=1)
+        scores = class_scores[np.arange(len(class_ids)), class_ids]
+        keep = scores >= LOCAL_MODEL_SCORE_THRESHOLD
+        if not keep.any():
+            return []
+
+        cx, cy, w, h = (predictions[keep, i] / scale for i in range(4))
+        boxes = np.stack([cx - w / 2, cy - h / 2, cx + w / 2, cy + h / 2], axis=1)
+        boxes[:, [0, 2]] = boxes[:, [0, 2]].clip(0, width)
+        boxes[:, [1, 3]] = boxes[:, [1, 3]].clip(0, height)
+        scores = scores[keep]
+        class_ids = class_ids[keep]
+
+        detections = []
+        for i in nms(boxes, scores, class_ids, LOCAL_MODEL_IOU_THRESHOLD):
+            x1, y1, x2, y2 = (int(round(v)) for v in boxes[i])
+            class_id = int(class_ids[i])
+            detections.append({
+                'label': self.labels[class_id] if class_id < len(self.labels) else str(class_id),
+                'score': round(float(scores[i]), 4),
+                'bbox': {'x': x1, 'y': y1, 'width': x2 - x1, 'height': y2 - y1}
+            })
+        return detections
+
+class StubDetector(Detector):
+    """
+    Deterministic offline detector for tests and local development
+
+    Returns the same boxes for the same image size, placed relative to
+    the image dimensions so they always fall inside the frame.
+    """
+
+    name = 'stub'
+    model_id = 'stub'
+
+    BOXES = [
+        ('person', 0.91, (0.10, 0.15, 0.30, 0.70)),
+        ('car', 0.84, (0.50, 0.55, 0.40, 0.35)),
+        ('dog', 0.62, (0.45, 0.20, 0.15, 0.20))
+    ]
+
+    def detect(self, image_data: Union[bytes, memoryview], deadline: Optional[float] = None) -> List[Dict]:
+        width, height = Image.open(BytesIO(as_bytes(image_data))).size
+        return [
+            {
+                'label': label,
+                'score': score,
+                'bbox': {
+                    'x': int(x * width),
+                    'y': int(y * height),
+                    'width': int(w * width),
+                    'height': int(h * height)
+                }
+            }
+            for label, score, (x, y, w, h) in self.BOXES
+        ]
+
+BACKENDS = {
+    'huggingface': HuggingFaceDetector,
+    'local': LocalOnnxDetector,
+    'stub': StubDetector
+}
+
+_detector: Optional[Detector] = None
+_cascade_detector: Optional[Detector] = None
+_cascade_failed_at: Optional[float] = None
+_detector_lock = threading.Lock()
+
+def create_detector(backend: str, model: str = '') -> Detector:
+    """
+    Instantiate a detector backend by name
+
+    Args:
+        backend: huggingface, local or stub
+        model: Hugging Face model id or local ONNX path (default: the
+            backend's own setting)
+
+    Raises:
+        ValueError: If the backend name is unknown
+    """
+    cls = BACKENDS.get(backend)
+    if cls is None:
+        raise ValueError(f"Unknown detector backend '{backend}'. Choose from: {', '.join(BACKENDS)}")
+    if model and cls is not StubDetector:
+        return cls(model)
+    return cls()
+
+def get_detector() -> Detector:
+    """Get the configured detector, shared by every request in this process"""
+    global _detector
+    if _detector is None:
+        with _detector_lock:
+            if _detector is None:
+                _detector = create_detector(DETECTOR_BACKEND)
+                print(f"🎯 Detector backend: {_detector.name} ({_detector.model_id})")
+    return _detector
+
+def _cascade_backing_off() -> bool:
+    return _cascade_failed_at is not None and time.monotonic() - _cascade_failed_at < CASCADE_RETRY_SECONDS
+
+def get_cascade_detector() -> Optional[Detector]:
+    """
+    Get the heavier second-stage detector
+
+    A broken second stage must not take the fast detector down with it: a
+    load failure is logged once and not retried for CASCADE_RETRY_SECONDS.
+
+    Returns:
+        The cascade detector, or None when no cascade is configured or it
+        failed to load
+    """
+    global _cascade_detector, _cascade_failed_at
+    if not CASCADE_BACKEND:
+        return None
+    if _cascade_detector is None and not _cascade_backing_off():
+        with _detector_lock:
+            if _cascade_detector is None and not _cascade_backing_off():
+                try:
+                    _cascade_detector = create_detector(CASCADE_BACKEND, CASCADE_MODEL)
+                except Exception as e:
+                    _cascade_failed_at = time.monotonic()
+                    print(f"⚠️ Cascade detector failed to load, retrying in {CASCADE_RETRY_SECONDS:.0f}s: {str(e)}")
+                    return None
+                _cascade_failed_at = None
+                print(f"🎯 Cascade backend: {_cascade_detector.name} ({_cascade_detector.model_id})")
+    return _cascade_detector
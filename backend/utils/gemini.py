@@ -4,22 +4,133 @@ Context-aware Q&A system
 """
 
 import google.generativeai as genai
+import json
 import os
-from typing import List, Dict
+import re
+import threading
+import time
+from typing import Dict, Iterator, List, Optional
+
+from utils.cache import LRUCache, make_cache_key
+from utils.circuit_breaker import CircuitOpenError, get_breaker
+from utils.http_client import get_stats
+from utils.prompt_context import (
+    QA_CONTEXT_TOKEN_BUDGET, compose_context, estimate_tokens, record_context, relevant_context
+)
+from utils.query_engine import QA_INDEX_CACHE_ITEMS, QA_INDEX_CACHE_TTL, answer_locally, get_index
+from utils.singleflight import SingleFlight
 
 GOOGLE_GEMINI_API_KEY = os.getenv('GOOGLE_GEMINI_API_KEY')
+GEMINI_MODEL = 'gemini-2.0-flash-exp'
+
+# Answers to the same question about the same detections are reused
+QA_CACHE_ENABLED = os.getenv('QA_CACHE_ENABLED', 'true').lower() == 'true'
+QA_CACHE_TTL = int(os.getenv('QA_CACHE_TTL', 600))  # seconds
+QA_CACHE_MAX_ITEMS = int(os.getenv('QA_CACHE_MAX_ITEMS', 1024))
+
+# Questions per /api/qa/batch request, answered in one Gemini call
+QA_BATCH_MAX_QUESTIONS = int(os.getenv('QA_BATCH_MAX_QUESTIONS', 20))
 
 # Configure Gemini API
 if GOOGLE_GEMINI_API_KEY:
     genai.configure(api_key=GOOGLE_GEMINI_API_KEY)
 
-def ask_gemini(question: str, detections: List[Dict]) -> str:
+_model = None
+_model_lock = threading.Lock()
+
+def get_model():
+    """Get the shared Gemini model client (built once per process)"""
+    global _model
+    if _model is None:
+        with _model_lock:
+            if _model is None:
+                _model = genai.GenerativeModel(GEMINI_MODEL)
+    return _model
+
+class AnswerCache:
+    """TTL/LRU cache of Gemini answers with hit counters"""
+
+    def __init__(self, max_items: int = QA_CACHE_MAX_ITEMS, ttl: float = QA_CACHE_TTL,
+                 enabled: bool = QA_CACHE_ENABLED):
+        self.enabled = enabled
+        self.memory = LRUCache(max_items, ttl)
+        self.flight = SingleFlight('qa')
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> Optional[str]:
+        if not self.enabled:
+            return None
+        answer = self.memory.get(key)
+        with self._lock:
+            if answer is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return answer
+
+    def set(self, key: str, answer: str):
+        if self.enabled and answer:
+            self.memory.set(key, answer)
+
+    def stats(self) -> Dict:
+        with self._lock:
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        flight = self.flight.stats()
+        return {
+            'hits': hits,
+            'misses': misses,
+            'hitRate': round(hits / lookups, 3) if lookups else 0.0,
+            'coalesced': flight['shared'],
+            'inFlight': flight['inFlight'],
+            'items': len(self.memory),
+            'enabled': self.enabled
+        }
+
+answer_cache = AnswerCache()
+
+# Prompt context per detection set, so follow-up questions skip rebuilding it
+_context_cache = LRUCache(QA_INDEX_CACHE_ITEMS, QA_INDEX_CACHE_TTL)
+
+def normalize_question(question: str) -> str:
+    """Case-, whitespace- and trailing-punctuation-insensitive form of a question"""
+    return re.sub(r'\s+', ' ', question.strip().lower()).rstrip(' ?!.')
+
+def detections_fingerprint(detections: List[Dict]) -> str:
+    """
+    Canonical, order-independent digest of a detections list
+
+    Scores are rounded to 4 decimals and boxes to whole pixels, so the same
+    result serialized by different clients gives the same fingerprint.
+    """
+    canonical = []
+    for detection in detections:
+        bbox = detection.get('bbox') or {}
+        if not isinstance(bbox, dict):
+            bbox = {}
+        score = detection.get('score', detection.get('confidence', 0)) or 0
+        canonical.append([
+            str(detection.get('label') or detection.get('class', 'Unknown')),
+            round(float(score), 4),
+            [round(float(bbox.get(k, 0) or 0)) for k in ('x', 'y', 'width', 'height')]
+        ])
+    canonical.sort(key=lambda item: json.dumps(item))
+    return make_cache_key(json.dumps(canonical, separators=(',', ':')))
+
+def answer_cache_key(question: str, fingerprint: str) -> str:
+    return make_cache_key(GEMINI_MODEL, normalize_question(question), fingerprint)
+
+def ask_gemini(question: str, detections: List[Dict], fingerprint: Optional[str] = None) -> str:
     """
     Ask Gemini AI a question with detection context
     
     Args:
         question: User's question
         detections: List of detected objects
+        fingerprint: Digest of the detections if already known (detection
+            sessions store it)
         
     Returns:
         AI-generated answer
@@ -28,173 +139,428 @@ def ask_gemini(question: str, detections: List[Dict]) -> str:
         print(f"🔍 ask_gemini called with question: '{question}'")
         print(f"🔍 Detections received: {len(detections)} items")
         
+        # Counts, thresholds, extremes and presence need no language model
+        fingerprint = fingerprint or detections_fingerprint(detections)
+        local = answer_locally(question, detections, fingerprint)
+        if local is not None:
+            print("🧮 Answered locally")
+            return local
+        
         # If API key is not set, return mock response
         if not GOOGLE_GEMINI_API_KEY:
             print("⚠️ GOOGLE_GEMINI_API_KEY not set, returning mock response")
             return get_mock_response(question, detections)
         
-        # Build context from detections
-        context = build_context(detections)
-        
-        # Create prompt
-        prompt = f"""You are an AI assistant for an object detection system. You have access to the following detected objects in an image:
-
-{context}
-
-User question: {question}
-
-Please provide a helpful, accurate, and concise answer based on the detected objects. If the question cannot be answered with the available information, politely explain what information is available."""
-        
-        # Generate response using Gemini 2.0 Flash
-        model = genai.GenerativeModel('gemini-2.0-flash-exp')
-        response = model.generate_content(prompt)
-        
-        return response.text
+        return ask_model(question, detections, fingerprint)
         
     except Exception as e:
         print(f"⚠️ Error calling Gemini API: {str(e)}")
         return get_mock_response(question, detections)
 
-def build_context(detections: List[Dict]) -> str:
+def ask_model(question: str, detections: List[Dict], fingerprint: str) -> str:
     """
-    Build context string from detections
+    Answer a question with Gemini, from the answer cache when possible
+    
+    Raises:
+        Exception: If the breaker is open or the call failed
+    """
+    key = answer_cache_key(question, fingerprint)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        print("💾 Q&A answer cache hit")
+        return cached
+    
+    # Identical questions arriving together share one Gemini call
+    answer, shared = answer_cache.flight.do(
+        key, lambda: generate_answer(question, detections, key, fingerprint)
+    )
+    if shared:
+        print("🔗 Shared in-flight Gemini answer")
+    return answer
+
+def generate_answer(question: str, detections: List[Dict], cache_key: str,
+                    fingerprint: Optional[str] = None) -> str:
+    """
+    Call Gemini for an answer and cache it
+    
+    Raises:
+        Exception: If the breaker is open or the call failed
+    """
+    prompt = build_prompt(question, detections, fingerprint)
+    answer = generate_text(prompt)
+    
+    # Only real answers are cached, never the mock fallback
+    answer_cache.set(cache_key, answer)
+    return answer
+
+def generate_text(prompt: str, **kwargs) -> str:
+    """
+    Run one Gemini generation with breaker and latency accounting
+    
+    Raises:
+        Exception: If the breaker is open or the call failed
+    """
+    # Generate response using Gemini 2.0 Flash
+    # The SDK manages its own transport, so only latency is tracked here
+    breaker = get_breaker('gemini')
+    breaker.allow()
+    started = time.monotonic()
+    try:
+        response = get_model().generate_content(prompt, **kwargs)
+        text = response.text
+    except Exception:
+        get_stats('gemini').record(time.monotonic() - started, ok=False)
+        breaker.record(time.monotonic() - started, ok=False)
+        raise
+    get_stats('gemini').record(time.monotonic() - started, ok=True)
+    breaker.record(time.monotonic() - started, ok=True)
+    return text
+
+def ask_gemini_batch(questions: List[str], detections: List[Dict],
+                     fingerprint: Optional[str] = None) -> List[Dict]:
+    """
+    Answer several questions about one detection set with a single Gemini call
+    
+    Local and cached answers are used first. The remaining questions go to
+    Gemini in one structured prompt. Any answer that cannot be parsed back
+    out is asked again as a single question. If the batch call itself
+    fails, every remaining question gets the fallback answer.
     
     Args:
+        questions: User's questions
         detections: List of detected objects
+        fingerprint: Digest of the detections if already known
         
     Returns:
-        Formatted context string
+        {"question", "answer", "source"} per question, in order. source is
+        local, cache, batch, single or fallback (the mock response).
     """
-    if not detections:
-        return "No objects detected in the image."
+    fingerprint = fingerprint or detections_fingerprint(detections)
+    results: List[Optional[Dict]] = [None] * len(questions)
+    pending: Dict[str, List[int]] = {}
     
-    context_lines = []
-    for i, detection in enumerate(detections, 1):
-        label = detection.get('label', 'Unknown')
-        score = detection.get('score', 0.0)
-        bbox = detection.get('bbox', {})
-        
-        context_lines.append(
-            f"{i}. {label} (confidence: {score:.1%}, "
-            f"location: x={bbox.get('x', 0)}, y={bbox.get('y', 0)}, "
-            f"width={bbox.get('width', 0)}, height={bbox.get('height', 0)})"
-        )
+    for position, question in enumerate(questions):
+        local = answer_locally(question, detections, fingerprint)
+        if local is not None:
+            results[position] = {'question': question, 'answer': local, 'source': 'local'}
+        elif not GOOGLE_GEMINI_API_KEY:
+            results[position] = {
+                'question': question, 'answer': get_mock_response(question, detections), 'source': 'fallback'
+            }
+        else:
+            cached = answer_cache.get(answer_cache_key(question, fingerprint))
+            if cached is not None:
+                results[position] = {'question': question, 'answer': cached, 'source': 'cache'}
+            else:
+                # Repeats of a question in one batch are asked once
+                pending.setdefault(normalize_question(question), []).append(position)
+    
+    unique = [questions[positions[0]] for positions in pending.values()]
+    answers = {}
+    failed = False
+    if len(unique) > 1:
+        try:
+            answers = generate_batch_answers(unique, detections, fingerprint)
+        except Exception as e:
+            # The upstream just failed: asking it again once per question
+            # would only multiply the load, so fall back for the whole batch
+            print(f"⚠️ Batch Gemini call failed: {str(e)}")
+            failed = True
+        _record_batch(len(unique), len(answers), failed)
     
-    return "\n".join(context_lines)
+    for number, positions in enumerate(pending.values(), 1):
+        question = questions[positions[0]]
+        answer, source = answers.get(number), 'batch'
+        if failed:
+            answer, source = get_mock_response(question, detections), 'fallback'
+        elif answer is None:
+            try:
+                answer, source = ask_model(question, detections, fingerprint), 'single'
+            except Exception as e:
+                print(f"⚠️ Error calling Gemini API: {str(e)}")
+                answer, source = get_mock_response(question, detections), 'fallback'
+        for position in positions:
+            results[position] = {'question': questions[position], 'answer': answer, 'source': source}
+    
+    return results
 
-def get_mock_response(question: str, detections: List[Dict]) -> str:
+def generate_batch_answers(questions: List[str], detections: List[Dict], fingerprint: str) -> Dict[int, str]:
     """
-    Generate intelligent mock response based on detections
+    Ask Gemini all questions in one prompt and cache the parsed answers
+    
+    Returns:
+        Answers by question number (1-based); numbers missing from the
+        response are left out
+    
+    Raises:
+        Exception: If the breaker is open or the call failed
     """
-    if not detections:
-        return "I don't see any objects in the image. Could you upload an image with detectable objects?"
+    text = generate_text(
+        build_batch_prompt(questions, detections, fingerprint),
+        generation_config={'response_mime_type': 'application/json'}
+    )
+    try:
+        answers = parse_batch_answers(text, len(questions))
+    except ValueError as e:
+        print(f"⚠️ Could not parse batch answers: {str(e)}")
+        return {}
+    for number, answer in answers.items():
+        answer_cache.set(answer_cache_key(questions[number - 1], fingerprint), answer)
+    print(f"📦 Answered {len(answers)}/{len(questions)} questions in one Gemini call")
+    return answers
+
+def parse_batch_answers(text: str, count: int) -> Dict[int, str]:
+    """
+    Read {"answers": [{"id": 1, "answer": "..."}, ...]} from a model response
     
-    object_count = len(detections)
-    # Handle both 'label' and 'class' keys, and both 'score' and 'confidence' keys
-    objects = [d.get('label') or d.get('class', 'Unknown') for d in detections]
-    objects_list = ", ".join(objects[:-1]) + (f", and {objects[-1]}" if len(objects) > 1 else objects[0])
+    A bare list of answers or of answer objects is accepted too, and the
+    JSON may be wrapped in a Markdown code fence.
     
-    # Helper function to get confidence value
-    def get_confidence(d):
-        conf = d.get('score') or d.get('confidence', 0)
-        return conf if conf <= 1 else conf / 100
+    Raises:
+        ValueError: If the text holds no answers list
+    """
+    text = text.strip()
+    fenced = re.match(r'^```(?:json)?\s*(.*?)\s*```$', text, re.DOTALL)
+    if fenced:
+        text = fenced.group(1)
+    data = json.loads(text)
+    items = data.get('answers') if isinstance(data, dict) else data
+    if not isinstance(items, list):
+        raise ValueError('Response has no answers list')
     
-    question_lower = question.lower()
+    answers = {}
+    for position, item in enumerate(items, 1):
+        number, answer = position, item
+        if isinstance(item, dict):
+            number, answer = item.get('id', position), item.get('answer')
+        try:
+            number = int(number)
+        except (TypeError, ValueError):
+            continue
+        if 1 <= number <= count and isinstance(answer, str) and answer.strip():
+            answers[number] = answer.strip()
+    return answers
+
+# Batched questions in this worker process, how many came back parsed and
+# how many fell back because the batch call failed
+_batch_stats = {'batches': 0, 'questions': 0, 'parsed': 0, 'failed': 0, 'fallback': 0}
+_batch_stats_lock = threading.Lock()
+
+def _record_batch(questions: int, parsed: int, failed: bool = False):
+    with _batch_stats_lock:
+        _batch_stats['batches'] += 1
+        _batch_stats['questions'] += questions
+        _batch_stats['parsed'] += parsed
+        if failed:
+            _batch_stats['failed'] += 1
+            _batch_stats['fallback'] += questions
+
+def batch_stats() -> Dict:
+    """Questions answered through batched Gemini calls, and how many had to be asked again"""
+    with _batch_stats_lock:
+        stats = dict(_batch_stats)
+    stats['askedAgain'] = stats['questions'] - stats['parsed'] - stats['fallback']
+    return stats
+
+def stream_gemini(question: str, detections: List[Dict], fingerprint: Optional[str] = None) -> Iterator[str]:
+    """
+    Ask Gemini AI a question and yield the answer as it is generated
     
-    # Count questions with confidence threshold
-    if any(word in question_lower for word in ["how many", "count", "number of"]):
-        # Check if asking about specific confidence level
-        import re
-        confidence_match = re.search(r'(\d+)%?\s*(?:confidence|percent)', question_lower)
+    Args:
+        question: User's question
+        detections: List of detected objects
+        fingerprint: Digest of the detections if already known
         
-        if confidence_match and any(word in question_lower for word in ["above", "over", "more than", "greater than", "higher than"]):
-            threshold = int(confidence_match.group(1)) / 100
-            high_conf_objects = [d for d in detections if get_confidence(d) > threshold]
-            count = len(high_conf_objects)
-            if count > 0:
-                high_conf_labels = [d.get('label') or d.get('class', 'Unknown') for d in high_conf_objects]
-                return f"There are {count} objects detected with confidence above {int(threshold*100)}%: {', '.join(high_conf_labels)}."
-            else:
-                return f"No objects were detected with confidence above {int(threshold*100)}%."
+    Yields:
+        Chunks of answer text. If the model fails before producing any
+        text, the mock response is yielded as a single chunk instead.
         
-        elif confidence_match and any(word in question_lower for word in ["below", "under", "less than", "lower than"]):
-            threshold = int(confidence_match.group(1)) / 100
-            low_conf_objects = [d for d in detections if get_confidence(d) < threshold]
-            count = len(low_conf_objects)
-            if count > 0:
-                low_conf_labels = [d.get('label') or d.get('class', 'Unknown') for d in low_conf_objects]
-                return f"There are {count} objects detected with confidence below {int(threshold*100)}%: {', '.join(low_conf_labels)}."
-            else:
-                return f"No objects were detected with confidence below {int(threshold*100)}%."
+    Raises:
+        Exception: If the stream breaks after text was already yielded
+    """
+    fingerprint = fingerprint or detections_fingerprint(detections)
+    local = answer_locally(question, detections, fingerprint)
+    if local is not None:
+        print("🧮 Answered locally")
+        yield local
+        return
+    
+    if not GOOGLE_GEMINI_API_KEY:
+        print("⚠️ GOOGLE_GEMINI_API_KEY not set, returning mock response")
+        yield get_mock_response(question, detections)
+        return
+    
+    key = answer_cache_key(question, fingerprint)
+    cached = answer_cache.get(key)
+    if cached is not None:
+        print("💾 Q&A answer cache hit")
+        yield cached
+        return
+    
+    breaker = get_breaker('gemini')
+    try:
+        breaker.allow()
+    except CircuitOpenError as e:
+        print(f"⚡ {str(e)}, returning mock response")
+        yield get_mock_response(question, detections)
+        return
+    
+    started = time.monotonic()
+    first_token = None
+    chunks = []
+    ok = None
+    try:
+        for chunk in get_model().generate_content(build_prompt(question, detections, fingerprint), stream=True):
+            try:
+                text = chunk.text
+            except ValueError:
+                # Chunk without text parts (e.g. only a finish reason)
+                continue
+            if not text:
+                continue
+            if first_token is None:
+                first_token = time.monotonic() - started
+            chunks.append(text)
+            yield text
+        ok = True
+        answer_cache.set(key, ''.join(chunks))
+    except Exception as e:
+        ok = False
+        print(f"⚠️ Error streaming from Gemini API: {str(e)}")
+        if first_token is not None:
+            raise
+        yield get_mock_response(question, detections)
+    finally:
+        elapsed = time.monotonic() - started
+        if ok is None:
+            # The client went away mid-stream; says nothing about the upstream
+            breaker.cancel()
+        else:
+            get_stats('gemini').record(elapsed, ok=ok)
+            breaker.record(elapsed, ok=ok)
+        if ok:
+            _record_stream(first_token, elapsed)
+
+# Time-to-first-token for streamed answers in this worker process
+_stream_stats = {'streams': 0, 'firstTokenMs': 0.0, 'totalMs': 0.0}
+_stream_stats_lock = threading.Lock()
+
+def _record_stream(first_token: float, total: float):
+    with _stream_stats_lock:
+        _stream_stats['streams'] += 1
+        _stream_stats['firstTokenMs'] += (first_token if first_token is not None else total) * 1000
+        _stream_stats['totalMs'] += total * 1000
+
+def stream_stats() -> Dict:
+    """Average time-to-first-token and total generation time of streamed answers"""
+    with _stream_stats_lock:
+        stats = dict(_stream_stats)
+    streams = stats['streams']
+    return {
+        'streams': streams,
+        'avgFirstTokenMs': round(stats['firstTokenMs'] / streams, 1) if streams else 0.0,
+        'avgTotalMs': round(stats['totalMs'] / streams, 1) if streams else 0.0
+    }
+
+def build_prompt(question: str, detections: List[Dict], fingerprint: Optional[str] = None) -> str:
+    """
+    Build the Gemini prompt for a question about the detected objects
+    
+    Args:
+        question: User's question
+        detections: List of detected objects
+        fingerprint: Digest of the detections, to reuse their index
         
-        # Default count response
-        conf = get_confidence(detections[0])
-        return f"I can see {object_count} objects in the image: {objects_list}. The most confident detection is {objects[0]} at {conf*100:.0f}% confidence."
-    
-    # What/Which questions
-    elif any(word in question_lower for word in ["what", "which", "identify"]):
-        return f"The image contains {objects_list}. These objects were detected with varying confidence levels, with {objects[0]} being the most prominent."
-    
-    # Highest confidence
-    elif any(word in question_lower for word in ["highest", "most confident", "best"]):
-        best = max(detections, key=lambda x: get_confidence(x))
-        label = best.get('label') or best.get('class', 'Unknown')
-        return f"The object detected with highest confidence is {label} at {get_confidence(best)*100:.0f}% confidence."
-    
-    # Lowest confidence
-    elif any(word in question_lower for word in ["lowest", "least confident", "worst"]):
-        worst = min(detections, key=lambda x: get_confidence(x))
-        label = worst.get('label') or worst.get('class', 'Unknown')
-        return f"The object with lowest confidence is {label} at {get_confidence(worst)*100:.0f}% confidence."
-    
-    # Largest/biggest object
-    elif any(word in question_lower for word in ["largest", "biggest", "largest object", "biggest object"]):
-        def get_area(d):
-            bbox = d['bbox']
-            if isinstance(bbox, dict):
-                return bbox.get('width', 0) * bbox.get('height', 0)
-            else:
-                return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    Returns:
+        Prompt text
+    """
+    context = get_context(detections, fingerprint, [question])
+    
+    return f"""You are an AI assistant for an object detection system. You have access to the following detected objects in an image:
+
+{context}
+
+User question: {question}
+
+Please provide a helpful, accurate, and concise answer based on the detected objects. If the question cannot be answered with the available information, politely explain what information is available."""
+
+def build_batch_prompt(questions: List[str], detections: List[Dict], fingerprint: Optional[str] = None) -> str:
+    """
+    Build one Gemini prompt asking for a JSON answer to each question
+    
+    Args:
+        questions: User's questions
+        detections: List of detected objects
+        fingerprint: Digest of the detections, to reuse their index
         
-        largest = max(detections, key=lambda x: get_area(x))
-        label = largest.get('label') or largest.get('class', 'Unknown')
-        bbox = largest['bbox']
-        area = get_area(largest)
-        return f"The largest object is {label} with {get_confidence(largest)*100:.0f}% confidence. It has an area of {area:.0f} square pixels."
-    
-    # Smallest object
-    elif any(word in question_lower for word in ["smallest", "tiniest", "smallest object"]):
-        def get_area(d):
-            bbox = d['bbox']
-            if isinstance(bbox, dict):
-                return bbox.get('width', 0) * bbox.get('height', 0)
-            else:
-                return (bbox[2] - bbox[0]) * (bbox[3] - bbox[1])
+    Returns:
+        Prompt text
+    """
+    context = get_context(detections, fingerprint, questions)
+    numbered = "\n".join(f"{number}. {question}" for number, question in enumerate(questions, 1))
+    
+    return f"""You are an AI assistant for an object detection system. You have access to the following detected objects in an image:
+
+{context}
+
+User questions:
+{numbered}
+
+Please provide a helpful, accurate, and concise answer to each question based on the detected objects. If a question cannot be answered with the available information, politely explain what information is available in its answer.
+
+Respond with only a JSON object of the form {{"answers": [{{"id": 1, "answer": "..."}}]}}, with one entry per question, where id is the question number."""
+
+def get_context(detections: List[Dict], fingerprint: Optional[str] = None,
+                questions: Optional[List[str]] = None) -> str:
+    """
+    Prompt context for a detection set within QA_CONTEXT_TOKEN_BUDGET
+    
+    The question-independent part is built once per fingerprint. When the
+    detections had to be summarized, the ones the questions ask about are
+    added on top.
+    
+    Args:
+        detections: List of detected objects
+        fingerprint: Digest of the detections, to reuse their index and context
+        questions: Questions the prompt will ask
         
-        smallest = min(detections, key=lambda x: get_area(x))
-        label = smallest.get('label') or smallest.get('class', 'Unknown')
-        return f"The smallest object is {label} with {get_confidence(smallest)*100:.0f}% confidence."
-    
-    # Specific object queries
-    elif any(obj.lower() in question_lower for obj in objects):
-        for detection in detections:
-            label = detection.get('label') or detection.get('class', 'Unknown')
-            if label.lower() in question_lower:
-                bbox = detection['bbox']
-                x = bbox.get('x') if isinstance(bbox, dict) else bbox[0]
-                y = bbox.get('y') if isinstance(bbox, dict) else bbox[1]
-                w = bbox.get('width') if isinstance(bbox, dict) else (bbox[2] - bbox[0])
-                h = bbox.get('height') if isinstance(bbox, dict) else (bbox[3] - bbox[1])
-                return f"Yes, I can see a {label} with {get_confidence(detection)*100:.0f}% confidence. It's located at position (x: {x}, y: {y}) with dimensions {w}x{h} pixels."
-    
-    # Location questions
-    elif any(word in question_lower for word in ["where", "location", "position"]):
-        bbox = detections[0]['bbox']
-        x = bbox.get('x') if isinstance(bbox, dict) else bbox[0]
-        y = bbox.get('y') if isinstance(bbox, dict) else bbox[1]
-        return f"The detected objects are positioned throughout the image. {objects[0]} is at ({x}, {y}), while others are distributed across different areas."
+    Returns:
+        Formatted context string
+    """
+    index = get_index(detections, fingerprint)
+    base = _context_cache.get(fingerprint) if fingerprint else None
+    if base is None:
+        base = compose_context(index)
+        if fingerprint:
+            _context_cache.set(fingerprint, base)
+    
+    context = base.text
+    tokens = base.tokens
+    if base.summarized and questions:
+        relevant = relevant_context(index, questions, base.listed, QA_CONTEXT_TOKEN_BUDGET - base.tokens)
+        if relevant:
+            context = f"{context}\n\n{relevant}"
+            tokens = estimate_tokens(context)
+    
+    record_context(tokens, base.summarized)
+    print(f"🧾 Prompt context: ~{tokens} tokens for {len(index.items)} detections")
+    return context
+
+def get_mock_response(question: str, detections: List[Dict]) -> str:
+    """
+    Generate intelligent mock response based on detections
+    """
+    index = get_index(detections)
+    if not index.items:
+        return "I don't see any objects in the image. Could you upload an image with detectable objects?"
+    
+    # Answer as much as the detections allow, even loosely matched questions
+    answer = answer_locally(question, detections, strict=False)
+    if answer is not None:
+        return answer
     
     # Default intelligent response
-    else:
-        confidences = [get_confidence(d) for d in detections]
-        return f"Based on the image analysis, I detected {object_count} objects: {objects_list}. The detection confidence ranges from {min(confidences)*100:.0f}% to {max(confidences)*100:.0f}%. What specific aspect would you like to know more about?"
+    labels = [item.label for item in index.items]
+    objects_list = ", ".join(labels[:-1]) + (f", and {labels[-1]}" if len(labels) > 1 else labels[0])
+    confidences = [item.score for item in index.items]
+    return f"Based on the image analysis, I detected {len(labels)} objects: {objects_list}. The detection confidence ranges from {min(confidences)*100:.0f}% to {max(confidences)*100:.0f}%. What specific aspect would you like to know more about?"
@@ -0,0 +1,254 @@
+"""
+Upstream HTTP client
+Pooled keep-alive sessions with retries and per-upstream latency stats
+"""
+
+import os
+import random
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.circuit_breaker import get_breaker
+
+UPSTREAM_CONNECT_TIMEOUT = float(os.getenv('UPSTREAM_CONNECT_TIMEOUT', 3.05))  # seconds
+UPSTREAM_READ_TIMEOUT = float(os.getenv('UPSTREAM_READ_TIMEOUT', 30))  # seconds
+UPSTREAM_MAX_RETRIES = int(os.getenv('UPSTREAM_MAX_RETRIES', 2))
+UPSTREAM_BACKOFF_BASE = float(os.getenv('UPSTREAM_BACKOFF_BASE', 0.5))  # seconds
+UPSTREAM_BACKOFF_MAX = float(os.getenv('UPSTREAM_BACKOFF_MAX', 8))  # seconds
+# Connections kept per upstream host; should cover the threads that can hit
+# an upstream at once inside one worker (request thread + fan-out pools)
+UPSTREAM_POOL_SIZE = int(os.getenv('UPSTREAM_POOL_SIZE', 10))
+
+RETRYABLE_STATUSES = frozenset({500, 502, 503, 504})
+
+# Number of recent calls kept for percentile estimates
+LATENCY_WINDOW = 512
+
+class LatencyStats:
+    """Rolling latency and outcome counters for one upstream"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=LATENCY_WINDOW)
+        self.calls = 0
+        self.errors = 0
+        self.retries = 0
+        self.last_status = None
+
+    def record(self, seconds: float, ok: bool, status: Optional[int] = None, retries: int = 0):
+        with self._lock:
+            self._samples.append(seconds)
+            self.calls += 1
+            self.retries += retries
+            if not ok:
+                self.errors += 1
+            if status is not None:
+                self.last_status = status
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            snapshot = {
+                'calls': self.calls,
+                'errors': self.errors,
+                'retries': self.retries,
+                'lastStatus': self.last_status
+            }
+        if samples:
+            snapshot.update({
+                'avgMs': round(sum(samples) / len(samples) * 1000, 1),
+                'p50Ms': round(samples[len(samples) // 2] * 1000, 1),
+                'p95Ms': round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1),
+                'maxMs': round(samples[-1] * 1000, 1)
+            })
+        return snapshot
+
+_stats: Dict[str, LatencyStats] = {}
+_stats_lock = threading.Lock()
+
+def get_stats(name: str) -> LatencyStats:
+    """Get (or create) the latency stats bucket for an upstream"""
+    with _stats_lock:
+        stats = _stats.get(name)
+        if stats is None:
+            stats = _stats[name] = LatencyStats()
+        return stats
+
+def upstream_stats() -> Dict[str, Dict]:
+    """Latency stats for every upstream seen by this worker"""
+    with _stats_lock:
+        names = list(_stats)
+    return {name: get_stats(name).snapshot() for name in names}
+
+def backoff_delay(attempt: int) -> float:
+    """Full-jitter exponential backoff for the given retry attempt (0-based)"""
+    return random.uniform(0, min(UPSTREAM_BACKOFF_MAX, UPSTREAM_BACKOFF_BASE * (2 ** attempt)))
+
+class DeadlineExceeded(requests.Timeout):
+    """Raised when a request's latency budget runs out before an attempt"""
+
+def remaining_budget(deadline: Optional[float]) -> Optional[float]:
+    """Seconds left until a time.monotonic() deadline (None = unlimited)"""
+    if deadline is None:
+        return None
+    return deadline - time.monotonic()
+
+class UpstreamClient:
+    """
+    Keep-alive session for a single upstream service
+
+    Retries connection failures and 5xx responses with jittered backoff.
+    A 503 from a Hugging Face model that is still loading waits for the
+    advertised estimated_time (capped by UPSTREAM_BACKOFF_MAX) instead.
+    Every call goes through the upstream's circuit breaker, and an optional
+    deadline caps timeouts and retries so a call never outlives its caller.
+    """
+
+    def __init__(self, name: str, pool_size: int = UPSTREAM_POOL_SIZE,
+                 connect_timeout: float = UPSTREAM_CONNECT_TIMEOUT,
+                 read_timeout: float = UPSTREAM_READ_TIMEOUT,
+                 max_retries: int = UPSTREAM_MAX_RETRIES):
+        self.name = name
+        self.connect_timeout = connect_timeout
+        self.read_timeout = read_timeout
+        self.max_retries = max_retries
+        self.stats = get_stats(name)
+        self.breaker = get_breaker(name)
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=pool_size, max_retries=0)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+    def request(self, method: str, url: str, read_timeout: Optional[float] = None,
+                deadline: Optional[float] = None, **kwargs) -> requests.Response:
+        """
+        Send a request with pooling, split timeouts and retries
+
+        Args:
+            method: HTTP method
+            url: Target URL
+            read_timeout: Override for the read timeout in seconds
+            deadline: time.monotonic() value the whole call must finish by;
+                timeouts are shortened and retries skipped to respect it
+            **kwargs: Passed through to requests.Session.request
+
+        Returns:
+            The final response (which may still be a 5xx after retries)
+
+        Raises:
+            CircuitOpenError: If the upstream's circuit breaker is open
+            DeadlineExceeded: If the deadline passed before an attempt
+            requests.RequestException: If every attempt failed at the transport level
+        """
+        self.breaker.allow()
+        started = time.monotonic()
+        attempt = 0
+
+        while True:
+            try:
+                timeout = self._timeout(read_timeout, deadline)
+            except DeadlineExceeded:
+                # The caller ran out of time, which says nothing about the upstream
+                self.breaker.cancel()
+                self.stats.record(time.monotonic() - started, ok=False, retries=attempt)
+                raise
+            try:
+                response = self.session.request(method, url, timeout=timeout, **kwargs)
+            except requests.ConnectionError:
+                # Covers connect timeouts and stale keep-alive sockets. Read
+                # timeouts are not retried: the upstream may still be working.
+                delay = backoff_delay(attempt)
+                if attempt >= self.max_retries or not self._can_wait(delay, deadline):
+                    self._record(started, ok=False, retries=attempt)
+                    raise
+            except requests.RequestException:
+                self._record(started, ok=False, retries=attempt)
+                raise
+            else:
+                delay = self._retry_delay(response, attempt)
+                if (response.status_code not in RETRYABLE_STATUSES or attempt >= self.max_retries
+                        or not self._can_wait(delay, deadline)):
+                    if self._loading_time(response):
+                        # A model still loading is a cold start, not an outage:
+                        # warm-up handles it, the breaker should not open
+                        self.stats.record(time.monotonic() - started, ok=False,
+                                          status=response.status_code, retries=attempt)
+                        self.breaker.cancel()
+                        return response
+                    self._record(started, ok=response.status_code < 500,
+                                 status=response.status_code, retries=attempt)
+                    return response
+                response.close()
+
+            print(f"🔁 Retrying {self.name} in {delay:.2f}s (attempt {attempt + 1}/{self.max_retries})")
+            time.sleep(delay)
+            attempt += 1
+
+    def post(self, url: str, **kwargs) -> requests.Response:
+        return self.request('POST', url, **kwargs)
+
+    def get(self, url: str, **kwargs) -> requests.Response:
+        return self.request('GET', url, **kwargs)
+
+    def _record(self, started: float, ok: bool, status: Optional[int] = None, retries: int = 0):
+        elapsed = time.monotonic() - started
+        self.stats.record(elapsed, ok=ok, status=status, retries=retries)
+        self.breaker.record(elapsed, ok=ok)
+
+    def _timeout(self, read_timeout: Optional[float], deadline: Optional[float]):
+        connect, read = self.connect_timeout, read_timeout or self.read_timeout
+        remaining = remaining_budget(deadline)
+        if remaining is None:
+            return connect, read
+        if remaining <= 0:
+            raise DeadlineExceeded(f"Latency budget for {self.name} exhausted")
+        return min(connect, remaining), min(read, remaining)
+
+    @staticmethod
+    def _can_wait(delay: float, deadline: Optional[float]) -> bool:
+        # Only retry if there is still time for the delay and a short attempt
+        remaining = remaining_budget(deadline)
+        return remaining is None or remaining > delay + 1.0
+
+    @staticmethod
+    def _loading_time(response: requests.Response) -> float:
+        """Seconds a Hugging Face 503 says the model needs to load (0 = not loading)"""
+        if response.status_code != 503:
+            return 0.0
+        try:
+            return max(0.0, float(response.json().get('estimated_time', 0)))
+        except (ValueError, AttributeError, TypeError):
+            return 0.0
+
+    def _retry_delay(self, response: requests.Response, attempt: int) -> float:
+        estimated = self._loading_time(response)
+        if estimated > 0:
+            return min(UPSTREAM_BACKOFF_MAX, estimated) * random.uniform(0.8, 1.0)
+        return backoff_delay(attempt)
+
+_clients: Dict[str, UpstreamClient] = {}
+_clients_lock = threading.Lock()
+_clients_pid = os.getpid()
+
+def get_client(name: str) -> UpstreamClient:
+    """
+    Get the shared client for an upstream
+
+    Clients are created lazily and rebuilt after a fork, so pooled
+    sockets are never shared between gunicorn workers.
+    """
+    global _clients_pid
+    with _clients_lock:
+        if _clients_pid != os.getpid():
+            _clients.clear()
+            _clients_pid = os.getpid()
+        client = _clients.get(name)
+        if client is None:
+            client = _clients[name] = UpstreamClient(name)
+        return client
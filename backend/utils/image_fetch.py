@@ -0,0 +1,285 @@
+"""
+Server-side image download
+Fetch images by URL through a pooled, size-capped, streaming downloader
+"""
+
+import ipaddress
+import os
+import socket
+import threading
+import time
+from collections import deque
+from typing import Dict, Optional, Tuple
+from urllib.parse import urljoin, urlsplit, urlunsplit
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from utils.image_input import ImageTooLargeError
+from utils.singleflight import SingleFlight
+
+IMAGE_FETCH_ENABLED = os.getenv('IMAGE_FETCH_ENABLED', 'true').lower() == 'true'
+IMAGE_FETCH_MAX_BYTES = int(os.getenv('IMAGE_FETCH_MAX_BYTES', 16 * 1024 * 1024))
+IMAGE_FETCH_CONNECT_TIMEOUT = float(os.getenv('IMAGE_FETCH_CONNECT_TIMEOUT', 3.05))  # seconds
+IMAGE_FETCH_READ_TIMEOUT = float(os.getenv('IMAGE_FETCH_READ_TIMEOUT', 10))  # seconds between bytes
+# Wall-clock cap for a whole download, so a slow drip cannot hold a slot
+IMAGE_FETCH_TOTAL_TIMEOUT = float(os.getenv('IMAGE_FETCH_TOTAL_TIMEOUT', 20))
+# Concurrent downloads per worker; further requests queue for a slot
+IMAGE_FETCH_CONCURRENCY = int(os.getenv('IMAGE_FETCH_CONCURRENCY', 8))
+IMAGE_FETCH_QUEUE_TIMEOUT = float(os.getenv('IMAGE_FETCH_QUEUE_TIMEOUT', 5))  # seconds
+IMAGE_FETCH_MAX_REDIRECTS = int(os.getenv('IMAGE_FETCH_MAX_REDIRECTS', 3))
+# Comma-separated hostnames allowed as sources; empty = any public host
+IMAGE_FETCH_ALLOWED_HOSTS = [
+    host.strip().lower() for host in os.getenv('IMAGE_FETCH_ALLOWED_HOSTS', '').split(',') if host.strip()
+]
+# Only for development: lets the server fetch from localhost and private networks
+IMAGE_FETCH_ALLOW_PRIVATE = os.getenv('IMAGE_FETCH_ALLOW_PRIVATE', 'false').lower() == 'true'
+
+FETCH_CHUNK_SIZE = 64 * 1024
+ALLOWED_CONTENT_TYPES = ('image/', 'application/octet-stream', 'binary/octet-stream')
+REDIRECT_STATUSES = frozenset({301, 302, 303, 307, 308})
+
+class ImageFetchError(ValueError):
+    """
+    Raised when an image URL cannot be downloaded
+
+    status is the HTTP status to answer with: 400 for a bad or blocked URL,
+    502 when the source failed, 503 when every download slot is busy and
+    504 when the download was too slow.
+    """
+
+    def __init__(self, message: str, status: int = 400):
+        super().__init__(message)
+        self.status = status
+
+def is_image_url(value) -> bool:
+    return isinstance(value, str) and value[:8].lower().startswith(('http://', 'https://'))
+
+def check_url(url: str) -> Optional[str]:
+    """
+    Reject URLs the server must not fetch
+
+    Only http(s) is allowed, the host must be on IMAGE_FETCH_ALLOWED_HOSTS
+    when that is set, and every address it resolves to must be public
+    (so clients cannot reach internal services through the server).
+
+    Returns:
+        A checked address of the host to connect to, or None when
+        IMAGE_FETCH_ALLOW_PRIVATE skips the check
+
+    Raises:
+        ImageFetchError: If the URL is not allowed
+    """
+    parts = urlsplit(url)
+    if parts.scheme not in ('http', 'https') or not parts.hostname:
+        raise ImageFetchError('imageUrl must be an http(s) URL')
+    if parts.username or parts.password:
+        raise ImageFetchError('imageUrl must not contain credentials')
+    host = parts.hostname.lower()
+    if IMAGE_FETCH_ALLOWED_HOSTS and host not in IMAGE_FETCH_ALLOWED_HOSTS:
+        raise ImageFetchError(f'Fetching images from {host} is not allowed')
+    if IMAGE_FETCH_ALLOW_PRIVATE:
+        return None
+
+    try:
+        infos = socket.getaddrinfo(host, parts.port or (443 if parts.scheme == 'https' else 80),
+                                   proto=socket.IPPROTO_TCP)
+    except (socket.gaierror, UnicodeError):
+        raise ImageFetchError(f'Cannot resolve host {host}')
+    for info in infos:
+        address = ipaddress.ip_address(info[4][0].split('%')[0])
+        if not address.is_global or address.is_multicast:
+            raise ImageFetchError(f'Fetching images from {host} is not allowed')
+    return infos[0][4][0]
+
+def pin_address(url: str, address: Optional[str]) -> Tuple[str, Dict[str, str]]:
+    """
+    Point a URL at an address check_url vetted, so it is not resolved again
+
+    A second DNS lookup could answer with an internal address (DNS
+    rebinding). The Host header keeps the real name; PinnedAddressAdapter
+    also uses it for TLS SNI and the certificate check.
+
+    Returns:
+        (URL to request, extra headers)
+    """
+    if address is None:
+        return url, {}
+    parts = urlsplit(url)
+    host = parts.hostname.encode('idna').decode('ascii') if ':' not in parts.hostname else f"[{parts.hostname}]"
+    ip = f"[{address}]" if ':' in address else address
+    port = f":{parts.port}" if parts.port else ''
+    return urlunsplit(parts._replace(netloc=ip + port)), {'Host': host + port}
+
+class PinnedAddressAdapter(HTTPAdapter):
+    """
+    HTTP adapter for URLs rewritten by pin_address
+
+    Connects to the IP in the URL but verifies TLS against the hostname in
+    the Host header. Connection pools are kept per (address, hostname).
+    """
+
+    def __init__(self, *args, **kwargs):
+        self._local = threading.local()
+        super().__init__(*args, **kwargs)
+
+    def send(self, request, *args, **kwargs):
+        host = request.headers.get('Host')
+        self._local.server_hostname = urlsplit(f"//{host}").hostname if host else None
+        try:
+            return super().send(request, *args, **kwargs)
+        finally:
+            self._local.server_hostname = None
+
+    def get_connection(self, url, proxies=None):
+        server_hostname = getattr(self._local, 'server_hostname', None)
+        if not server_hostname or not url.lower().startswith('https://'):
+            return super().get_connection(url, proxies)
+        return self.poolmanager.connection_from_url(
+            url, pool_kwargs={'server_hostname': server_hostname, 'assert_hostname': server_hostname}
+        )
+
+class FetchStats:
+    """Download counters for this worker process"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._samples = deque(maxlen=512)
+        self.downloads = 0
+        self.errors = 0
+        self.bytes = 0
+        self.rejected_busy = 0
+
+    def record(self, seconds: float, size: int = 0, ok: bool = True):
+        with self._lock:
+            self._samples.append(seconds)
+            self.downloads += 1
+            self.bytes += size
+            if not ok:
+                self.errors += 1
+
+    def record_busy(self):
+        with self._lock:
+            self.rejected_busy += 1
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            samples = sorted(self._samples)
+            snapshot = {
+                'downloads': self.downloads,
+                'errors': self.errors,
+                'bytes': self.bytes,
+                'rejectedBusy': self.rejected_busy
+            }
+        if samples:
+            snapshot['avgMs'] = round(sum(samples) / len(samples) * 1000, 1)
+            snapshot['p95Ms'] = round(samples[min(len(samples) - 1, int(len(samples) * 0.95))] * 1000, 1)
+        return snapshot
+
+_stats = FetchStats()
+_flight = SingleFlight('image-fetch')
+_slots = threading.BoundedSemaphore(IMAGE_FETCH_CONCURRENCY)
+_session: Optional[requests.Session] = None
+_session_pid = None
+_session_lock = threading.Lock()
+
+def _get_session() -> requests.Session:
+    """Keep-alive session for downloads, rebuilt after a fork"""
+    global _session, _session_pid
+    with _session_lock:
+        if _session is None or _session_pid != os.getpid():
+            session = requests.Session()
+            # Connect straight to the checked address; a proxy would resolve the host again
+            session.trust_env = False
+            adapter = PinnedAddressAdapter(pool_connections=16, pool_maxsize=IMAGE_FETCH_CONCURRENCY,
+                                           max_retries=0)
+            session.mount('https://', adapter)
+            session.mount('http://', adapter)
+            _session, _session_pid = session, os.getpid()
+        return _session
+
+def fetch_image(url: str, max_bytes: int = IMAGE_FETCH_MAX_BYTES) -> bytes:
+    """
+    Download an image, sharing the download with concurrent requests for the same URL
+
+    Args:
+        url: http(s) URL of the image
+        max_bytes: Size cap for the image
+
+    Returns:
+        The encoded image bytes
+
+    Raises:
+        ImageFetchError: If the URL is not allowed or the download failed
+        ImageTooLargeError: If the image is larger than max_bytes
+    """
+    if not IMAGE_FETCH_ENABLED:
+        raise ImageFetchError('Fetching images by URL is disabled')
+    if not is_image_url(url) or len(url) > 2048:
+        raise ImageFetchError('imageUrl must be an http(s) URL')
+    data, shared = _flight.do((url, max_bytes), lambda: _download(url, max_bytes))
+    if shared:
+        print(f"🔗 Shared in-flight download of {url[:80]}")
+    return data
+
+def _download(url: str, max_bytes: int) -> bytes:
+    if not _slots.acquire(timeout=IMAGE_FETCH_QUEUE_TIMEOUT):
+        _stats.record_busy()
+        raise ImageFetchError('Too many image downloads in progress, try again shortly', status=503)
+    started = time.monotonic()
+    try:
+        data = _download_with_redirects(url, max_bytes, started)
+    except (ImageFetchError, ImageTooLargeError):
+        _stats.record(time.monotonic() - started, ok=False)
+        raise
+    except requests.RequestException as e:
+        _stats.record(time.monotonic() - started, ok=False)
+        raise ImageFetchError(f'Could not download image: {type(e).__name__}', status=502)
+    finally:
+        _slots.release()
+    elapsed = time.monotonic() - started
+    _stats.record(elapsed, len(data))
+    print(f"📥 Downloaded {len(data) / 1024:.0f}KB in {elapsed * 1000:.0f}ms")
+    return data
+
+def _download_with_redirects(url: str, max_bytes: int, started: float) -> bytes:
+    session = _get_session()
+    for _ in range(IMAGE_FETCH_MAX_REDIRECTS + 1):
+        # Every hop is checked, so a public URL cannot redirect inward, and
+        # fetched from the address that passed the check
+        target, headers = pin_address(url, check_url(url))
+        with session.get(target, headers=headers, stream=True, allow_redirects=False,
+                         timeout=(IMAGE_FETCH_CONNECT_TIMEOUT, IMAGE_FETCH_READ_TIMEOUT)) as response:
+            if response.status_code in REDIRECT_STATUSES and response.headers.get('Location'):
+                url = urljoin(url, response.headers['Location'])
+                continue
+            if response.status_code != 200:
+                raise ImageFetchError(f'Image URL returned {response.status_code}', status=502)
+            return _read_body(response, max_bytes, started)
+    raise ImageFetchError('Image URL redirected too many times', status=502)
+
+def _read_body(response: requests.Response, max_bytes: int, started: float) -> bytes:
+    content_type = response.headers.get('Content-Type', '').split(';')[0].strip().lower()
+    if content_type and not content_type.startswith(ALLOWED_CONTENT_TYPES):
+        raise ImageFetchError(f'Image URL has content type {content_type}, expected an image')
+    try:
+        declared = int(response.headers.get('Content-Length', 0))
+    except ValueError:
+        declared = 0
+    if max_bytes and declared > max_bytes:
+        raise ImageTooLargeError(f'Image exceeds the {max_bytes // (1024 * 1024)}MB size limit')
+
+    buffer = bytearray()
+    for chunk in response.iter_content(FETCH_CHUNK_SIZE):
+        buffer += chunk
+        if max_bytes and len(buffer) > max_bytes:
+            raise ImageTooLargeError(f'Image exceeds the {max_bytes // (1024 * 1024)}MB size limit')
+        if time.monotonic() - started > IMAGE_FETCH_TOTAL_TIMEOUT:
+            raise ImageFetchError('Image download took too long', status=504)
+    if not buffer:
+        raise ImageFetchError('Image URL returned an empty body', status=502)
+    return bytes(buffer)
+
+def fetch_stats() -> Dict:
+    """Download counters plus in-flight deduplication for /health"""
+    return {**_stats.snapshot(), 'dedupe': _flight.stats(), 'enabled': IMAGE_FETCH_ENABLED}
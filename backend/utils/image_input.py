@@ -0,0 +1,151 @@
+"""
+Request-scoped image input
+Decode an upload once and hand each pipeline stage only what it needs
+"""
+
+import base64
+import binascii
+import os
+import tempfile
+import tracemalloc
+from io import BytesIO
+from typing import BinaryIO, Optional, Union
+
+from PIL import Image, ImageOps
+
+# Record per-request peak Python memory (adds tracemalloc overhead)
+DETECT_TRACE_MEMORY = os.getenv('DETECT_TRACE_MEMORY', 'false').lower() == 'true'
+
+# Raw uploads larger than this spill from memory to a temp file while streaming
+UPLOAD_SPOOL_MAX_MEMORY = 1024 * 1024
+UPLOAD_CHUNK_SIZE = 64 * 1024
+
+class ImageTooLargeError(ValueError):
+    """Raised when an uploaded image exceeds the configured size limit"""
+
+def as_bytes(data: Union[bytes, bytearray, memoryview]) -> bytes:
+    """
+    Get a bytes object for a buffer, without copying when it already wraps one
+
+    BytesIO and requests can use an immutable bytes object in place, so
+    handing them the exporter of a full-length memoryview avoids a copy.
+    """
+    if isinstance(data, bytes):
+        return data
+    if isinstance(data, memoryview) and isinstance(data.obj, bytes) and data.nbytes == len(data.obj):
+        return data.obj
+    return bytes(data)
+
+class DecodedImage:
+    """
+    An uploaded image, base64-decoded exactly once
+
+    The encoded bytes are exposed as a memoryview for the detector and the
+    decoded PIL image is built lazily for the renderer. Each can be
+    released as soon as its stage is done so a request never holds every
+    representation at once.
+    """
+
+    def __init__(self, data: bytes):
+        self._data = data
+        self._image = None
+
+    @classmethod
+    def from_data_url(cls, image_base64: str) -> 'DecodedImage':
+        """
+        Decode a base64 data URL (or bare base64 string)
+
+        Raises:
+            ValueError: If the payload is not valid base64
+        """
+        _, _, payload = image_base64.partition(',')
+        try:
+            return cls(base64.b64decode(payload or image_base64))
+        except binascii.Error as e:
+            raise ValueError(f"Invalid base64 image data: {str(e)}")
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO, max_bytes: Optional[int] = None) -> 'DecodedImage':
+        """
+        Read raw image bytes from a request stream
+
+        The body is streamed in chunks through a spooled temp buffer so an
+        oversized upload is rejected as soon as it crosses max_bytes.
+
+        Raises:
+            ImageTooLargeError: If the body is larger than max_bytes
+            ValueError: If the body is empty
+        """
+        total = 0
+        with tempfile.SpooledTemporaryFile(max_size=UPLOAD_SPOOL_MAX_MEMORY) as spool:
+            while True:
+                chunk = stream.read(UPLOAD_CHUNK_SIZE)
+                if not chunk:
+                    break
+                total += len(chunk)
+                if max_bytes is not None and total > max_bytes:
+                    raise ImageTooLargeError(f'Image exceeds the {max_bytes // (1024 * 1024)}MB limit')
+                spool.write(chunk)
+            if not total:
+                raise ValueError('Image is required')
+            spool.seek(0)
+            return cls(spool.read())
+
+    @property
+    def data(self) -> memoryview:
+        """Encoded image bytes, without copying"""
+        if self._data is None:
+            raise ValueError('Image bytes were already released')
+        return memoryview(self._data)
+
+    @property
+    def size_bytes(self) -> int:
+        return len(self._data) if self._data is not None else 0
+
+    @property
+    def image(self) -> Image.Image:
+        """Fully decoded, EXIF-oriented PIL image"""
+        if self._image is None:
+            image = Image.open(BytesIO(as_bytes(self.data)))
+            image.load()
+            self._image = ImageOps.exif_transpose(image)
+        return self._image
+
+    def release_data(self):
+        """Drop the encoded bytes once the detector no longer needs them"""
+        self._data = None
+
+    def release_image(self):
+        """Drop the decoded image once rendering is done"""
+        if self._image is not None:
+            self._image.close()
+        self._image = None
+
+    def release(self):
+        self.release_data()
+        self.release_image()
+
+    def __enter__(self) -> 'DecodedImage':
+        return self
+
+    def __exit__(self, *exc):
+        self.release()
+
+class MemoryTracker:
+    """Measure peak traced Python memory for one request (no-op unless enabled)"""
+
+    def __init__(self, enabled: bool = DETECT_TRACE_MEMORY):
+        self.enabled = enabled
+        self.peak_bytes: Optional[int] = None
+
+    def __enter__(self) -> 'MemoryTracker':
+        if self.enabled:
+            if not tracemalloc.is_tracing():
+                tracemalloc.start()
+            tracemalloc.reset_peak()
+            self._baseline = tracemalloc.get_traced_memory()[0]
+        return self
+
+    def __exit__(self, *exc):
+        if self.enabled:
+            self.peak_bytes = tracemalloc.get_traced_memory()[1] - self._baseline
@@ -0,0 +1,235 @@
+"""
+Asynchronous detection jobs
+Durable SQLite-backed queue with interactive and bulk priority lanes
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+from typing import Dict, Optional
+
+from sqlalchemy import and_, or_
+
+from utils.database import db, DetectionJob
+from utils.image_input import DecodedImage
+from utils.yolo import run_detection
+
+JOB_WORKERS = int(os.getenv('JOB_WORKERS', 2))  # threads per gunicorn worker
+JOB_LEASE_SECONDS = int(os.getenv('JOB_LEASE_SECONDS', 120))
+JOB_MAX_ATTEMPTS = int(os.getenv('JOB_MAX_ATTEMPTS', 3))
+# A failed attempt waits this long before it can run again, doubling per attempt
+JOB_RETRY_DELAY = float(os.getenv('JOB_RETRY_DELAY', 10))  # seconds
+JOB_RETRY_MAX_DELAY = 300
+# The detector call must finish this long before the lease runs out, so a
+# slow attempt is never reclaimed (and run twice) by another worker
+JOB_LEASE_MARGIN = 10  # seconds
+JOB_POLL_INTERVAL = float(os.getenv('JOB_POLL_INTERVAL', 0.5))  # seconds
+JOB_MAX_WAIT = float(os.getenv('JOB_MAX_WAIT', 25))  # long-poll cap in seconds
+JOB_RETENTION_HOURS = int(os.getenv('JOB_RETENTION_HOURS', 24))
+# Every Nth claim looks at the bulk lane first so bulk jobs are never starved
+JOB_BULK_EVERY = int(os.getenv('JOB_BULK_EVERY', 5))
+
+LANES = {'interactive': 0, 'bulk': 1}
+TERMINAL_STATUSES = ('done', 'failed')
+
+# Wakes idle workers in this process as soon as a job is enqueued here;
+# jobs enqueued by other workers are picked up on the next poll
+_wakeup = threading.Event()
+_started_pid = None
+_start_lock = threading.Lock()
+
+def job_to_dict(job: DetectionJob) -> Dict:
+    """Public representation of a job (never includes the image)"""
+    data = {
+        'jobId': job.id,
+        'status': job.status,
+        'lane': 'bulk' if job.priority else 'interactive',
+        'attempts': job.attempts,
+        'createdAt': job.created_at.isoformat() if job.created_at else None,
+        'startedAt': job.started_at.isoformat() if job.started_at else None,
+        'finishedAt': job.finished_at.isoformat() if job.finished_at else None
+    }
+    if job.status == 'done':
+        data['detections'] = json.loads(job.result or '[]')
+    if job.status == 'failed':
+        data['error'] = job.error
+    return data
+
+def enqueue_job(user_id: str, image_data: bytes, lane: str = 'interactive') -> Dict:
+    """
+    Persist a detection job and wake a worker
+
+    Args:
+        user_id: Owner of the job
+        image_data: Encoded image bytes
+        lane: 'interactive' or 'bulk'
+
+    Returns:
+        Job dictionary
+
+    Raises:
+        ValueError: If the lane is unknown
+    """
+    if lane not in LANES:
+        raise ValueError(f"Unknown lane '{lane}'. Choose from: {', '.join(LANES)}")
+
+    job = DetectionJob(user_id=user_id, image=image_data, priority=LANES[lane])
+    db.session.add(job)
+    db.session.commit()
+    _wakeup.set()
+    return job_to_dict(job)
+
+def get_job(job_id: str, user_id: str) -> Optional[Dict]:
+    """Find a job owned by the given user"""
+    job = DetectionJob.query.filter_by(id=job_id, user_id=user_id).first()
+    return job_to_dict(job) if job else None
+
+def wait_for_job(job_id: str, user_id: str, timeout: float) -> Optional[Dict]:
+    """
+    Long-poll a job until it finishes or the timeout passes
+
+    Returns:
+        Latest job dictionary, or None if the job does not exist
+    """
+    deadline = time.monotonic() + min(timeout, JOB_MAX_WAIT)
+    while True:
+        job = get_job(job_id, user_id)
+        if job is None or job['status'] in TERMINAL_STATUSES or time.monotonic() >= deadline:
+            return job
+        # Drop the identity map so the next read sees other workers' commits
+        db.session.expire_all()
+        time.sleep(min(JOB_POLL_INTERVAL, max(0.0, deadline - time.monotonic())))
+
+def _claimable(now: datetime):
+    # Queued jobs (once a retried job's delay has passed), plus running jobs
+    # whose worker died before the lease ran out
+    return or_(
+        and_(DetectionJob.status == 'queued',
+             or_(DetectionJob.lease_expires_at.is_(None), DetectionJob.lease_expires_at < now)),
+        and_(DetectionJob.status == 'running', DetectionJob.lease_expires_at < now)
+    )
+
+def retry_delay(attempts: int) -> float:
+    """Seconds before a job that failed its Nth attempt may run again"""
+    return min(JOB_RETRY_DELAY * 2 ** max(attempts - 1, 0), JOB_RETRY_MAX_DELAY)
+
+def claim_next_job(prefer_bulk: bool = False) -> Optional[DetectionJob]:
+    """
+    Atomically claim the next runnable job
+
+    The conditional UPDATE makes the claim safe across threads and
+    gunicorn workers sharing the same SQLite file.
+    """
+    now = datetime.utcnow()
+    priority_order = DetectionJob.priority.desc() if prefer_bulk else DetectionJob.priority
+    candidate = (
+        DetectionJob.query
+        .with_entities(DetectionJob.id)
+        .filter(_claimable(now))
+        .order_by(priority_order, DetectionJob.created_at)
+        .first()
+    )
+    if candidate is None:
+        return None
+
+    claimed = (
+        DetectionJob.query
+        .filter(DetectionJob.id == candidate.id, _claimable(now))
+        .update({
+            'status': 'running',
+            'attempts': DetectionJob.attempts + 1,
+            'started_at': now,
+            'lease_expires_at': now + timedelta(seconds=JOB_LEASE_SECONDS)
+        }, synchronize_session=False)
+    )
+    db.session.commit()
+    if not claimed:
+        return None
+    return db.session.get(DetectionJob, candidate.id)
+
+def finish_job(job: DetectionJob, detections=None, error: Optional[str] = None):
+    """Record a job's outcome and free its stored image"""
+    job.status = 'failed' if error else 'done'
+    job.result = json.dumps(detections) if detections is not None else None
+    job.error = error
+    job.image = None
+    job.lease_expires_at = None
+    job.finished_at = datetime.utcnow()
+    db.session.commit()
+
+def run_job(job: DetectionJob):
+    """Run detection for a claimed job"""
+    if job.attempts > JOB_MAX_ATTEMPTS:
+        finish_job(job, error='Job exceeded the maximum number of attempts')
+        return
+    deadline = time.monotonic() + max(JOB_LEASE_SECONDS - JOB_LEASE_MARGIN, 1)
+    try:
+        # The raising path: a detector failure is retried, never stored as
+        # mock detections
+        with DecodedImage(job.image) as decoded:
+            detections = run_detection(decoded.data, deadline)
+    except Exception as e:
+        print(f"⚠️ Detection job {job.id} failed: {str(e)}")
+        if job.attempts >= JOB_MAX_ATTEMPTS:
+            finish_job(job, error='Detection failed')
+        else:
+            # Hand it back to the queue; for a queued job the lease column
+            # holds the time it may be claimed again
+            delay = retry_delay(job.attempts)
+            job.status = 'queued'
+            job.lease_expires_at = datetime.utcnow() + timedelta(seconds=delay)
+            db.session.commit()
+            print(f"🔁 Retrying detection job {job.id} in {delay:.0f}s")
+        return
+    finish_job(job, detections=detections)
+
+def purge_finished_jobs():
+    """Delete finished jobs older than JOB_RETENTION_HOURS"""
+    cutoff = datetime.utcnow() - timedelta(hours=JOB_RETENTION_HOURS)
+    DetectionJob.query.filter(
+        DetectionJob.status.in_(TERMINAL_STATUSES),
+        DetectionJob.finished_at < cutoff
+    ).delete(synchronize_session=False)
+    db.session.commit()
+
+def _worker_loop(app, index: int):
+    claims = 0
+    while True:
+        try:
+            with app.app_context():
+                claims += 1
+                job = claim_next_job(prefer_bulk=JOB_BULK_EVERY > 0 and claims % JOB_BULK_EVERY == 0)
+                if job is not None:
+                    run_job(job)
+                    continue
+                if index == 0 and claims % 1000 == 0:
+                    purge_finished_jobs()
+        except Exception as e:
+            print(f"⚠️ Job worker error: {str(e)}")
+        _wakeup.wait(JOB_POLL_INTERVAL)
+        _wakeup.clear()
+
+def start_job_workers(app):
+    """
+    Start the background job workers for this process
+
+    Safe to call repeatedly: threads are started once per process, so it
+    works both from gunicorn's post_fork hook and lazily on first request.
+    """
+    global _started_pid
+    if _started_pid == os.getpid() or JOB_WORKERS <= 0:
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        for index in range(JOB_WORKERS):
+            threading.Thread(
+                target=_worker_loop,
+                args=(app, index),
+                name=f'detect-job-{index}',
+                daemon=True
+            ).start()
+        _started_pid = os.getpid()
+        print(f"🧵 Started {JOB_WORKERS} detection job workers in process {os.getpid()}")
@@ -0,0 +1,204 @@
+"""
+Near-duplicate image index
+Perceptual hashes (dHash) in a BK-tree, so re-saved, resized or
+recompressed uploads can reuse earlier detections
+"""
+
+import os
+import threading
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image, ImageOps
+
+from utils.cache import DETECTION_CACHE_ENABLED
+from utils.image_input import as_bytes
+from utils.preprocess import EXIF_ORIENTATION_TAG, TRANSPOSED_ORIENTATIONS
+
+NEAR_DUP_ENABLED = os.getenv('NEAR_DUP_ENABLED', 'true').lower() == 'true' and DETECTION_CACHE_ENABLED
+NEAR_DUP_MAX_DISTANCE = int(os.getenv('NEAR_DUP_MAX_DISTANCE', 4))  # differing bits out of 64
+NEAR_DUP_MAX_ITEMS = int(os.getenv('NEAR_DUP_MAX_ITEMS', 10000))
+# Relative aspect ratio difference still treated as the same picture
+NEAR_DUP_ASPECT_TOLERANCE = float(os.getenv('NEAR_DUP_ASPECT_TOLERANCE', 0.02))
+
+HASH_WIDTH, HASH_HEIGHT = 9, 8  # 8x8 horizontal gradients -> 64-bit hash
+
+class Fingerprint(NamedTuple):
+    """Perceptual hash plus the upright size of the image it came from"""
+    hash: int
+    width: int
+    height: int
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count('1')
+
+def fingerprint_image(image_data: Union[bytes, memoryview]) -> Fingerprint:
+    """
+    Compute the dHash of an encoded image
+
+    JPEGs are decoded at 1/8 scale; EXIF orientation is applied so a
+    rotated-by-tag copy and a rotated-by-pixels copy hash the same.
+    """
+    image = Image.open(BytesIO(as_bytes(image_data)))
+    width, height = image.size
+    if image.getexif().get(EXIF_ORIENTATION_TAG, 1) in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+    if image.format == 'JPEG':
+        image.draft('L', (HASH_WIDTH * 4, HASH_HEIGHT * 4))
+    image = ImageOps.exif_transpose(image).convert('L').resize((HASH_WIDTH, HASH_HEIGHT), Image.BILINEAR)
+
+    pixels = list(image.getdata())
+    value = 0
+    for row in range(HASH_HEIGHT):
+        offset = row * HASH_WIDTH
+        for col in range(HASH_WIDTH - 1):
+            value = (value << 1) | (pixels[offset + col] < pixels[offset + col + 1])
+    return Fingerprint(value, width, height)
+
+class BKTree:
+    """
+    Burkhard-Keller tree over 64-bit hashes with Hamming distance
+
+    Nodes are never removed; callers keep their own set of live hashes and
+    rebuild the tree once too many dead ones have piled up.
+    """
+
+    def __init__(self):
+        self.root = None  # [hash, {distance: child}]
+        self.size = 0
+
+    def add(self, value: int):
+        if self.root is None:
+            self.root = [value, {}]
+            self.size = 1
+            return
+        node = self.root
+        while True:
+            distance = hamming(value, node[0])
+            if distance == 0:
+                return
+            child = node[1].get(distance)
+            if child is None:
+                node[1][distance] = [value, {}]
+                self.size += 1
+                return
+            node = child
+
+    def search(self, value: int, radius: int) -> List[Tuple[int, int]]:
+        """All (distance, hash) pairs within radius, closest first"""
+        if self.root is None:
+            return []
+        found = []
+        stack = [self.root]
+        while stack:
+            node_value, children = stack.pop()
+            distance = hamming(value, node_value)
+            if distance <= radius:
+                found.append((distance, node_value))
+            # Triangle inequality: only these subtrees can hold matches
+            for child_distance, child in children.items():
+                if distance - radius <= child_distance <= distance + radius:
+                    stack.append(child)
+        found.sort()
+        return found
+
+class NearDuplicateIndex:
+    """
+    Bounded in-process index from perceptual hash to cached detections
+
+    Entries point at detection cache keys rather than holding detections,
+    so the cache stays the single source of results. The oldest entries
+    are evicted past max_items; their tree nodes become tombstones until
+    the next rebuild.
+    """
+
+    def __init__(self, max_items: int = NEAR_DUP_MAX_ITEMS, max_distance: int = NEAR_DUP_MAX_DISTANCE,
+                 aspect_tolerance: float = NEAR_DUP_ASPECT_TOLERANCE):
+        self.max_items = max_items
+        self.max_distance = max_distance
+        self.aspect_tolerance = aspect_tolerance
+        self._tree = BKTree()
+        self._entries = OrderedDict()  # (scope, hash) -> (cache key, width, height)
+        self._hashes = {}  # hash -> number of live entries using it
+        self._lock = threading.Lock()
+        self._stats = {'lookups': 0, 'nearHits': 0, 'rejectedAspect': 0}
+
+    def add(self, scope: str, fingerprint: Fingerprint, cache_key: str):
+        """Remember which cached result belongs to this image"""
+        if self.max_items <= 0:
+            return
+        key = (scope, fingerprint.hash)
+        with self._lock:
+            if key not in self._entries:
+                self._hashes[fingerprint.hash] = self._hashes.get(fingerprint.hash, 0) + 1
+                self._tree.add(fingerprint.hash)
+            self._entries[key] = (cache_key, fingerprint.width, fingerprint.height)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_items:
+                self._forget(self._entries.popitem(last=False)[0][1])
+            if self._tree.size > 2 * len(self._hashes) + 64:
+                self._rebuild()
+
+    def find(self, scope: str, fingerprint: Fingerprint) -> Optional[Dict]:
+        """
+        Closest earlier image within max_distance and with the same shape
+
+        Returns:
+            {"cacheKey", "hash", "width", "height", "distance"}, or None
+        """
+        with self._lock:
+            self._stats['lookups'] += 1
+            for distance, value in self._tree.search(fingerprint.hash, self.max_distance):
+                entry = self._entries.get((scope, value))
+                if entry is None:
+                    continue
+                cache_key, width, height = entry
+                if not self._same_shape(fingerprint, width, height):
+                    self._stats['rejectedAspect'] += 1
+                    continue
+                self._entries.move_to_end((scope, value))
+                return {'cacheKey': cache_key, 'hash': value, 'width': width, 'height': height,
+                        'distance': distance}
+        return None
+
+    def record_hit(self):
+        with self._lock:
+            self._stats['nearHits'] += 1
+
+    def discard(self, scope: str, fingerprint_hash: int):
+        """Drop an entry whose cached result has expired"""
+        with self._lock:
+            if self._entries.pop((scope, fingerprint_hash), None) is not None:
+                self._forget(fingerprint_hash)
+
+    def stats(self) -> Dict:
+        """Near-duplicate counters for this worker process"""
+        with self._lock:
+            stats = dict(self._stats)
+            stats['items'] = len(self._entries)
+        stats['hitRate'] = round(stats['nearHits'] / stats['lookups'], 4) if stats['lookups'] else 0.0
+        stats['maxDistance'] = self.max_distance
+        stats['enabled'] = NEAR_DUP_ENABLED
+        return stats
+
+    def _same_shape(self, fingerprint: Fingerprint, width: int, height: int) -> bool:
+        if not (width and height and fingerprint.width and fingerprint.height):
+            return False
+        ratio = (fingerprint.width / fingerprint.height) / (width / height)
+        return abs(ratio - 1.0) <= self.aspect_tolerance
+
+    def _forget(self, value: int):
+        remaining = self._hashes.get(value, 0) - 1
+        if remaining > 0:
+            self._hashes[value] = remaining
+        else:
+            self._hashes.pop(value, None)
+
+    def _rebuild(self):
+        tree = BKTree()
+        for value in self._hashes:
+            tree.add(value)
+        self._tree = tree
+
+near_duplicate_index = NearDuplicateIndex()
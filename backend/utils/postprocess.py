@@ -0,0 +1,153 @@
+"""
+Detection post-processing
+Vectorized (NumPy) box operations shared by the detector backends,
+tiled inference and request-level filtering
+"""
+
+from typing import Dict, List, Mapping, Optional, Tuple
+
+import numpy as np
+
+def detections_to_arrays(detections: List[Dict]) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    """
+    Pack detections into arrays
+
+    Returns:
+        (boxes as float32 (N, 4) x1/y1/x2/y2, scores (N,), labels (N,) object array)
+    """
+    count = len(detections)
+    boxes = np.empty((count, 4), dtype=np.float32)
+    scores = np.empty(count, dtype=np.float32)
+    labels = np.empty(count, dtype=object)
+    for i, detection in enumerate(detections):
+        bbox = detection.get('bbox') or {}
+        x, y = bbox.get('x', 0), bbox.get('y', 0)
+        boxes[i] = (x, y, x + bbox.get('width', 0), y + bbox.get('height', 0))
+        scores[i] = detection.get('score', 0.0)
+        labels[i] = detection.get('label', 'Unknown')
+    return boxes, scores, labels
+
+def nms(boxes: np.ndarray, scores: np.ndarray, class_ids: np.ndarray = None,
+        iou_threshold: float = 0.5) -> List[int]:
+    """
+    Class-aware greedy non-maximum suppression, highest score first
+
+    Args:
+        boxes: (N, 4) x1/y1/x2/y2 boxes
+        scores: (N,) confidence scores
+        class_ids: (N,) integer classes; boxes of different classes never
+            suppress each other. None treats all boxes as one class.
+        iou_threshold: IoU above which the lower-scored box is dropped
+
+    Returns:
+        Indices of the kept boxes, in descending score order
+    """
+    if len(boxes) == 0:
+        return []
+    boxes = boxes.astype(np.float32, copy=False)
+    if class_ids is not None:
+        # Offset each class into its own coordinate range so boxes of
+        # different classes never overlap
+        offsets = class_ids.astype(np.float32)[:, None] * (boxes.max() + 1)
+        boxes = boxes + offsets
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+    order = scores.argsort()[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        order = rest[iou <= iou_threshold]
+    return keep
+
+def _label_list(value) -> List[str]:
+    if value is None or value == '':
+        return []
+    if isinstance(value, str):
+        value = value.split(',')
+    if not isinstance(value, (list, tuple)):
+        raise ValueError('labels and excludeLabels must be a list or comma-separated string')
+    return [str(label).strip().lower() for label in value if str(label).strip()]
+
+def parse_postprocess_options(params: Mapping) -> Optional[Dict]:
+    """
+    Read result filtering options from request params
+
+    Args:
+        params: JSON body, form fields or query args with optional
+            minScore (0-1), labels / excludeLabels (list or comma-separated),
+            nmsIou (IoU threshold 0-1) and topK
+
+    Returns:
+        {"min_score", "labels", "exclude_labels", "nms_iou", "top_k"}, or
+        None when no option was given
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    try:
+        min_score = params.get('minScore')
+        min_score = float(min_score) if min_score not in (None, '') else None
+        nms_iou = params.get('nmsIou')
+        nms_iou = float(nms_iou) if nms_iou not in (None, '') else None
+        top_k = params.get('topK')
+        top_k = int(top_k) if top_k not in (None, '') else None
+    except (TypeError, ValueError):
+        raise ValueError('minScore and nmsIou must be numbers, topK an integer')
+    if min_score is not None and not 0 <= min_score <= 1:
+        raise ValueError('minScore must be between 0 and 1')
+    if nms_iou is not None and not 0 < nms_iou <= 1:
+        raise ValueError('nmsIou must be between 0 and 1')
+    if top_k is not None and top_k < 1:
+        raise ValueError('topK must be at least 1')
+
+    options = {
+        'min_score': min_score,
+        'labels': _label_list(params.get('labels')),
+        'exclude_labels': _label_list(params.get('excludeLabels')),
+        'nms_iou': nms_iou,
+        'top_k': top_k
+    }
+    if not any(options.values()):
+        return None
+    return options
+
+def apply_postprocess(detections: List[Dict], options: Optional[Dict]) -> List[Dict]:
+    """
+    Filter detections by score and label, run class-aware NMS and keep the top k
+
+    Works on the whole result as arrays; the detections themselves are not
+    copied or modified.
+
+    Returns:
+        Surviving detections, highest score first (unchanged if options is None)
+    """
+    if not options or not detections:
+        return detections
+
+    boxes, scores, labels = detections_to_arrays(detections)
+    labels = np.char.lower(labels.astype(str))
+    keep = np.ones(len(detections), dtype=bool)
+    if options['min_score'] is not None:
+        keep &= scores >= options['min_score']
+    if options['labels']:
+        keep &= np.isin(labels, options['labels'])
+    if options['exclude_labels']:
+        keep &= ~np.isin(labels, options['exclude_labels'])
+
+    indices = np.flatnonzero(keep)
+    if options['nms_iou'] is not None and indices.size > 1:
+        _, class_ids = np.unique(labels[indices], return_inverse=True)
+        indices = indices[nms(boxes[indices], scores[indices], class_ids, options['nms_iou'])]
+    else:
+        indices = indices[np.argsort(-scores[indices], kind='stable')]
+    if options['top_k'] is not None:
+        indices = indices[:options['top_k']]
+
+    return [detections[i] for i in indices]
@@ -0,0 +1,104 @@
+"""
+Image preprocessing for inference
+Downscale uploads before they reach the detector and map boxes back
+"""
+
+import os
+from io import BytesIO
+from typing import Dict, List, NamedTuple, Union
+
+from PIL import Image, ImageOps
+
+from utils.image_input import as_bytes
+
+PREPROCESS_ENABLED = os.getenv('PREPROCESS_ENABLED', 'true').lower() == 'true'
+PREPROCESS_MAX_SIDE = int(os.getenv('PREPROCESS_MAX_SIDE', 800))  # pixels
+PREPROCESS_JPEG_QUALITY = int(os.getenv('PREPROCESS_JPEG_QUALITY', 85))
+
+# EXIF orientations that rotate the image by 90 or 270 degrees
+TRANSPOSED_ORIENTATIONS = {5, 6, 7, 8}
+EXIF_ORIENTATION_TAG = 0x0112
+
+class PreparedImage(NamedTuple):
+    """Encoded image sent to the detector plus the mapping back to the original"""
+    data: Union[bytes, memoryview]
+    width: int  # original width, after EXIF orientation
+    height: int  # original height, after EXIF orientation
+    scale_x: float  # original / prepared
+    scale_y: float
+
+def prepare_for_inference(image_data: Union[bytes, memoryview],
+                          max_side: int = PREPROCESS_MAX_SIDE) -> PreparedImage:
+    """
+    Downscale an image for inference
+
+    JPEGs are decoded at reduced size with draft mode, EXIF orientation is
+    applied, the longest side is capped at max_side and the result is
+    re-encoded as a compact JPEG. Images that are already small and upright
+    are passed through untouched. With PREPROCESS_ENABLED=false the size is
+    kept, but EXIF orientation is still applied.
+
+    Args:
+        image_data: Original encoded image bytes
+        max_side: Maximum width/height sent to the detector
+
+    Returns:
+        PreparedImage with the bytes to send and the scale back to the original
+    """
+    image = Image.open(BytesIO(as_bytes(image_data)))
+    orientation = image.getexif().get(EXIF_ORIENTATION_TAG, 1)
+    width, height = image.size
+    if orientation in TRANSPOSED_ORIENTATIONS:
+        width, height = height, width
+
+    # Without preprocessing, only EXIF orientation is applied: the renderer
+    # draws on the transposed image, so the detector must see it upright too
+    resize = PREPROCESS_ENABLED and max(width, height) > max_side
+    if not resize and orientation == 1:
+        return PreparedImage(image_data, width, height, 1.0, 1.0)
+
+    if resize and image.format == 'JPEG':
+        # Let libjpeg decode at 1/2, 1/4 or 1/8 scale, never below target
+        scale = max_side / max(width, height)
+        target = (max(1, int(width * scale)), max(1, int(height * scale)))
+        if orientation in TRANSPOSED_ORIENTATIONS:
+            target = target[::-1]
+        image.draft('RGB', target)
+
+    image = ImageOps.exif_transpose(image)
+    if image.mode != 'RGB':
+        image = image.convert('RGB')
+    if resize:
+        image.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+
+    buffered = BytesIO()
+    image.save(buffered, format='JPEG', quality=PREPROCESS_JPEG_QUALITY)
+    prepared = buffered.getvalue()
+
+    print(f"🗜️ {'Downscaled' if resize else 'Rotated'} {width}x{height} ({len(image_data) // 1024}KB) -> "
+          f"{image.width}x{image.height} ({len(prepared) // 1024}KB)")
+
+    return PreparedImage(prepared, width, height, width / image.width, height / image.height)
+
+def rescale_detections(detections: List[Dict], prepared: PreparedImage) -> List[Dict]:
+    """
+    Map detection boxes from prepared-image to original-image coordinates
+
+    Args:
+        detections: Detections returned for the prepared image
+        prepared: The PreparedImage the detector saw
+
+    Returns:
+        The same detections with bboxes in original pixel coordinates
+    """
+    if prepared.scale_x == 1.0 and prepared.scale_y == 1.0:
+        return detections
+
+    for detection in detections:
+        bbox = detection.get('bbox', {})
+        x1 = min(prepared.width, max(0, round(bbox.get('x', 0) * prepared.scale_x)))
+        y1 = min(prepared.height, max(0, round(bbox.get('y', 0) * prepared.scale_y)))
+        x2 = min(prepared.width, round((bbox.get('x', 0) + bbox.get('width', 0)) * prepared.scale_x))
+        y2 = min(prepared.height, round((bbox.get('y', 0) + bbox.get('height', 0)) * prepared.scale_y))
+        detection['bbox'] = {'x': x1, 'y': y1, 'width': max(0, x2 - x1), 'height': max(0, y2 - y1)}
+    return detections
@@ -0,0 +1,209 @@
+"""
+Prompt context for Q&A
+Describes a detection set to the model within a token budget: every box
+when they fit, otherwise per-label summaries plus the boxes that matter
+"""
+
+import os
+import threading
+from collections import Counter
+from typing import Dict, FrozenSet, List
+
+from utils.query_engine import DetectionIndex, find_region, normalize, plural
+
+# Estimated tokens the detections may take up in a prompt
+QA_CONTEXT_TOKEN_BUDGET = int(os.getenv('QA_CONTEXT_TOKEN_BUDGET', 2000))
+# Individual boxes kept in a summarized context, best scored and largest
+QA_CONTEXT_TOP_BOXES = int(os.getenv('QA_CONTEXT_TOP_BOXES', 20))
+
+# Overlapping pairs listed in the prompt, largest overlap first
+CONTEXT_OVERLAP_PAIRS = 20
+CONTEXT_MIN_IOU = 0.05
+# Share of a summarized context's budget held back for question-relevant boxes
+RELEVANT_SHARE = 0.3
+CHARS_PER_TOKEN = 4
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (about four characters per token for English and numbers)"""
+    return (len(text) + CHARS_PER_TOKEN - 1) // CHARS_PER_TOKEN
+
+class PromptContext:
+    """
+    Question-independent description of one detection set
+
+    summarized is True when the boxes did not fit the budget; listed holds
+    the detections that still appear individually.
+    """
+    __slots__ = ('text', 'tokens', 'summarized', 'listed')
+
+    def __init__(self, text: str, summarized: bool = False, listed: FrozenSet[int] = frozenset()):
+        self.text = text
+        self.tokens = estimate_tokens(text)
+        self.summarized = summarized
+        self.listed = listed
+
+class _Lines:
+    """Context lines that stop accepting text once the budget is spent"""
+
+    def __init__(self, budget: int):
+        self.budget = budget
+        self.tokens = 0
+        self.lines: List[str] = []
+
+    def add(self, line: str) -> bool:
+        cost = estimate_tokens(line) + 1
+        if self.tokens + cost > self.budget:
+            return False
+        self.lines.append(line)
+        self.tokens += cost
+        return True
+
+    def note(self, line: str):
+        """Add a short closing line even if it goes slightly over"""
+        self.lines.append(line)
+        self.tokens += estimate_tokens(line) + 1
+
+    def text(self) -> str:
+        return "\n".join(self.lines)
+
+def detection_line(index: DetectionIndex, i: int) -> str:
+    item = index.items[i]
+    return (
+        f"{i + 1}. {item.label} (confidence: {item.score:.1%}, "
+        f"location: x={item.x}, y={item.y}, "
+        f"width={item.width}, height={item.height}, position: {index.spatial.region_of(i)})"
+    )
+
+def compose_context(index: DetectionIndex, budget: int = QA_CONTEXT_TOKEN_BUDGET) -> PromptContext:
+    """
+    Describe a detection set for the prompt
+
+    Every detection is listed, with the most overlapping pairs, when that
+    fits the budget. Otherwise the context summarizes each label (count,
+    confidence range, extent, where in the image) and lists only the
+    QA_CONTEXT_TOP_BOXES best scored and largest boxes, keeping part of
+    the budget for detections relevant to the question.
+    """
+    if not index.items:
+        return PromptContext("No objects detected in the image.")
+
+    full = _Lines(budget)
+    complete = all(full.add(detection_line(index, i)) for i in range(len(index.items)))
+    if complete:
+        pairs = index.spatial.overlapping_pairs(CONTEXT_MIN_IOU, limit=CONTEXT_OVERLAP_PAIRS)
+        if pairs:
+            full.add("")
+            full.add("Overlapping objects:")
+            for i, j, iou in pairs:
+                if not full.add(f"- {i + 1}. {index.items[i].label} and {j + 1}. {index.items[j].label} (IoU: {iou:.0%})"):
+                    break
+        return PromptContext(full.text(), listed=frozenset(range(len(index.items))))
+
+    lines = _Lines(int(budget * (1 - RELEVANT_SHARE)))
+    lines.add(f"{len(index.items)} objects were detected, too many to list one by one. "
+              f"Summary by label:")
+    shown_labels = 0
+    for key, count in index.counts.most_common():
+        if not lines.add(_label_line(index, key, count)):
+            break
+        shown_labels += 1
+    if shown_labels < len(index.counts):
+        rest = sum(count for _, count in index.counts.most_common()[shown_labels:])
+        lines.note(f"- {len(index.counts) - shown_labels} more labels with {rest} objects in total")
+
+    listed = []
+    if lines.add("") and lines.add("Most confident and largest objects (numbered as in the full detection list):"):
+        for i in _top_boxes(index, QA_CONTEXT_TOP_BOXES):
+            if not lines.add(detection_line(index, i)):
+                break
+            listed.append(i)
+    print(f"🗜️ Summarized {len(index.items)} detections into ~{lines.tokens} tokens")
+    return PromptContext(lines.text(), summarized=True, listed=frozenset(listed))
+
+def _label_line(index: DetectionIndex, key: str, count: int) -> str:
+    members = [index.items[i] for i in index.indices(key)]
+    scores = [item.score for item in members]
+    x0 = min(item.x for item in members)
+    y0 = min(item.y for item in members)
+    x1 = max(item.x + item.width for item in members)
+    y1 = max(item.y + item.height for item in members)
+    regions = Counter(index.spatial.region_of(i) for i in index.indices(key))
+    where = ', '.join(region for region, _ in regions.most_common(2))
+    return (f"- {plural(index.name(key), count)}: {count} (confidence {min(scores):.0%}-{max(scores):.0%}, "
+            f"average {sum(scores) / count:.0%}; spanning x={x0:.0f}-{x1:.0f}, y={y0:.0f}-{y1:.0f}; "
+            f"mostly {where})")
+
+def _top_boxes(index: DetectionIndex, limit: int) -> List[int]:
+    """Best scored and largest detections, alternating, without repeats"""
+    chosen = []
+    seen = set()
+    for pair in zip(index.by_score, index.by_area):
+        for i in pair:
+            if i not in seen:
+                seen.add(i)
+                chosen.append(i)
+        if len(chosen) >= limit:
+            break
+    return chosen[:limit]
+
+def relevant_context(index: DetectionIndex, questions: List[str], exclude: FrozenSet[int],
+                     budget: int) -> str:
+    """
+    Detections named by the questions (by label, region or both) that the
+    summarized context does not already list, highest score first
+    """
+    candidates: List[int] = []
+    for question in questions:
+        text = normalize(question)
+        region, _ = find_region(text)
+        inside = set(index.spatial.in_region(region)) if region else None
+        keys = [key for key, _ in index.find_labels(text)]
+        if keys:
+            for key in keys:
+                candidates += [i for i in index.indices(key) if inside is None or i in inside]
+        elif inside is not None:
+            candidates += [i for i in index.by_score if i in inside]
+
+    matching = []
+    seen = set(exclude)
+    for i in candidates:
+        if i not in seen:
+            seen.add(i)
+            matching.append(i)
+
+    lines = _Lines(budget)
+    if not matching or not lines.add(f"Detections relevant to the question{'s' if len(questions) > 1 else ''}:"):
+        return ''
+    shown = 0
+    for i in matching:
+        if not lines.add(detection_line(index, i)):
+            break
+        shown += 1
+    if shown < len(matching):
+        lines.note(f"- {len(matching) - shown} more matching detections not listed")
+    return lines.text() if shown else ''
+
+# Context sizes of prompts built in this worker process
+_stats = {'prompts': 0, 'summarized': 0, 'tokens': 0, 'maxTokens': 0}
+_stats_lock = threading.Lock()
+
+def record_context(tokens: int, summarized: bool):
+    with _stats_lock:
+        _stats['prompts'] += 1
+        _stats['summarized'] += int(summarized)
+        _stats['tokens'] += tokens
+        _stats['maxTokens'] = max(_stats['maxTokens'], tokens)
+
+def context_stats() -> Dict:
+    """Estimated context tokens per prompt and how often detections were summarized"""
+    with _stats_lock:
+        stats = dict(_stats)
+    prompts = stats.pop('prompts')
+    total = stats.pop('tokens')
+    return {
+        'prompts': prompts,
+        'summarized': stats['summarized'],
+        'avgTokens': round(total / prompts, 1) if prompts else 0.0,
+        'maxTokens': stats['maxTokens'],
+        'budget': QA_CONTEXT_TOKEN_BUDGET
+    }
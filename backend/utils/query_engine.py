@@ -0,0 +1,593 @@
+"""
+Local question answering over detections
+Answers structured questions (counts, thresholds, extremes, presence,
+positions and spatial relations) straight from an index of the
+detection set, without an LLM call
+"""
+
+import bisect
+import os
+import re
+import threading
+from collections import Counter
+from typing import Dict, List, Optional, Tuple
+
+from utils.cache import LRUCache
+from utils.detectors import COCO_LABELS
+from utils.spatial import SpatialIndex
+
+QA_LOCAL_ENABLED = os.getenv('QA_LOCAL_ENABLED', 'true').lower() == 'true'
+QA_INDEX_CACHE_ITEMS = int(os.getenv('QA_INDEX_CACHE_ITEMS', 256))
+QA_INDEX_CACHE_TTL = 600  # seconds
+# Objects count as "next to" each other within this fraction of the
+# reference box's longer side
+QA_NEAR_DISTANCE = float(os.getenv('QA_NEAR_DISTANCE', 0.5))
+
+IRREGULAR_PLURALS = {
+    'person': ['people', 'persons'], 'man': ['men'], 'woman': ['women'], 'child': ['children'],
+    'mouse': ['mice'], 'knife': ['knives'], 'sheep': ['sheep'], 'skis': ['skis'], 'scissors': ['scissors']
+}
+
+# Words that carry no meaning beyond the intent itself. A question whose
+# leftover words are not all in here is too specific to answer locally.
+STOPWORDS = frozenset('''
+a an the is are was were be there here this that these those it its in on of at to for from by with
+do does did you i me we can could would please tell show give list image picture photo scene frame
+object objects item items thing things detection detections detected found identified recognized
+visible present see spot notice any some all total overall exactly number count many much how what
+which confidence confident score scores percent level have has got contain contains one ones
+s each other another box boxes
+'''.split())
+
+THRESHOLD_RE = re.compile(
+    r'\b(?P<cmp>above|over|more than|greater than|higher than|at least|at most|below|under|less than|lower than)'
+    r'\s+(?P<value>\d+(?:\.\d+)?)\s*(?P<percent>%|percent)?'
+)
+COMPARATORS = {
+    'above': '>', 'over': '>', 'more than': '>', 'greater than': '>', 'higher than': '>',
+    'at least': '>=', 'at most': '<=',
+    'below': '<', 'under': '<', 'less than': '<', 'lower than': '<'
+}
+
+REGION_RE = re.compile(
+    r'\b(?:(?P<vertical>top|upper|bottom|lower)(?:[- ](?P<horizontal>left|right))?|(?P<side>left|right)'
+    r'|(?P<center>center|centre|middle))'
+    r'(?:[- ]hand)?(?: (?:side|corner|half|part|area|region|quadrant|edge))?'
+    r'(?: (?:of|in) the (?:image|picture|photo|frame|scene))?\b'
+)
+VERTICAL = {'top': 'top', 'upper': 'top', 'bottom': 'bottom', 'lower': 'bottom'}
+
+# "highest confidence", "best score", "most confident", "score is highest"
+CONFIDENCE_EXTREME = (
+    r'\b(?:(?:{0})[- ](?:confidence|score|scoring|scored|certainty|probability)'
+    r'|{1} (?:confident|certain)|(?:confidence|score) (?:is )?(?:the )?(?:{0}))\b'
+)
+
+# (intent, trigger); the first matching intent wins. Label-only intents are
+# skipped when the question names no label.
+INTENTS = [
+    ('overlap', re.compile(r'\b(?:overlap(?:s|ping|ped)?|intersect(?:s|ing|ed)?)\b')),
+    ('near', re.compile(r'\b(?:next to|near(?:est|by)?(?: to)?|closest to|close to|beside|adjacent to|around)\b')),
+    ('count_threshold', re.compile(r'\b(?:how many|count|number of)\b')),
+    ('count', re.compile(r'^(?:how many|count|number of|what is the number of)\b')),
+    # Bare "highest"/"lowest" is left alone: "which object is highest in the
+    # image" asks where it is, not how sure the detector was
+    ('highest', re.compile(CONFIDENCE_EXTREME.format('highest|best|strongest|top', 'most'))),
+    ('lowest', re.compile(CONFIDENCE_EXTREME.format('lowest|worst|weakest', 'least'))),
+    ('largest', re.compile(r'\b(?:largest|biggest)\b')),
+    ('smallest', re.compile(r'\b(?:smallest|tiniest)\b')),
+    ('confidence', re.compile(r'\b(?:how (?:confident|sure|certain)|(?:confidence|score) (?:of|for))\b')),
+    ('presence', re.compile(r'^(?:is there|are there|do you see|can you see|does (?:it|the image) (?:contain|have|show)|any)\b')),
+    ('location', re.compile(r'^where\b')),
+    ('list', re.compile(r'^(?:what|which|list|identify)\b'))
+]
+LABEL_REQUIRED = frozenset({'confidence', 'presence', 'near'})
+SPATIAL_INTENTS = frozenset({'overlap', 'near'})
+COUNT_RE = re.compile(r'\b(?:how many|count|number of)\b')
+PRESENCE_RE = re.compile(r'^(?:is there|are there|is (?:a|an|the|any)|are (?:any|the)|do you see|can you see|any)\b')
+
+FILLER_RE = re.compile(r'^(?:(?:please|hey|so|ok|okay|can you|could you|tell me|show me)\s+)+')
+WORD_RE = re.compile(r'[a-z0-9%]+')
+
+def normalize(question: str) -> str:
+    text = re.sub(r'\s+', ' ', question.strip().lower()).rstrip(' ?!.')
+    return FILLER_RE.sub('', text)
+
+def surface_forms(label: str) -> List[str]:
+    """Singular and plural spellings of a label"""
+    forms = [label] + IRREGULAR_PLURALS.get(label, [])
+    if label not in IRREGULAR_PLURALS:
+        forms.append(label + ('es' if label.endswith(('s', 'x', 'ch', 'sh')) else 's'))
+    return forms
+
+def plural(label: str, count: int) -> str:
+    if count == 1:
+        return label
+    return surface_forms(label)[1]
+
+def _label_matcher(forms: Dict[str, str]):
+    alternatives = sorted(forms, key=len, reverse=True)
+    return re.compile(r'\b(?:' + '|'.join(re.escape(form) for form in alternatives) + r')\b')
+
+_COCO_LABELS = frozenset(COCO_LABELS)
+_COCO_FORMS = {form: label for label in COCO_LABELS for form in surface_forms(label)}
+_COCO_RE = _label_matcher(_COCO_FORMS)
+
+class Item:
+    __slots__ = ('label', 'key', 'score', 'x', 'y', 'width', 'height', 'area')
+
+    def __init__(self, detection: Dict):
+        self.label = str(detection.get('label') or detection.get('class', 'Unknown'))
+        self.key = self.label.lower()
+        score = detection.get('score') or detection.get('confidence', 0) or 0
+        self.score = score if score <= 1 else score / 100
+        bbox = detection.get('bbox') or {}
+        if isinstance(bbox, dict):
+            self.x, self.y = bbox.get('x', 0) or 0, bbox.get('y', 0) or 0
+            self.width, self.height = bbox.get('width', 0) or 0, bbox.get('height', 0) or 0
+        else:
+            self.x, self.y = bbox[0], bbox[1]
+            self.width, self.height = bbox[2] - bbox[0], bbox[3] - bbox[1]
+        self.area = max(0, self.width) * max(0, self.height)
+
+    @property
+    def box(self) -> Tuple[float, float, float, float]:
+        return (self.x, self.y, self.x + self.width, self.y + self.height)
+
+class DetectionIndex:
+    """
+    Precomputed views of one detection set
+
+    Label counts, score-sorted and area-sorted orders (overall and per
+    label), a compiled matcher for label names in questions and, on first
+    use, a spatial grid over the boxes. Built once per detection set and
+    reused for every question about it.
+    """
+
+    def __init__(self, detections: List[Dict], items: Optional[List[Item]] = None):
+        self.items = items if items is not None else [Item(d) for d in detections if isinstance(d, dict)]
+        self._spatial: Optional[SpatialIndex] = None
+        self.counts = Counter(item.key for item in self.items)
+        self.display = {}
+        for item in self.items:
+            self.display.setdefault(item.key, item.label)
+        self.by_score = sorted(range(len(self.items)), key=lambda i: -self.items[i].score)
+        self.by_area = sorted(range(len(self.items)), key=lambda i: -self.items[i].area)
+        self._label_order: Dict[str, List[int]] = {}
+        for i in self.by_score:
+            self._label_order.setdefault(self.items[i].key, []).append(i)
+        self._scores = sorted(item.score for item in self.items)
+        self._label_scores = {
+            key: [self.items[i].score for i in reversed(order)] for key, order in self._label_order.items()
+        }
+
+        # Labels outside the COCO vocabulary get their own matcher
+        self._forms = {}
+        for key in self.counts:
+            if key not in _COCO_LABELS:
+                for form in surface_forms(key):
+                    self._forms.setdefault(form, key)
+        self._label_re = _label_matcher(self._forms) if self._forms else None
+
+    @property
+    def spatial(self) -> SpatialIndex:
+        """Grid over the boxes, built the first time a question needs it"""
+        if self._spatial is None:
+            self._spatial = SpatialIndex([item.box for item in self.items])
+        return self._spatial
+
+    def subset(self, indices: List[int]) -> 'DetectionIndex':
+        """Index over some of the detections, framed like the full set"""
+        index = DetectionIndex([], [self.items[i] for i in indices])
+        index._spatial = SpatialIndex([item.box for item in index.items], self.spatial.frame)
+        return index
+
+    def find_labels(self, text: str) -> List[Tuple[str, Tuple[int, int]]]:
+        """Every label named in a question, in order"""
+        found = []
+        if self._label_re is not None:
+            found += [(self._forms[m.group(0)], m.span()) for m in self._label_re.finditer(text)]
+        for match in _COCO_RE.finditer(text):
+            if not any(start < match.end() and match.start() < end for _, (start, end) in found):
+                found.append((_COCO_FORMS[match.group(0)], match.span()))
+        found.sort(key=lambda pair: pair[1])
+        return found
+
+    def find_label(self, text: str) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+        """
+        First label named in a question
+
+        Besides the detected labels, any COCO class is recognized, so "is
+        there a giraffe" can be answered "no" without asking the model.
+        """
+        if self._label_re is not None:
+            match = self._label_re.search(text)
+            if match is not None:
+                return self._forms[match.group(0)], match.span()
+        match = _COCO_RE.search(text)
+        if match is None:
+            return None, None
+        return _COCO_FORMS[match.group(0)], match.span()
+
+    def name(self, key: str) -> str:
+        return self.display.get(key, key)
+
+    def indices(self, key: Optional[str] = None) -> List[int]:
+        """Detection indices (optionally of one label), highest score first"""
+        if key is None:
+            return self.by_score
+        return self._label_order.get(key, [])
+
+    def count_where(self, op: str, threshold: float, key: Optional[str] = None) -> int:
+        scores = self._scores if key is None else self._label_scores.get(key, [])
+        if op == '>':
+            return len(scores) - bisect.bisect_right(scores, threshold)
+        if op == '>=':
+            return len(scores) - bisect.bisect_left(scores, threshold)
+        if op == '<':
+            return bisect.bisect_left(scores, threshold)
+        return bisect.bisect_right(scores, threshold)
+
+class Query:
+    def __init__(self, intent: str, label: Optional[str] = None, op: Optional[str] = None,
+                 threshold: Optional[float] = None, comparator: str = '', residual: Optional[List[str]] = None,
+                 region: Optional[str] = None, reference: Optional[str] = None, mode: str = 'list'):
+        self.intent = intent
+        self.label = label
+        self.op = op
+        self.threshold = threshold
+        self.comparator = comparator
+        self.residual = residual or []
+        # Part of the frame the question is about ("top-left", "center", ...)
+        self.region = region
+        # For spatial relations, the object the others are placed against
+        self.reference = reference
+        # How a spatial answer is phrased: 'count', 'presence' or 'list'
+        self.mode = mode
+
+def find_region(text: str) -> Tuple[Optional[str], Optional[Tuple[int, int]]]:
+    """Part of the frame named in a normalized question ("top-left", "center", ...)"""
+    match = REGION_RE.search(text)
+    if match is None:
+        return None, None
+    if match.group('center'):
+        return 'center', match.span()
+    vertical = VERTICAL.get(match.group('vertical'))
+    horizontal = match.group('horizontal') or match.group('side')
+    return '-'.join(part for part in (vertical, horizontal) if part), match.span()
+
+def parse_question(question: str, index: DetectionIndex) -> Optional[Query]:
+    """
+    Match a question to an intent and fill its label, threshold and region slots
+
+    Returns:
+        The parsed query (with any words no slot accounted for), or None
+    """
+    text = normalize(question)
+    label, label_span = index.find_label(text)
+    threshold_match = THRESHOLD_RE.search(text)
+    region, region_span = find_region(text)
+
+    for intent, pattern in INTENTS:
+        match = pattern.search(text)
+        if match is None:
+            continue
+        if intent == 'count_threshold' and threshold_match is None:
+            continue
+
+        spans = [match.span()]
+        query = Query(intent, label)
+        if intent in SPATIAL_INTENTS:
+            # "how many cars are next to the person": subject before the
+            # relation, reference after it
+            labels = index.find_labels(text)
+            before = [pair for pair in labels if pair[1][1] <= match.start()]
+            after = [pair for pair in labels if pair[1][0] >= match.end()]
+            query.label = before[0][0] if before else None
+            if after:
+                query.reference = after[0][0]
+            elif before and intent == 'near':
+                # "what is the car next to"
+                query.label, query.reference = None, before[-1][0]
+            spans += [span for _, span in before[:1] + after[:1]]
+            if intent in LABEL_REQUIRED and query.reference is None:
+                continue
+            if COUNT_RE.search(text):
+                query.mode = 'count'
+                spans.append(COUNT_RE.search(text).span())
+            elif PRESENCE_RE.match(text):
+                query.mode = 'presence'
+                spans.append(PRESENCE_RE.match(text).span())
+        else:
+            if intent in LABEL_REQUIRED and label is None:
+                continue
+            if label is not None:
+                spans.append(label_span)
+
+        if region is not None:
+            spans.append(region_span)
+            query.region = region
+        if threshold_match is not None and intent == 'count_threshold':
+            spans.append(threshold_match.span())
+            value = float(threshold_match.group('value'))
+            if threshold_match.group('percent') or value > 1:
+                value /= 100
+            query.op = COMPARATORS[threshold_match.group('cmp')]
+            query.threshold = value
+            query.comparator = threshold_match.group('cmp')
+        query.residual = _residual(text, spans)
+        return query
+    return None
+
+def _residual(text: str, spans: List[Tuple[int, int]]) -> List[str]:
+    chars = list(text)
+    for start, end in spans:
+        chars[start:end] = ' ' * (end - start)
+    return [word for word in WORD_RE.findall(''.join(chars)) if word not in STOPWORDS]
+
+def _pct(score: float) -> str:
+    return f"{score * 100:.0f}%"
+
+def _labels_summary(index: DetectionIndex, indices: List[int]) -> str:
+    counts = Counter(index.items[i].key for i in indices)
+    parts = [f"{n} {plural(index.name(key), n)}" if n > 1 else index.name(key) for key, n in counts.most_common()]
+    if len(parts) <= 1:
+        return ''.join(parts)
+    return ', '.join(parts[:-1]) + f" and {parts[-1]}"
+
+def _where(region: str) -> str:
+    """Phrase for a part of the frame ("in the top-left of the image")"""
+    if region in ('left', 'right'):
+        return f"on the {region} side of the image"
+    return f"in the {region} of the image"
+
+def _answer(query: Query, index: DetectionIndex) -> Optional[str]:
+    if query.intent in SPATIAL_INTENTS:
+        return _answer_spatial(query, index)
+    scope = 'in the image'
+    if query.region:
+        # Everything else is answered over the objects centered in the region
+        index = index.subset(index.spatial.in_region(query.region))
+        scope = _where(query.region)
+
+    key = query.label
+    items = index.items
+    subject = plural(index.name(key), 2) if key else 'objects'
+    within = f" {scope}" if query.region else ''
+
+    if query.intent == 'count_threshold':
+        count = index.count_where(query.op, query.threshold, key)
+        bound = f"{query.comparator} {_pct(query.threshold)}"
+        if count == 0:
+            return f"No {subject} were detected{within} with confidence {bound}."
+        matching = [i for i in index.indices(key) if _compare(items[i].score, query.op, query.threshold)]
+        return (f"There {'is' if count == 1 else 'are'} {count} "
+                f"{plural(index.name(key) if key else 'object', count)} "
+                f"detected{within} with confidence {bound}: {_labels_summary(index, matching)}.")
+
+    if query.intent == 'count':
+        if key:
+            count = index.counts.get(key, 0)
+            if count == 0:
+                return f"No {subject} were detected {scope}."
+            return f"There {'is' if count == 1 else 'are'} {count} {plural(index.name(key), count)} {scope}."
+        if not items:
+            return f"No objects were detected {scope}."
+        return f"I can see {len(items)} {plural('object', len(items))} {scope}: {_labels_summary(index, index.by_score)}."
+
+    if query.intent in ('highest', 'lowest'):
+        ranked = index.indices(key)
+        if not ranked:
+            return f"No {subject} were detected {scope}."
+        item = items[ranked[0] if query.intent == 'highest' else ranked[-1]]
+        if key:
+            return (f"The {index.name(key)} with the {query.intent} confidence{within} was detected at "
+                    f"{_pct(item.score)}, located at (x: {item.x:.0f}, y: {item.y:.0f}).")
+        return (f"The object with the {query.intent} confidence{within} is {item.label} "
+                f"at {_pct(item.score)} confidence.")
+
+    if query.intent in ('largest', 'smallest'):
+        candidates = [i for i in index.by_area if key is None or items[i].key == key]
+        if not candidates:
+            return f"No {subject} were detected {scope}."
+        item = items[candidates[0] if query.intent == 'largest' else candidates[-1]]
+        size = (f"an area of {item.area:.0f} square pixels "
+                f"({item.width:.0f}x{item.height:.0f} at x: {item.x:.0f}, y: {item.y:.0f})")
+        if key:
+            return f"The {query.intent} {index.name(key)}{within} has {_pct(item.score)} confidence and {size}."
+        return f"The {query.intent} object{within} is {item.label} with {_pct(item.score)} confidence. It has {size}."
+
+    if query.intent == 'confidence':
+        ranked = index.indices(key)
+        if not ranked:
+            return f"No {subject} were detected {scope}."
+        if len(ranked) == 1:
+            return f"The {items[ranked[0]].label} was detected with {_pct(items[ranked[0]].score)} confidence."
+        scores = ', '.join(_pct(items[i].score) for i in ranked)
+        return f"There are {len(ranked)} {subject}{within}, detected with confidence {scores}."
+
+    if query.intent == 'presence':
+        count = index.counts.get(key, 0)
+        if count == 0:
+            return f"No, no {index.name(key)} was detected {scope}."
+        best = items[index.indices(key)[0]]
+        return (f"Yes, I can see {count} {plural(index.name(key), count)}{within}. The most confident is at "
+                f"{_pct(best.score)}, located at (x: {best.x:.0f}, y: {best.y:.0f}) with dimensions "
+                f"{best.width:.0f}x{best.height:.0f} pixels.")
+
+    if query.intent == 'location':
+        ranked = index.indices(key)
+        if not ranked:
+            return f"No {subject} were detected {scope}."
+        spatial = index.spatial
+        if len(ranked) == 1:
+            item = items[ranked[0]]
+            return (f"The {item.label} is {_where(spatial.region_of(ranked[0]))}, at (x: {item.x:.0f}, "
+                    f"y: {item.y:.0f}) with dimensions {item.width:.0f}x{item.height:.0f} pixels.")
+        places = '; '.join(
+            f"{items[i].label} ({spatial.region_of(i)}, x: {items[i].x:.0f}, y: {items[i].y:.0f})"
+            for i in ranked[:5]
+        )
+        more = f" and {len(ranked) - 5} more" if len(ranked) > 5 else ''
+        return f"Positions (top-left corner of each box): {places}{more}."
+
+    if query.intent == 'list':
+        if key is not None:
+            return None
+        if not items:
+            return f"No objects were detected {scope}."
+        contents = _labels_summary(index, index.by_score)
+        lead = f"{scope[0].upper()}{scope[1:]} I can see {contents}" if query.region else f"The image contains {contents}"
+        return (f"{lead}. The most confident detection is "
+                f"{items[index.by_score[0]].label} at {_pct(items[index.by_score[0]].score)}.")
+
+    return None
+
+def _answer_spatial(query: Query, index: DetectionIndex) -> Optional[str]:
+    """Answer "what is next to the person" and "how many objects overlap the car" """
+    items = index.items
+    spatial = index.spatial
+    key, reference = query.label, query.reference
+
+    def wanted(j: int) -> bool:
+        # "what is next to the person" is about the other objects
+        return items[j].key == key if key else items[j].key != reference
+
+    if reference is None:
+        # "do any boxes overlap": every overlapping pair in the image
+        pairs = [(i, j, iou) for i, j, iou in spatial.overlapping_pairs()
+                 if key is None or items[i].key == key == items[j].key]
+        subject = plural(index.name(key), 2) if key else 'objects'
+        if not pairs:
+            return f"No, none of the {subject} overlap." if query.mode == 'presence' else f"No {subject} overlap."
+        shown = '; '.join(f"{items[i].label} and {items[j].label} (IoU {_pct(iou)})" for i, j, iou in pairs[:3])
+        return (f"{'Yes, ' if query.mode == 'presence' else ''}{len(pairs)} "
+                f"{'pair of ' + subject + ' overlaps' if len(pairs) == 1 else 'pairs of ' + subject + ' overlap'}. "
+                f"The largest overlaps: {shown}.")
+
+    anchors = index.indices(reference)
+    if query.region:
+        inside = set(spatial.in_region(query.region))
+        anchors = [i for i in anchors if i in inside]
+    anchor_name = index.name(reference)
+    if not anchors:
+        where = f" {_where(query.region)}" if query.region else ''
+        return f"No {anchor_name} was detected{where}, so I can't tell what is around it."
+    anchor_phrase = f"the {anchor_name}" if len(anchors) == 1 else f"the {len(anchors)} {plural(anchor_name, 2)}"
+
+    # Closest matches per anchor, merged keeping each object's nearest anchor
+    found: Dict[int, float] = {}
+    if query.intent == 'overlap':
+        relation = 'overlap' if query.mode == 'count' else 'overlapping'
+        for i in anchors:
+            for j, iou in spatial.overlaps(i):
+                if wanted(j):
+                    found[j] = max(found.get(j, 0.0), iou)
+        detail = lambda j: f"IoU {_pct(found[j])}"
+    else:
+        relation = 'next to'
+        for i in anchors:
+            reach = QA_NEAR_DISTANCE * max(items[i].width, items[i].height)
+            for j, gap in spatial.nearest(i, k=10, accept=wanted, max_gap=reach):
+                found[j] = min(found.get(j, gap), gap)
+        detail = lambda j: 'touching' if found[j] == 0 else f"{found[j]:.0f}px away"
+    subject = plural(index.name(key), 2) if key else 'objects'
+    order = sorted(found, key=lambda j: -found[j] if query.intent == 'overlap' else found[j])
+
+    if query.mode == 'count':
+        count = len(order)
+        noun = plural(index.name(key) if key else 'object', count)
+        verb = ('overlaps' if count == 1 else 'overlap') if query.intent == 'overlap' else \
+            f"{'is' if count == 1 else 'are'} next to"
+        summary = f": {_labels_summary(index, order)}" if order and not key else ''
+        return f"{count or 'No'} {noun} {verb} {anchor_phrase}{summary}."
+
+    if not order:
+        if query.intent == 'near':
+            # Nothing close enough; say what the closest thing is instead
+            closest = min(
+                (pair for i in anchors for pair in spatial.nearest(i, k=1, accept=wanted)),
+                key=lambda pair: pair[1], default=None
+            )
+            if closest is not None:
+                return (f"{'No, n' if query.mode == 'presence' else 'N'}othing is right next to {anchor_phrase}. "
+                        f"The closest {'match' if key else 'object'} is {items[closest[0]].label}, "
+                        f"{closest[1]:.0f}px away.")
+        nothing = f"o {subject} are" if key else 'othing is'
+        return f"{'No, n' if query.mode == 'presence' else 'N'}{nothing} {relation} {anchor_phrase}."
+
+    shown = ', '.join(f"{items[j].label} ({detail(j)})" for j in order[:5])
+    more = f" and {len(order) - 5} more" if len(order) > 5 else ''
+    prefix = 'Yes. ' if query.mode == 'presence' else ''
+    return f"{prefix}{relation[0].upper()}{relation[1:]} {anchor_phrase}: {shown}{more}."
+
+def _compare(score: float, op: str, threshold: float) -> bool:
+    if op == '>':
+        return score > threshold
+    if op == '>=':
+        return score >= threshold
+    if op == '<':
+        return score < threshold
+    return score <= threshold
+
+_index_cache = LRUCache(QA_INDEX_CACHE_ITEMS, QA_INDEX_CACHE_TTL)
+_stats = Counter()
+_stats_lock = threading.Lock()
+
+def get_index(detections: List[Dict], fingerprint: Optional[str] = None) -> DetectionIndex:
+    """Index for a detection set, reused across questions when a fingerprint is given"""
+    if fingerprint is None:
+        return DetectionIndex(detections)
+    index = _index_cache.get(fingerprint)
+    if index is None:
+        index = DetectionIndex(detections)
+        _index_cache.set(fingerprint, index)
+    return index
+
+def answer_locally(question: str, detections: List[Dict], fingerprint: Optional[str] = None,
+                   strict: bool = True) -> Optional[str]:
+    """
+    Answer a structured question from the detections alone
+
+    Args:
+        question: User's question
+        detections: List of detected objects
+        fingerprint: Digest of the detections, to reuse their index
+        strict: Decline questions with words no intent accounts for
+            ("how many people are wearing hats"); the mock fallback
+            passes False to answer as best it can
+
+    Returns:
+        The answer, or None if the question needs the language model
+    """
+    if strict and not QA_LOCAL_ENABLED:
+        return None
+    index = get_index(detections, fingerprint)
+    query = parse_question(question, index)
+    if query is None or (strict and query.residual):
+        if strict:
+            _count('declined')
+        return None
+    answer = _answer(query, index)
+    if strict:
+        _count(query.intent if answer is not None else 'declined')
+    return answer
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def local_answer_stats() -> Dict:
+    """Questions answered locally per intent, and questions passed on to Gemini"""
+    with _stats_lock:
+        stats = dict(_stats)
+    declined = stats.pop('declined', 0)
+    answered = sum(stats.values())
+    total = answered + declined
+    return {
+        'answered': answered,
+        'declined': declined,
+        'localRate': round(answered / total, 3) if total else 0.0,
+        'intents': stats,
+        'enabled': QA_LOCAL_ENABLED
+    }
@@ -0,0 +1,121 @@
+"""
+Bounding box renderer
+Draws detections with a font loaded once, a stable label palette and
+cached pre-rendered label badges
+"""
+
+import colorsys
+import os
+import zlib
+from functools import lru_cache
+from typing import Dict, List, Tuple
+
+from PIL import Image, ImageDraw, ImageFont
+
+from utils.detectors import COCO_LABELS
+
+RENDER_FONT_SIZE = int(os.getenv('RENDER_FONT_SIZE', 20))
+RENDER_BOX_WIDTH = 4
+RENDER_BADGE_CACHE_SIZE = 2048
+
+# Tried in order; the first one FreeType can open wins
+FONT_CANDIDATES = ('arial.ttf', 'DejaVuSans.ttf', 'LiberationSans-Regular.ttf')
+
+def _build_palette(size: int) -> List[Tuple[int, int, int]]:
+    """Evenly spread, reasonably bright hues (golden-ratio hue stepping)"""
+    palette = []
+    for i in range(size):
+        hue = (i * 0.618033988749895) % 1.0
+        r, g, b = colorsys.hsv_to_rgb(hue, 0.65, 0.95)
+        palette.append((int(r * 255), int(g * 255), int(b * 255)))
+    return palette
+
+PALETTE = _build_palette(len(COCO_LABELS))
+LABEL_COLORS = {label: PALETTE[i] for i, label in enumerate(COCO_LABELS)}
+
+def label_color(label: str) -> Tuple[int, int, int]:
+    """
+    Color for a label, identical in every worker process
+
+    Known labels get their own palette slot; anything else is mapped with
+    CRC32, which (unlike hash()) is not randomized per process.
+    """
+    color = LABEL_COLORS.get(label)
+    if color is None:
+        color = PALETTE[zlib.crc32(label.encode('utf-8')) % len(PALETTE)]
+    return color
+
+@lru_cache(maxsize=8)
+def load_font(size: int = RENDER_FONT_SIZE) -> ImageFont.ImageFont:
+    """Load the label font once per size"""
+    for name in FONT_CANDIDATES:
+        try:
+            return ImageFont.truetype(name, size)
+        except OSError:
+            continue
+    try:
+        return ImageFont.load_default(size)
+    except TypeError:
+        # Pillow without FreeType: fixed-size bitmap font
+        return ImageFont.load_default()
+
+@lru_cache(maxsize=RENDER_BADGE_CACHE_SIZE)
+def _badge(label: str, score_bucket: int, font_size: int) -> Image.Image:
+    """Pre-rendered label badge, keyed by (label, score bucket, font)"""
+    font = load_font(font_size)
+    text = f"{label} ({score_bucket / 100:.2f})"
+    left, top, right, bottom = font.getbbox(text)
+    badge = Image.new('RGB', (right - left + 10, bottom - top + 8), label_color(label))
+    ImageDraw.Draw(badge).text((5 - left, 4 - top), text, fill='white', font=font)
+    return badge
+
+def render_stats() -> Dict:
+    """Badge cache effectiveness for this worker process"""
+    info = _badge.cache_info()
+    return {'badgeHits': info.hits, 'badgeMisses': info.misses, 'badgeCached': info.currsize}
+
+class BoxRenderer:
+    """Draws detection boxes and label badges onto PIL images"""
+
+    def __init__(self, font_size: int = RENDER_FONT_SIZE, box_width: int = RENDER_BOX_WIDTH):
+        self.font_size = font_size
+        self.box_width = box_width
+
+    def draw(self, image: Image.Image, detections: List[Dict], scale: float = 1.0) -> Image.Image:
+        """
+        Draw detections onto an image
+
+        Args:
+            image: PIL image; drawn on in place when already RGB/RGBA
+            detections: List of detection dictionaries
+            scale: Factor from detection coordinates to image coordinates
+
+        Returns:
+            The image that was drawn on
+        """
+        if image.mode not in ('RGB', 'RGBA'):
+            image = image.convert('RGB')
+        draw = ImageDraw.Draw(image)
+        half = self.box_width // 2
+
+        for detection in detections:
+            label = detection.get('label', 'Unknown')
+            score = detection.get('score', 0.0)
+            bbox = detection.get('bbox', {})
+
+            x1 = int(bbox.get('x', 0) * scale)
+            y1 = int(bbox.get('y', 0) * scale)
+            x2 = int((bbox.get('x', 0) + bbox.get('width', 0)) * scale)
+            y2 = int((bbox.get('y', 0) + bbox.get('height', 0)) * scale)
+            color = label_color(label)
+
+            draw.rectangle([x1 - half, y1 - half, x2 + half, y2 + half], outline=color, width=self.box_width)
+
+            badge = _badge(label, int(round(score * 100)), self.font_size)
+            # Sit above the box, or just inside it when the box touches the top edge
+            badge_y = y1 - badge.height if y1 - badge.height >= 0 else y1
+            image.paste(badge, (x1, badge_y))
+
+        return image
+
+renderer = BoxRenderer()
@@ -0,0 +1,128 @@
+"""
+Detection sessions
+Detection results stored under an ID, so Q&A requests can refer to them
+instead of posting the detections back with every question
+"""
+
+import json
+import os
+import threading
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from utils.cache import LRUCache
+from utils.database import db, DetectionSession
+from utils.gemini import detections_fingerprint
+
+DETECTION_SESSIONS_ENABLED = os.getenv('DETECTION_SESSIONS_ENABLED', 'true').lower() == 'true'
+DETECTION_SESSION_TTL = int(os.getenv('DETECTION_SESSION_TTL', 60 * 60))  # seconds
+# Sessions kept decoded in memory per worker; others are read from SQLite
+DETECTION_SESSION_CACHE_ITEMS = int(os.getenv('DETECTION_SESSION_CACHE_ITEMS', 256))
+
+# Delete expired sessions every N sessions created
+SESSION_PURGE_INTERVAL = 100
+
+class LoadedSession:
+    """A detection session as used by Q&A: decoded detections plus their fingerprint"""
+    __slots__ = ('detection_id', 'user_id', 'detections', 'fingerprint', 'expires_at')
+
+    def __init__(self, detection_id: str, user_id: str, detections: List[Dict], fingerprint: str,
+                 expires_at: datetime):
+        self.detection_id = detection_id
+        self.user_id = user_id
+        self.detections = detections
+        self.fingerprint = fingerprint
+        self.expires_at = expires_at
+
+    @property
+    def expired(self) -> bool:
+        return self.expires_at <= datetime.utcnow()
+
+_memory = LRUCache(DETECTION_SESSION_CACHE_ITEMS, DETECTION_SESSION_TTL)
+_stats = {'created': 0, 'memoryHits': 0, 'databaseLoads': 0, 'notFound': 0}
+_stats_lock = threading.Lock()
+
+def _count(name: str):
+    with _stats_lock:
+        _stats[name] += 1
+
+def create_detection_session(user_id: str, detections: List[Dict]) -> Optional[str]:
+    """
+    Store a detection result for later questions
+
+    Args:
+        user_id: Owner of the result
+        detections: Detections as returned to the client
+
+    Returns:
+        The detection ID, or None if sessions are disabled
+    """
+    if not DETECTION_SESSIONS_ENABLED:
+        return None
+    fingerprint = detections_fingerprint(detections)
+    expires_at = datetime.utcnow() + timedelta(seconds=DETECTION_SESSION_TTL)
+    session = DetectionSession(
+        user_id=user_id,
+        detections=json.dumps(detections),
+        fingerprint=fingerprint,
+        expires_at=expires_at
+    )
+    db.session.add(session)
+    try:
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+
+    # The next question usually lands on this worker; skip the database then
+    _memory.set(session.id, LoadedSession(session.id, user_id, detections, fingerprint, expires_at))
+    with _stats_lock:
+        _stats['created'] += 1
+        purge = _stats['created'] % SESSION_PURGE_INTERVAL == 0
+    if purge:
+        purge_expired_sessions()
+    return session.id
+
+def get_detection_session(detection_id: str, user_id: str) -> Optional[LoadedSession]:
+    """
+    Find an unexpired detection session owned by the given user
+
+    Returns:
+        The session, or None if it does not exist, has expired or belongs
+        to someone else
+    """
+    session = _memory.get(detection_id)
+    if session is not None and not session.expired:
+        if session.user_id != user_id:
+            _count('notFound')
+            return None
+        _count('memoryHits')
+        return session
+
+    row = DetectionSession.query.filter_by(id=detection_id, user_id=user_id).first()
+    if row is None or row.expires_at <= datetime.utcnow():
+        _count('notFound')
+        return None
+    session = LoadedSession(row.id, row.user_id, json.loads(row.detections), row.fingerprint, row.expires_at)
+    _memory.set(detection_id, session)
+    _count('databaseLoads')
+    return session
+
+def purge_expired_sessions():
+    """Delete expired detection sessions"""
+    try:
+        DetectionSession.query.filter(
+            DetectionSession.expires_at < datetime.utcnow()
+        ).delete(synchronize_session=False)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        print(f"⚠️ Could not purge detection sessions: {str(e)}")
+
+def session_stats() -> Dict:
+    """Detection session counters for this worker process"""
+    with _stats_lock:
+        stats = dict(_stats)
+    stats['cached'] = len(_memory)
+    stats['enabled'] = DETECTION_SESSIONS_ENABLED
+    return stats
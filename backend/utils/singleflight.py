@@ -0,0 +1,75 @@
+"""
+Single-flight call deduplication
+Concurrent callers asking for the same key share one in-flight call
+"""
+
+import threading
+from typing import Any, Callable, Dict, Hashable, Tuple
+
+class _Call:
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+class SingleFlight:
+    """
+    Collapse concurrent calls with the same key into one
+
+    The first caller for a key runs the function; callers arriving while it
+    runs wait and get the same result (or the same exception). Nothing is
+    kept once the call finishes, so this is not a cache.
+    """
+
+    def __init__(self, name: str):
+        self.name = name
+        self._calls: Dict[Hashable, _Call] = {}
+        self._lock = threading.Lock()
+        self.executed = 0
+        self.shared = 0
+
+    def do(self, key: Hashable, fn: Callable[[], Any]) -> Tuple[Any, bool]:
+        """
+        Run fn once for all concurrent callers with this key
+
+        Returns:
+            (result, shared) where shared is True if another caller's call
+            was reused
+
+        Raises:
+            Exception: Whatever fn raised, in every waiting caller
+        """
+        with self._lock:
+            call = self._calls.get(key)
+            if call is not None:
+                self.shared += 1
+                leader = False
+            else:
+                call = self._calls[key] = _Call()
+                self.executed += 1
+                leader = True
+
+        if not leader:
+            call.done.wait()
+            if call.error is not None:
+                raise call.error
+            return call.result, True
+
+        try:
+            call.result = fn()
+        except Exception as e:
+            call.error = e
+            raise
+        finally:
+            with self._lock:
+                del self._calls[key]
+            call.done.set()
+        return call.result, False
+
+    def stats(self) -> Dict:
+        with self._lock:
+            return {
+                'executed': self.executed,
+                'shared': self.shared,
+                'inFlight': len(self._calls)
+            }
@@ -0,0 +1,231 @@
+"""
+Spatial index over detection boxes
+Uniform grid for region, nearest-neighbour and overlap queries
+"""
+
+import math
+from collections import defaultdict
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+Box = Tuple[float, float, float, float]  # (x1, y1, x2, y2)
+
+# Boxes spanning more cells than this are kept aside and checked on every
+# query, so a few image-sized boxes cannot blow up the grid
+MAX_CELLS_PER_BOX = 64
+
+# Named parts of the frame as (x1, y1, x2, y2) fractions. Sides and halves
+# are half the frame, corners a quadrant, the center the middle third.
+REGIONS: Dict[str, Tuple[float, float, float, float]] = {
+    'top-left': (0, 0, 0.5, 0.5), 'top-right': (0.5, 0, 1, 0.5),
+    'bottom-left': (0, 0.5, 0.5, 1), 'bottom-right': (0.5, 0.5, 1, 1),
+    'top': (0, 0, 1, 0.5), 'bottom': (0, 0.5, 1, 1),
+    'left': (0, 0, 0.5, 1), 'right': (0.5, 0, 1, 1),
+    'center': (1 / 3, 1 / 3, 2 / 3, 2 / 3)
+}
+_ROWS = ('top', '', 'bottom')
+_COLUMNS = ('left', '', 'right')
+
+def box_iou(a: Box, b: Box) -> float:
+    inter_w = min(a[2], b[2]) - max(a[0], b[0])
+    inter_h = min(a[3], b[3]) - max(a[1], b[1])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = (a[2] - a[0]) * (a[3] - a[1]) + (b[2] - b[0]) * (b[3] - b[1]) - inter
+    return inter / union if union > 0 else 0.0
+
+def box_gap(a: Box, b: Box) -> float:
+    """Edge-to-edge distance between two boxes (0 if they touch or overlap)"""
+    dx = max(0.0, b[0] - a[2], a[0] - b[2])
+    dy = max(0.0, b[1] - a[3], a[1] - b[3])
+    return math.hypot(dx, dy)
+
+class SpatialIndex:
+    """
+    Uniform grid over a set of boxes
+
+    The cell size follows the median box size (but never more cells than
+    boxes), so every query only looks at the few cells around it instead of
+    the whole set. The frame is the image area the boxes were found in;
+    without one, it is the extent of the boxes starting from (0, 0).
+    """
+
+    def __init__(self, boxes: List[Box], frame: Optional[Box] = None):
+        self.boxes = boxes
+        if frame is None:
+            frame = (0.0, 0.0, max((b[2] for b in boxes), default=1.0), max((b[3] for b in boxes), default=1.0))
+        self.frame = frame
+        width = max(frame[2] - frame[0], 1.0)
+        height = max(frame[3] - frame[1], 1.0)
+
+        sides = sorted(max(b[2] - b[0], b[3] - b[1]) for b in boxes)
+        median = sides[len(sides) // 2] if sides else 1.0
+        self.cell = max(median, math.sqrt(width * height / max(len(boxes), 1)), 1.0)
+        self.columns = int(width // self.cell) + 1
+        self.rows = int(height // self.cell) + 1
+
+        self._cells: Dict[Tuple[int, int], List[int]] = defaultdict(list)
+        self._large: List[int] = []
+        for i, box in enumerate(boxes):
+            c0, r0, c1, r1 = self._cell_range(box)
+            if (c1 - c0 + 1) * (r1 - r0 + 1) > MAX_CELLS_PER_BOX:
+                self._large.append(i)
+                continue
+            for column in range(c0, c1 + 1):
+                for row in range(r0, r1 + 1):
+                    self._cells[(column, row)].append(i)
+
+    def _cell_range(self, box: Box) -> Tuple[int, int, int, int]:
+        def clamp(value: float, limit: int) -> int:
+            return min(max(int(value // self.cell), 0), limit - 1)
+        x0, y0 = self.frame[0], self.frame[1]
+        return (clamp(box[0] - x0, self.columns), clamp(box[1] - y0, self.rows),
+                clamp(box[2] - x0, self.columns), clamp(box[3] - y0, self.rows))
+
+    def _candidates(self, cells: Iterable[Tuple[int, int]]) -> set:
+        found = set(self._large)
+        for cell in cells:
+            found.update(self._cells.get(cell, ()))
+        return found
+
+    def search(self, area: Box) -> List[int]:
+        """Boxes intersecting an area, in index order"""
+        c0, r0, c1, r1 = self._cell_range(area)
+        cells = ((column, row) for column in range(c0, c1 + 1) for row in range(r0, r1 + 1))
+        return sorted(i for i in self._candidates(cells) if _intersects(self.boxes[i], area))
+
+    def region_area(self, name: str) -> Box:
+        fx0, fy0, fx1, fy1 = REGIONS[name]
+        x0, y0, x1, y1 = self.frame
+        width, height = x1 - x0, y1 - y0
+        return (x0 + fx0 * width, y0 + fy0 * height, x0 + fx1 * width, y0 + fy1 * height)
+
+    def in_region(self, name: str) -> List[int]:
+        """Boxes whose center lies in a named region of the frame"""
+        area = self.region_area(name)
+        found = []
+        for i in self.search(area):
+            cx, cy = _center(self.boxes[i])
+            if area[0] <= cx <= area[2] and area[1] <= cy <= area[3]:
+                found.append(i)
+        return found
+
+    def region_of(self, i: int) -> str:
+        """Where a box sits on a 3x3 grid over the frame ("top-left", "center", ...)"""
+        cx, cy = _center(self.boxes[i])
+        x0, y0, x1, y1 = self.frame
+        column = min(max(int(3 * (cx - x0) / max(x1 - x0, 1e-9)), 0), 2)
+        row = min(max(int(3 * (cy - y0) / max(y1 - y0, 1e-9)), 0), 2)
+        name = '-'.join(part for part in (_ROWS[row], _COLUMNS[column]) if part)
+        return name or 'center'
+
+    def overlaps(self, i: int, min_iou: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Boxes overlapping box i
+
+        Returns:
+            (index, IoU) pairs with IoU above min_iou, largest first
+        """
+        box = self.boxes[i]
+        found = []
+        for j in self.search(box):
+            if j == i:
+                continue
+            iou = box_iou(box, self.boxes[j])
+            if iou > min_iou:
+                found.append((j, iou))
+        found.sort(key=lambda pair: -pair[1])
+        return found
+
+    def overlapping_pairs(self, min_iou: float = 0.0, limit: Optional[int] = None) -> List[Tuple[int, int, float]]:
+        """
+        Every pair of overlapping boxes
+
+        Returns:
+            (i, j, IoU) with i < j and IoU above min_iou, largest first
+        """
+        seen = set()
+        pairs = []
+
+        def consider(a: int, b: int):
+            pair = (a, b) if a < b else (b, a)
+            if a == b or pair in seen:
+                return
+            seen.add(pair)
+            iou = box_iou(self.boxes[a], self.boxes[b])
+            if iou > min_iou:
+                pairs.append((pair[0], pair[1], iou))
+
+        for members in self._cells.values():
+            for position, a in enumerate(members):
+                for b in members[position + 1:]:
+                    consider(a, b)
+        for a in self._large:
+            for b in range(len(self.boxes)):
+                consider(a, b)
+        pairs.sort(key=lambda pair: -pair[2])
+        return pairs[:limit] if limit is not None else pairs
+
+    def nearest(self, i: int, k: int = 3, accept: Optional[Callable[[int], bool]] = None,
+                max_gap: Optional[float] = None) -> List[Tuple[int, float]]:
+        """
+        Closest boxes to box i by edge-to-edge distance
+
+        Searches rings of cells outward from the box and stops as soon as
+        no unvisited cell can hold anything closer than what was found.
+
+        Args:
+            i: Index of the reference box
+            k: Number of neighbours
+            accept: Optional filter on candidate indices
+            max_gap: Ignore boxes farther away than this
+
+        Returns:
+            (index, gap) pairs, closest first
+        """
+        box = self.boxes[i]
+        c0, r0, c1, r1 = self._cell_range(box)
+        seen = {i}
+        best: List[Tuple[float, int]] = []
+
+        def consider(candidates: Iterable[int]):
+            for j in candidates:
+                if j in seen:
+                    continue
+                seen.add(j)
+                if accept is not None and not accept(j):
+                    continue
+                gap = box_gap(box, self.boxes[j])
+                if max_gap is None or gap <= max_gap:
+                    best.append((gap, j))
+
+        consider(self._large)
+        max_ring = max(c0, r0, self.columns - 1 - c1, self.rows - 1 - r1)
+        for ring in range(max_ring + 1):
+            consider(self._candidates(_ring(c0, r0, c1, r1, ring)))
+            best.sort()
+            # Anything in ring + 1 or beyond is at least ring * cell away
+            reach = ring * self.cell
+            if len(best) >= k and best[k - 1][0] <= reach:
+                break
+            if max_gap is not None and reach > max_gap:
+                break
+        return [(j, gap) for gap, j in best[:k]]
+
+def _ring(c0: int, r0: int, c1: int, r1: int, ring: int) -> Iterable[Tuple[int, int]]:
+    """Cells exactly `ring` cells outside the block c0..c1 x r0..r1"""
+    if ring == 0:
+        return [(column, row) for column in range(c0, c1 + 1) for row in range(r0, r1 + 1)]
+    top, bottom = r0 - ring, r1 + ring
+    left, right = c0 - ring, c1 + ring
+    cells = [(column, top) for column in range(left, right + 1)]
+    cells += [(column, bottom) for column in range(left, right + 1)]
+    cells += [(left, row) for row in range(top + 1, bottom)]
+    cells += [(right, row) for row in range(top + 1, bottom)]
+    return cells
+
+def _intersects(a: Box, b: Box) -> bool:
+    return a[0] <= b[2] and b[0] <= a[2] and a[1] <= b[3] and b[1] <= a[3]
+
+def _center(box: Box) -> Tuple[float, float]:
+    return (box[0] + box[2]) / 2, (box[1] + box[3]) / 2
@@ -0,0 +1,241 @@
+"""
+Tiled inference
+Splits very large images into overlapping tiles, runs them through the
+detector concurrently and merges boxes across tile borders
+"""
+
+import os
+from concurrent.futures import ThreadPoolExecutor
+from io import BytesIO
+from typing import Callable, Dict, List, Mapping, NamedTuple, Optional, Tuple, Union
+
+from PIL import Image
+
+import numpy as np
+
+from utils.detectors import DetectorError
+from utils.postprocess import detections_to_arrays
+
+TILE_SIZE = int(os.getenv('TILE_SIZE', 800))  # pixels; keep <= PREPROCESS_MAX_SIDE
+TILE_OVERLAP = float(os.getenv('TILE_OVERLAP', 0.2))  # fraction of the tile size
+TILE_PARALLELISM = int(os.getenv('TILE_PARALLELISM', 4))
+TILE_MAX_PARALLELISM = int(os.getenv('TILE_MAX_PARALLELISM', 8))
+TILE_MAX_TILES = int(os.getenv('TILE_MAX_TILES', 64))
+# Boxes of one label from different passes overlapping by more than this
+# (intersection over the smaller box) are one object cut by a tile seam
+TILE_MERGE_THRESHOLD = float(os.getenv('TILE_MERGE_THRESHOLD', 0.6))
+# Any other same-label pair is only a duplicate above this IoU, so a small
+# object inside a coarser box of the same label survives
+TILE_MERGE_IOU = 0.5
+# A box within this fraction of the tile size from an inner tile edge was
+# probably cut off by it
+TILE_SEAM_MARGIN = 0.01
+# Also run the whole (downscaled) image so objects larger than a tile are found
+TILE_INCLUDE_FULL = os.getenv('TILE_INCLUDE_FULL', 'true').lower() == 'true'
+
+TILE_JPEG_QUALITY = 90
+TILE_MIN_SIZE = 128
+TILE_MAX_SIZE = 4096
+
+Box = Tuple[int, int, int, int]
+
+class TiledDetections(NamedTuple):
+    """Merged detections of a tiled run, and how many of its passes failed"""
+    detections: List[Dict]
+    failed: int  # tiles (or the whole-image pass) whose detector call failed
+    passes: int
+
+    @property
+    def partial(self) -> bool:
+        return self.failed > 0
+
+def parse_tile_options(params: Mapping) -> Optional[Dict]:
+    """
+    Read tiling options from request params
+
+    Args:
+        params: JSON body, form fields or query args with optional
+            tile (true | false), tileSize (pixels), tileOverlap (0-0.9)
+            and tileParallelism
+
+    Returns:
+        {"tile_size", "overlap", "parallelism"}, or None when tiling is off
+
+    Raises:
+        ValueError: If an option is invalid
+    """
+    if str(params.get('tile', 'false')).lower() not in ('true', '1', 'on', 'yes'):
+        return None
+    try:
+        tile_size = int(params.get('tileSize', TILE_SIZE))
+        overlap = float(params.get('tileOverlap', TILE_OVERLAP))
+        parallelism = int(params.get('tileParallelism', TILE_PARALLELISM))
+    except (TypeError, ValueError):
+        raise ValueError('tileSize and tileParallelism must be integers, tileOverlap a number')
+    if not TILE_MIN_SIZE <= tile_size <= TILE_MAX_SIZE:
+        raise ValueError(f'tileSize must be between {TILE_MIN_SIZE} and {TILE_MAX_SIZE} pixels')
+    if not 0 <= overlap <= 0.9:
+        raise ValueError('tileOverlap must be between 0 and 0.9')
+    if not 1 <= parallelism <= TILE_MAX_PARALLELISM:
+        raise ValueError(f'tileParallelism must be between 1 and {TILE_MAX_PARALLELISM}')
+    return {'tile_size': tile_size, 'overlap': overlap, 'parallelism': parallelism}
+
+def tile_grid(width: int, height: int, tile_size: int, overlap: float) -> List[Box]:
+    """
+    Overlapping tiles covering the image
+
+    The last tile in each row and column is aligned with the image edge,
+    so every tile is full size unless the image itself is smaller.
+
+    Returns:
+        (left, top, right, bottom) boxes
+    """
+    stride = max(1, int(tile_size * (1 - overlap)))
+
+    def starts(length: int) -> List[int]:
+        if length <= tile_size:
+            return [0]
+        return list(range(0, length - tile_size, stride)) + [length - tile_size]
+
+    return [
+        (x, y, min(x + tile_size, width), min(y + tile_size, height))
+        for y in starts(height)
+        for x in starts(width)
+    ]
+
+def _encode_tile(image: Image.Image, box: Box) -> bytes:
+    tile = image.crop(box)
+    if tile.mode != 'RGB':
+        tile = tile.convert('RGB')
+    buffered = BytesIO()
+    tile.save(buffered, format='JPEG', quality=TILE_JPEG_QUALITY)
+    return buffered.getvalue()
+
+def detect_tiles(image: Image.Image, options: Dict, detect: Callable[[Union[bytes, memoryview]], List[Dict]],
+                 full_image_data: Optional[Union[bytes, memoryview]] = None) -> TiledDetections:
+    """
+    Detect objects tile by tile and merge the results
+
+    Args:
+        image: Decoded, upright image
+        options: Output of parse_tile_options
+        detect: Detector call taking encoded bytes; returns boxes in the
+            coordinates of the bytes it was given
+        full_image_data: Original encoded image, run as one extra pass for
+            objects larger than a tile
+
+    Returns:
+        Detections in image coordinates, highest score first, with the
+        number of failed passes: a failed tile leaves its objects out
+
+    Raises:
+        DetectorError: If every tile failed
+    """
+    width, height = image.size
+    tile_size, overlap = options['tile_size'], options['overlap']
+    tiles = tile_grid(width, height, tile_size, overlap)
+    while len(tiles) > TILE_MAX_TILES:
+        # Grow the tiles rather than flood the detector
+        tile_size = int(tile_size * 1.25)
+        tiles = tile_grid(width, height, tile_size, overlap)
+
+    if len(tiles) == 1 and full_image_data is not None:
+        # Fits in one tile: no need to crop and re-encode
+        return TiledDetections(detect(full_image_data), 0, 1)
+
+    def run(box: Optional[Box]) -> Optional[List[Tuple[Dict, bool]]]:
+        try:
+            if box is None:
+                return [(detection, False) for detection in detect(full_image_data)]
+            detections = detect(_encode_tile(image, box))
+        except Exception as e:
+            print(f"⚠️ Tile {box or 'full'} failed: {str(e)}")
+            return None
+        left, top = box[0], box[1]
+        tagged = []
+        for detection in detections:
+            bbox = detection['bbox']
+            seam = at_seam(bbox, box, width, height)
+            detection['bbox'] = {**bbox, 'x': bbox.get('x', 0) + left, 'y': bbox.get('y', 0) + top}
+            tagged.append((detection, seam))
+        return tagged
+
+    passes = list(tiles)
+    if TILE_INCLUDE_FULL and full_image_data is not None:
+        passes.append(None)
+
+    workers = max(1, min(options['parallelism'], len(passes)))
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='detect-tile') as pool:
+        results = list(pool.map(run, passes))
+
+    succeeded = [detections for detections in results if detections is not None]
+    if not succeeded:
+        raise DetectorError('All tiles failed')
+
+    detections, pass_ids, seams = [], [], []
+    for number, tagged in enumerate(results):
+        for detection, seam in tagged or ():
+            detections.append(detection)
+            pass_ids.append(number)
+            seams.append(seam)
+    merged = merge_tile_detections(detections, pass_ids, seams)
+    print(f"🧩 Tiled {width}x{height} into {len(tiles)} tiles of {tile_size}px "
+          f"({len(passes) - len(succeeded)} failed): {len(detections)} -> {len(merged)} detections")
+    return TiledDetections(merged, len(passes) - len(succeeded), len(passes))
+
+def at_seam(bbox: Dict, tile: Box, width: int, height: int) -> bool:
+    """Whether a box (in tile coordinates) touches an edge of the tile that is not an image edge"""
+    left, top, right, bottom = tile
+    margin = max(2.0, TILE_SEAM_MARGIN * max(right - left, bottom - top))
+    x, y = bbox.get('x', 0), bbox.get('y', 0)
+    x2, y2 = x + bbox.get('width', 0), y + bbox.get('height', 0)
+    return ((left > 0 and x <= margin) or (top > 0 and y <= margin)
+            or (right < width and x2 >= right - left - margin)
+            or (bottom < height and y2 >= bottom - top - margin))
+
+def merge_tile_detections(detections: List[Dict], pass_ids: List[int], seams: List[bool],
+                          ios_threshold: float = TILE_MERGE_THRESHOLD,
+                          iou_threshold: float = TILE_MERGE_IOU) -> List[Dict]:
+    """
+    Merge detections from overlapping tiles (and the whole-image pass)
+
+    Greedy, highest score first, per label. A lower-scored box is dropped
+    when its IoU with a kept box exceeds iou_threshold, or when the two
+    come from different passes, one of them touches a tile seam and their
+    intersection over the smaller box exceeds ios_threshold (an object cut
+    in two by a tile edge). A small object inside a larger box of the same
+    label is kept unless a seam explains the overlap.
+
+    Args:
+        detections: Detections in image coordinates
+        pass_ids: Tile (or whole-image pass) each detection came from
+        seams: Whether each detection touches an inner tile edge
+
+    Returns:
+        Surviving detections, highest score first
+    """
+    if len(detections) < 2:
+        return detections
+    boxes, scores, labels = detections_to_arrays(detections)
+    _, class_ids = np.unique(labels.astype(str), return_inverse=True)
+    pass_ids = np.asarray(pass_ids)
+    seams = np.asarray(seams, dtype=bool)
+    areas = (boxes[:, 2] - boxes[:, 0]) * (boxes[:, 3] - boxes[:, 1])
+
+    order = scores.argsort(kind='stable')[::-1]
+    keep = []
+    while order.size:
+        i = order[0]
+        keep.append(int(i))
+        rest = order[1:]
+        xx1 = np.maximum(boxes[i, 0], boxes[rest, 0])
+        yy1 = np.maximum(boxes[i, 1], boxes[rest, 1])
+        xx2 = np.minimum(boxes[i, 2], boxes[rest, 2])
+        yy2 = np.minimum(boxes[i, 3], boxes[rest, 3])
+        inter = np.clip(xx2 - xx1, 0, None) * np.clip(yy2 - yy1, 0, None)
+        iou = inter / (areas[i] + areas[rest] - inter + 1e-9)
+        ios = inter / (np.minimum(areas[i], areas[rest]) + 1e-9)
+        cut = (pass_ids[rest] != pass_ids[i]) & (seams[rest] | seams[i]) & (ios > ios_threshold)
+        duplicate = (class_ids[rest] == class_ids[i]) & ((iou > iou_threshold) | cut)
+        order = rest[~duplicate]
+    return [detections[i] for i in keep]
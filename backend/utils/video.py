@@ -0,0 +1,274 @@
+"""
+Frame-stream detection
+Frame sources (multi-frame images, multipart frames, MJPEG streams),
+cheap change detection and an IoU tracker that carries detections
+forward between detector calls
+"""
+
+import os
+from io import BytesIO
+from typing import BinaryIO, Callable, Dict, Iterable, Iterator, List, Optional
+
+import numpy as np
+from PIL import Image, ImageSequence
+
+from utils.image_input import ImageTooLargeError
+
+STREAM_SAMPLE_EVERY = int(os.getenv('STREAM_SAMPLE_EVERY', 1))  # run on every Nth frame
+STREAM_DIFF_THRESHOLD = float(os.getenv('STREAM_DIFF_THRESHOLD', 0.02))  # mean abs diff, 0-1
+STREAM_MAX_FRAMES = int(os.getenv('STREAM_MAX_FRAMES', 5000))
+STREAM_MAX_BYTES = int(os.getenv('STREAM_MAX_BYTES', 512 * 1024 * 1024))
+STREAM_TRACK_IOU = float(os.getenv('STREAM_TRACK_IOU', 0.3))
+STREAM_TRACK_MAX_AGE = int(os.getenv('STREAM_TRACK_MAX_AGE', 3))  # detector runs a track may miss
+
+# Side of the grayscale thumbnail used for frame differencing
+SIGNATURE_SIZE = 32
+STREAM_CHUNK_SIZE = 64 * 1024
+
+class Frame:
+    """One video frame, held as encoded JPEG bytes and/or a decoded image"""
+
+    def __init__(self, index: int, data: Optional[bytes] = None, image: Optional[Image.Image] = None):
+        self.index = index
+        self.data = data
+        self.image = image
+
+    def signature(self) -> np.ndarray:
+        """Tiny grayscale thumbnail for cheap change detection"""
+        if self.image is not None:
+            image = self.image
+        else:
+            image = Image.open(BytesIO(self.data))
+            # JPEG frames decode at 1/8 scale here, which is all we need
+            image.draft('L', (SIGNATURE_SIZE * 2, SIGNATURE_SIZE * 2))
+        small = image.convert('L').resize((SIGNATURE_SIZE, SIGNATURE_SIZE), Image.BILINEAR)
+        return np.asarray(small, dtype=np.float32) / 255.0
+
+    def encoded(self) -> bytes:
+        """JPEG bytes for the detector (re-encoded only for decoded frames)"""
+        if self.data is None:
+            buffered = BytesIO()
+            self.image.convert('RGB').save(buffered, format='JPEG', quality=90)
+            self.data = buffered.getvalue()
+        return self.data
+
+def frame_difference(a: np.ndarray, b: np.ndarray) -> float:
+    """Mean absolute pixel difference between two signatures (0-1)"""
+    return float(np.abs(a - b).mean())
+
+def iter_image_frames(image_data: bytes) -> Iterator[Frame]:
+    """Frames of a multi-frame image (animated GIF/WebP, multi-page TIFF)"""
+    image = Image.open(BytesIO(image_data))
+    for index, frame in enumerate(ImageSequence.Iterator(image)):
+        yield Frame(index, image=frame.convert('RGB'))
+
+def iter_encoded_frames(frames: Iterable[bytes]) -> Iterator[Frame]:
+    """Frames that already arrive as separate encoded images"""
+    for index, data in enumerate(frames):
+        yield Frame(index, data=data)
+
+def _jpeg_end(buffer: bytearray) -> Optional[int]:
+    """
+    Offset just past the EOI marker of the JPEG at the start of buffer
+
+    Walks marker segments by their length fields, so EOI markers inside
+    embedded EXIF thumbnails are skipped, and scans entropy-coded data for
+    the first marker that is not a stuffed byte or restart marker.
+
+    Returns:
+        End offset, or None if the frame is not complete yet
+    """
+    n = len(buffer)
+    i = 2
+    while True:
+        i = buffer.find(b'\xff', i)
+        if i == -1 or i + 1 >= n:
+            return None
+        marker = buffer[i + 1]
+        if marker == 0xFF:  # fill byte
+            i += 1
+            continue
+        if marker == 0xD9:  # EOI
+            return i + 2
+        if marker == 0x01 or 0xD0 <= marker <= 0xD7:  # standalone markers
+            i += 2
+            continue
+        if i + 3 >= n:
+            return None
+        segment_end = i + 2 + ((buffer[i + 2] << 8) | buffer[i + 3])
+        if segment_end > n:
+            return None
+        if marker != 0xDA:
+            i = segment_end
+            continue
+
+        # Start of scan: skip entropy-coded data up to the next real marker
+        j = segment_end
+        while True:
+            j = buffer.find(b'\xff', j)
+            if j == -1 or j + 1 >= n:
+                return None
+            following = buffer[j + 1]
+            if following == 0x00 or 0xD0 <= following <= 0xD7:
+                j += 2
+            elif following == 0xFF:
+                j += 1
+            else:
+                break
+        i = j
+
+def iter_mjpeg_frames(stream: BinaryIO, max_frame_bytes: int) -> Iterator[Frame]:
+    """
+    Split a stream of concatenated JPEGs (MJPEG) into frames as they arrive
+
+    Raises:
+        ImageTooLargeError: If a single frame grows past max_frame_bytes
+    """
+    buffer = bytearray()
+    index = 0
+    while True:
+        start = buffer.find(b'\xff\xd8')
+        if start == -1:
+            # Keep a trailing 0xFF in case the SOI marker is split across chunks
+            del buffer[:-1]
+        else:
+            if start:
+                del buffer[:start]
+            end = _jpeg_end(buffer)
+            if end is not None:
+                yield Frame(index, data=bytes(buffer[:end]))
+                del buffer[:end]
+                index += 1
+                continue
+            if len(buffer) > max_frame_bytes:
+                raise ImageTooLargeError(f'Frame {index} exceeds the {max_frame_bytes // (1024 * 1024)}MB limit')
+
+        chunk = stream.read(STREAM_CHUNK_SIZE)
+        if not chunk:
+            return
+        buffer += chunk
+
+def box_iou(a: Dict, b: Dict) -> float:
+    """IoU of two {"x", "y", "width", "height"} boxes"""
+    ax2, ay2 = a['x'] + a['width'], a['y'] + a['height']
+    bx2, by2 = b['x'] + b['width'], b['y'] + b['height']
+    inter_w = min(ax2, bx2) - max(a['x'], b['x'])
+    inter_h = min(ay2, by2) - max(a['y'], b['y'])
+    if inter_w <= 0 or inter_h <= 0:
+        return 0.0
+    inter = inter_w * inter_h
+    union = a['width'] * a['height'] + b['width'] * b['height'] - inter
+    return inter / union if union > 0 else 0.0
+
+class IoUTracker:
+    """
+    Minimal multi-object tracker
+
+    Matches each detector run to existing tracks greedily by IoU (same
+    label only), so objects keep a stable trackId across frames. Tracks
+    that go unmatched for more than max_age detector runs are dropped.
+    """
+
+    def __init__(self, iou_threshold: float = STREAM_TRACK_IOU, max_age: int = STREAM_TRACK_MAX_AGE):
+        self.iou_threshold = iou_threshold
+        self.max_age = max_age
+        self.tracks: List[Dict] = []
+        self._next_id = 1
+
+    def update(self, detections: List[Dict]) -> List[Dict]:
+        """Match fresh detections to tracks and return them with trackIds"""
+        pairs = []
+        for t, track in enumerate(self.tracks):
+            for d, detection in enumerate(detections):
+                if track['label'] != detection.get('label'):
+                    continue
+                iou = box_iou(track['bbox'], detection['bbox'])
+                if iou >= self.iou_threshold:
+                    pairs.append((iou, t, d))
+
+        matched_tracks, matched_detections = set(), {}
+        for _, t, d in sorted(pairs, reverse=True):
+            if t in matched_tracks or d in matched_detections:
+                continue
+            matched_tracks.add(t)
+            matched_detections[d] = self.tracks[t]
+
+        survivors = []
+        for t, track in enumerate(self.tracks):
+            if t not in matched_tracks:
+                track['misses'] += 1
+                if track['misses'] > self.max_age:
+                    continue
+            survivors.append(track)
+
+        results = []
+        for d, detection in enumerate(detections):
+            track = matched_detections.get(d)
+            if track is None:
+                track = {'trackId': self._next_id}
+                self._next_id += 1
+                survivors.append(track)
+            track.update(label=detection.get('label'), score=detection.get('score'),
+                         bbox=detection['bbox'], misses=0)
+            results.append({**detection, 'trackId': track['trackId']})
+
+        self.tracks = survivors
+        return results
+
+    def current(self) -> List[Dict]:
+        """Detections for the tracks seen in the latest detector run"""
+        return [
+            {'label': track['label'], 'score': track['score'], 'bbox': track['bbox'], 'trackId': track['trackId']}
+            for track in self.tracks if track['misses'] == 0
+        ]
+
+def process_frames(frames: Iterable[Frame], detect: Callable[[bytes], List[Dict]],
+                   sample_every: int = STREAM_SAMPLE_EVERY,
+                   diff_threshold: float = STREAM_DIFF_THRESHOLD,
+                   max_frames: int = STREAM_MAX_FRAMES) -> Iterator[Dict]:
+    """
+    Run detection over a frame sequence, skipping work where possible
+
+    Only every sample_every-th frame is considered. A sampled frame goes to
+    the detector only if it differs from the last detected frame by at
+    least diff_threshold; otherwise the tracker's detections are carried
+    forward. A frame the detector fails on is reported as an error and
+    leaves the tracks untouched.
+
+    Yields:
+        {"frame", "status": detected | unchanged | unsampled, "detections", "diff"},
+        or {"frame", "status": "error", "error", "diff"}
+    """
+    tracker = IoUTracker()
+    reference = None
+    for frame in frames:
+        if frame.index >= max_frames:
+            break
+
+        result = {'frame': frame.index}
+        if frame.index % sample_every:
+            result['status'] = 'unsampled'
+        else:
+            signature = frame.signature()
+            diff = frame_difference(signature, reference) if reference is not None else 1.0
+            result['diff'] = round(diff, 4)
+            if reference is None or diff >= diff_threshold:
+                try:
+                    detections = detect(frame.encoded())
+                except Exception as e:
+                    # Keep the tracks and reference; the next sampled frame retries
+                    print(f"⚠️ Detection failed on frame {frame.index}: {str(e)}")
+                    result.update(status='error', error='Detection failed')
+                    yield result
+                    frame.data = frame.image = None
+                    continue
+                tracker.update(detections)
+                reference = signature
+                result['status'] = 'detected'
+            else:
+                result['status'] = 'unchanged'
+
+        result['detections'] = tracker.current()
+        yield result
+        # Frames are not needed once reported
+        frame.data = frame.image = None
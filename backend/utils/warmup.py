@@ -0,0 +1,200 @@
+"""
+Detector warm-up and readiness
+Pings the detector with a tiny image at startup and periodically so a cold
+remote model is loaded before users hit it, and tracks whether it is ready
+"""
+
+import os
+import threading
+import time
+from io import BytesIO
+from typing import Dict, Optional
+
+from PIL import Image
+
+from utils.detectors import ModelLoadingError, get_detector
+from utils.http_client import remaining_budget
+
+WARMUP_ENABLED = os.getenv('WARMUP_ENABLED', 'true').lower() == 'true'
+# Seconds between keep-warm pings once ready; real detections reset the clock
+WARMUP_INTERVAL = float(os.getenv('WARMUP_INTERVAL', 300))
+# Seconds between pings while the model is cold or failing
+WARMUP_RETRY_INTERVAL = float(os.getenv('WARMUP_RETRY_INTERVAL', 5))
+WARMUP_TIMEOUT = float(os.getenv('WARMUP_TIMEOUT', 30))  # seconds per ping
+# Longest a request waits for a cold model before it is attempted anyway
+COLD_START_MAX_WAIT = float(os.getenv('COLD_START_MAX_WAIT', 10))
+
+COLD, LOADING, READY, FAILING, DISABLED = 'cold', 'loading', 'ready', 'failing', 'disabled'
+
+def _tiny_image() -> bytes:
+    buffered = BytesIO()
+    Image.new('RGB', (64, 64), (128, 128, 128)).save(buffered, format='JPEG', quality=75)
+    return buffered.getvalue()
+
+WARMUP_IMAGE = _tiny_image()
+
+class DetectorReadiness:
+    """
+    Readiness of the detector in this worker
+
+    cold: not probed yet; loading: the upstream is loading the model;
+    ready: the last ping or detection succeeded; failing: the last ping
+    failed for another reason (bad key, breaker open, ...). Requests only
+    wait while the model is cold or loading.
+    """
+
+    def __init__(self, enabled: bool = WARMUP_ENABLED):
+        self.enabled = enabled
+        self.state = COLD if enabled else DISABLED
+        self.last_error = None
+        self.last_success = None
+        self.last_ping_ms = None
+        self.pings = 0
+        self.waits = 0
+        self.wait_timeouts = 0
+        self._ready = threading.Event()
+        self._wakeup = threading.Event()
+        self._lock = threading.Lock()
+
+    def is_ready(self) -> bool:
+        return not self.enabled or self.state == READY
+
+    def mark_ready(self):
+        with self._lock:
+            self.last_success = time.monotonic()
+            if self.state != READY and self.enabled:
+                print(f"✅ Detector ready in worker {os.getpid()}")
+            if self.enabled:
+                self.state = READY
+                self.last_error = None
+        self._ready.set()
+
+    def mark_unready(self, state: str, error: str, wake: bool = True):
+        """
+        Record that the detector is not usable right now
+
+        Args:
+            state: loading or failing
+            error: Reason shown on /health
+            wake: Make the warm-up thread probe now rather than at its next
+                scheduled ping (requests pass True, the thread itself False)
+        """
+        if not self.enabled:
+            return
+        with self._lock:
+            self.state = state
+            self.last_error = error
+        self._ready.clear()
+        if wake:
+            self._wakeup.set()
+
+    def record_ping(self, milliseconds: float):
+        with self._lock:
+            self.pings += 1
+            self.last_ping_ms = round(milliseconds, 1)
+
+    def wait(self, deadline: Optional[float] = None) -> bool:
+        """
+        Hold a request while the model is cold, bounded by COLD_START_MAX_WAIT
+
+        Args:
+            deadline: time.monotonic() value the request must finish by; the
+                wait leaves at least a second of it for the detector call
+
+        Returns:
+            True if the detector is ready (or not cold) when the wait ends
+        """
+        if self.is_ready() or self.state not in (COLD, LOADING):
+            return self.is_ready()
+        timeout = COLD_START_MAX_WAIT
+        remaining = remaining_budget(deadline)
+        if remaining is not None:
+            timeout = min(timeout, remaining - 1)
+        if timeout <= 0:
+            return False
+        with self._lock:
+            self.waits += 1
+        ready = self._ready.wait(timeout)
+        if not ready:
+            with self._lock:
+                self.wait_timeouts += 1
+        return ready
+
+    def next_ping_in(self) -> float:
+        if self.state != READY or self.last_success is None:
+            return WARMUP_RETRY_INTERVAL
+        return max(0.0, self.last_success + WARMUP_INTERVAL - time.monotonic())
+
+    def sleep(self, seconds: float):
+        self._wakeup.wait(seconds)
+        self._wakeup.clear()
+
+    def snapshot(self) -> Dict:
+        with self._lock:
+            snapshot = {
+                'ready': self.is_ready(),
+                'state': self.state,
+                'lastError': self.last_error,
+                'pings': self.pings,
+                'lastPingMs': self.last_ping_ms,
+                'coldStartWaits': self.waits,
+                'coldStartTimeouts': self.wait_timeouts
+            }
+            if self.last_success is not None:
+                snapshot['lastSuccessSecondsAgo'] = round(time.monotonic() - self.last_success, 1)
+        return snapshot
+
+readiness = DetectorReadiness()
+
+def warm_up_once() -> bool:
+    """
+    Send the warm-up image straight to the detector, bypassing the caches
+
+    Returns:
+        True if the detector answered
+    """
+    started = time.perf_counter()
+    try:
+        get_detector().detect(WARMUP_IMAGE, deadline=time.monotonic() + WARMUP_TIMEOUT)
+    except ModelLoadingError as e:
+        readiness.mark_unready(LOADING, str(e), wake=False)
+        return False
+    except Exception as e:
+        print(f"⚠️ Detector warm-up failed: {str(e)}")
+        readiness.mark_unready(FAILING, str(e), wake=False)
+        return False
+    finally:
+        readiness.record_ping((time.perf_counter() - started) * 1000)
+    readiness.mark_ready()
+    return True
+
+def _warmup_loop():
+    while True:
+        try:
+            warm_up_once()
+        except Exception as e:
+            print(f"⚠️ Warm-up loop error: {str(e)}")
+        readiness.sleep(readiness.next_ping_in())
+        while readiness.state == READY and readiness.next_ping_in() > 0:
+            # A real detection succeeded meanwhile; no need to ping yet
+            readiness.sleep(readiness.next_ping_in())
+
+_started_pid = None
+_start_lock = threading.Lock()
+
+def start_warmup():
+    """
+    Start the warm-up thread for this process
+
+    Safe to call repeatedly, from gunicorn's post_fork hook or lazily on
+    first request, like start_job_workers.
+    """
+    global _started_pid
+    if _started_pid == os.getpid() or not WARMUP_ENABLED:
+        return
+    with _start_lock:
+        if _started_pid == os.getpid():
+            return
+        threading.Thread(target=_warmup_loop, name='detector-warmup', daemon=True).start()
+        _started_pid = os.getpid()
+        print(f"🔥 Started detector warm-up in process {os.getpid()}")
@@ -1,200 +1,405 @@
 """
 YOLO Object Detection Integration
-Uses Hugging Face API for object detection
+Runs the configured detector backend (Hugging Face API by default)
 """
 
-import requests
-import os
 import base64
+import functools
+import os
 from io import BytesIO
-from PIL import Image, ImageDraw, ImageFont
-from typing import List, Dict, Tuple
-import random
+from PIL import Image
+from typing import List, Dict, Optional, Tuple, Union
+import threading
+import time
+
+from utils.cache import detection_cache, make_cache_key
+from utils.detectors import (CASCADE_BACKEND, CASCADE_MODEL, Detector, ModelLoadingError,
+                             get_cascade_detector, get_detector)
+from utils.image_input import DecodedImage
+from utils.near_duplicate import NEAR_DUP_ENABLED, Fingerprint, fingerprint_image, near_duplicate_index
+from utils.preprocess import PREPROCESS_MAX_SIDE, PreparedImage, prepare_for_inference, rescale_detections
+from utils.render import label_color, renderer
+from utils.tiling import TILE_INCLUDE_FULL, TILE_MERGE_THRESHOLD, TiledDetections, detect_tiles
+from utils.warmup import LOADING, readiness
 
-HUGGINGFACE_API_KEY = os.getenv('HUGGINGFACE_API_KEY')
-# Using YOLOv8 model - more accurate and publicly accessible
-HUGGINGFACE_API_URL = "https://api-inference.huggingface.co/models/hustvl/yolos-tiny"
+# Cascade: results of the fast detector are escalated to CASCADE_BACKEND when
+# fewer than CASCADE_MIN_DETECTIONS reach CASCADE_MIN_CONFIDENCE, or when more
+# than CASCADE_MAX_UNCERTAIN of them fall below it
+CASCADE_MIN_CONFIDENCE = float(os.getenv('CASCADE_MIN_CONFIDENCE', 0.6))
+CASCADE_MIN_DETECTIONS = int(os.getenv('CASCADE_MIN_DETECTIONS', 1))
+CASCADE_MAX_UNCERTAIN = float(os.getenv('CASCADE_MAX_UNCERTAIN', 0.5))
 
-def detect_objects(image_base64: str) -> List[Dict]:
+def detect_objects(image: Union[str, DecodedImage], tiling: Optional[Dict] = None,
+                   deadline: Optional[float] = None) -> List[Dict]:
     """
-    Detect objects in an image using YOLO via Hugging Face
+    Detect objects in an image using the configured detector backend
     
     Args:
-        image_base64: Base64 encoded image string
+        image: Decoded request image, or a base64 encoded image string
+        tiling: Tiling options from parse_tile_options, or None to send the
+            image as a single frame (use detect_tiled to learn whether a
+            tiled result is partial)
+        deadline: time.monotonic() value the detector call must finish by
         
     Returns:
         List of detection dictionaries with label, score, and bbox
-    """
-    try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        
-        # Call Hugging Face API with or without key
-        headers = {}
-        if HUGGINGFACE_API_KEY:
-            headers["Authorization"] = f"Bearer {HUGGINGFACE_API_KEY}"
-            print(f"✅ Using API key: {HUGGINGFACE_API_KEY[:10]}...")
-        else:
-            print("⚠️ No API key, trying public inference...")
-        response = requests.post(
-            HUGGINGFACE_API_URL,
-            headers=headers,
-            data=image_data,
-            timeout=30
-        )
         
-        if response.status_code != 200:
-            error_msg = f"⚠️ Hugging Face API error: {response.status_code}"
-            try:
-                error_detail = response.json()
-                print(f"{error_msg} - {error_detail}")
-            except:
-                print(f"{error_msg} - {response.text[:200]}")
-            
-            if response.status_code == 401:
-                print("❌ Authentication failed! Check your HUGGINGFACE_API_KEY")
-            elif response.status_code == 503:
-                print("⏳ Model is loading, please wait and try again...")
-            
-            return get_mock_detections()
-        
-        # Parse response
-        detections = response.json()
-        
-        # Debug: Print raw API response
-        print(f"🔍 Raw API response: {detections}")
-        
-        # Format detections
-        formatted_detections = []
-        for detection in detections:
-            # Get label with better fallback
-            label = detection.get('label', 'Unknown')
-            if label == 'Unknown' or not label:
-                print(f"⚠️ Detection missing label: {detection}")
-            
-            formatted_detections.append({
-                'label': label,
-                'score': detection.get('score', 0.0),
-                'bbox': {
-                    'x': detection.get('box', {}).get('xmin', 0),
-                    'y': detection.get('box', {}).get('ymin', 0),
-                    'width': detection.get('box', {}).get('xmax', 0) - detection.get('box', {}).get('xmin', 0),
-                    'height': detection.get('box', {}).get('ymax', 0) - detection.get('box', {}).get('ymin', 0)
-                }
-            })
-        
-        return formatted_detections
+    Raises:
+        ModelLoadingError: If the model is still loading after the cold-start wait
+        CircuitOpenError: If the detector's circuit breaker is open
+        Exception: Whatever the detector backend raised; failures are never
+            answered with made-up detections
+    """
+    # Decode base64 image unless the caller already did
+    if isinstance(image, str):
+        image = DecodedImage.from_data_url(image)
+    
+    if tiling is not None:
+        return detect_tiled(image, tiling, deadline).detections
+    return run_detection(image.data, deadline)
+
+def run_detection(image_data: Union[bytes, memoryview], deadline: Optional[float] = None,
+                  near_dup: bool = True) -> List[Dict]:
+    """
+    Detect objects in encoded image bytes, using the caches where possible
+    
+    Args:
+        image_data: Encoded image bytes
+        deadline: time.monotonic() value the detector call must finish by
+        near_dup: Look up and record perceptual near-duplicates. Tiles turn
+            this off: a 9x8 hash cannot tell low-detail tiles apart.
         
+    Raises:
+        Exception: Whatever the detector backend raised
+    """
+    detector = get_detector()
+    model_id = pipeline_id(detector)
+    
+    # Same bytes + same model + same input size always give the same answer
+    cache_key = make_cache_key(model_id, str(PREPROCESS_MAX_SIDE), image_data)
+    cached = detection_cache.get(cache_key)
+    if cached is not None:
+        return cached
+    
+    # A re-saved or resized copy of an earlier upload reuses its result
+    scope = f"{model_id}:{PREPROCESS_MAX_SIDE}"
+    fingerprint = fingerprint_image(image_data) if NEAR_DUP_ENABLED and near_dup else None
+    if fingerprint is not None:
+        detections = find_near_duplicate(scope, fingerprint)
+        if detections is not None:
+            detection_cache.set(cache_key, detections)
+            return detections
+    
+    # Send a downscaled copy and map the boxes back to the original
+    prepared = prepare_for_inference(image_data)
+    detections, complete = run_cascade(detector, prepared.data, deadline)
+    detections = rescale_detections(detections, prepared)
+    
+    # A fast result standing in for a failed cascade stage is not cached
+    if complete:
+        detection_cache.set(cache_key, detections)
+        if fingerprint is not None:
+            near_duplicate_index.add(scope, fingerprint, cache_key)
+    
+    return detections
+
+def call_detector(detector: Detector, image_data: Union[bytes, memoryview],
+                  deadline: Optional[float] = None) -> List[Dict]:
+    """
+    Run the detector, holding the call briefly while the model is cold
+    
+    A request that finds the model loading waits (bounded) for the warm-up
+    thread to report it ready and tries once more, rather than falling
+    straight back to mock detections.
+    
+    Raises:
+        Exception: Whatever the detector backend raised
+    """
+    readiness.wait(deadline)
+    try:
+        detections = detector.detect(image_data, deadline=deadline)
+    except ModelLoadingError as e:
+        # Unloaded after an idle period: let the warm-up thread take over
+        readiness.mark_unready(LOADING, str(e))
+        if not readiness.wait(deadline):
+            raise
+        detections = detector.detect(image_data, deadline=deadline)
+    readiness.mark_ready()
+    return detections
+
+def pipeline_id(detector: Detector) -> str:
+    """
+    Cache identity of the detection pipeline: the model, or both cascade stages and thresholds
+    
+    The cascade stage is named by its configuration, not by whether it
+    loaded, so a passing load failure does not move every cache key.
+    """
+    if not CASCADE_BACKEND:
+        return detector.model_id
+    return (f"cascade:{detector.model_id}>{CASCADE_BACKEND}:{CASCADE_MODEL}"
+            f"@{CASCADE_MIN_CONFIDENCE}/{CASCADE_MIN_DETECTIONS}/{CASCADE_MAX_UNCERTAIN}")
+
+def needs_escalation(detections: List[Dict]) -> bool:
+    """Whether the fast detector's result is too uncertain to return as is"""
+    if not detections:
+        return CASCADE_MIN_DETECTIONS > 0
+    confident = sum(1 for d in detections if d.get('score', 0.0) >= CASCADE_MIN_CONFIDENCE)
+    if confident < CASCADE_MIN_DETECTIONS:
+        return True
+    return (len(detections) - confident) / len(detections) > CASCADE_MAX_UNCERTAIN
+
+def run_cascade(detector: Detector, image_data: Union[bytes, memoryview],
+                deadline: Optional[float] = None) -> Tuple[List[Dict], bool]:
+    """
+    Run the fast detector, and the cascade detector if its result is uncertain
+    
+    If the second stage fails (down, not loaded, out of time) the fast result
+    is returned rather than nothing.
+    
+    Returns:
+        (detections, complete); complete is False when the result needed
+        the cascade stage but only the fast one answered
+    
+    Raises:
+        Exception: Whatever the fast detector backend raised
+    """
+    started = time.perf_counter()
+    detections = call_detector(detector, image_data, deadline)
+    fast_ms = (time.perf_counter() - started) * 1000
+    
+    if not CASCADE_BACKEND:
+        return detections, True
+    if not needs_escalation(detections):
+        _record_cascade(fast_ms)
+        return detections, True
+    heavy = get_cascade_detector()
+    if heavy is None:
+        _record_cascade(fast_ms, 0.0, failed=True)
+        return detections, False
+    
+    started = time.perf_counter()
+    try:
+        escalated = heavy.detect(image_data, deadline=deadline)
     except Exception as e:
-        print(f"⚠️ Error in object detection: {str(e)}")
-        return get_mock_detections()
-
-def get_mock_detections() -> List[Dict]:
-    """
-    Return mock detection data for testing
-    """
-    return [
-        {
-            'label': 'car',
-            'score': 0.94,
-            'bbox': {'x': 80, 'y': 120, 'width': 180, 'height': 160}
-        },
-        {
-            'label': 'person',
-            'score': 0.89,
-            'bbox': {'x': 340, 'y': 80, 'width': 140, 'height': 180}
-        },
-        {
-            'label': 'bike',
-            'score': 0.87,
-            'bbox': {'x': 150, 'y': 260, 'width': 100, 'height': 80}
-        },
-        {
-            'label': 'tree',
-            'score': 0.82,
-            'bbox': {'x': 20, 'y': 30, 'width': 80, 'height': 60}
-        },
-        {
-            'label': 'sign',
-            'score': 0.76,
-            'bbox': {'x': 380, 'y': 280, 'width': 120, 'height': 90}
-        }
-    ]
+        print(f"⚠️ Cascade stage {heavy.model_id} failed, keeping fast result: {str(e)}")
+        _record_cascade(fast_ms, (time.perf_counter() - started) * 1000, failed=True)
+        return detections, False
+    heavy_ms = (time.perf_counter() - started) * 1000
+    _record_cascade(fast_ms, heavy_ms)
+    print(f"🪜 Escalated to {heavy.model_id}: {len(detections)} -> {len(escalated)} detections "
+          f"({fast_ms:.0f}ms + {heavy_ms:.0f}ms)")
+    return escalated, True
+
+# Per-stage cascade counters for this worker process
+_cascade_stats = {'images': 0, 'escalated': 0, 'escalationErrors': 0, 'fastMs': 0.0, 'heavyMs': 0.0}
+_cascade_stats_lock = threading.Lock()
+
+def _record_cascade(fast_ms: float, heavy_ms: Optional[float] = None, failed: bool = False):
+    with _cascade_stats_lock:
+        _cascade_stats['images'] += 1
+        _cascade_stats['fastMs'] += fast_ms
+        if heavy_ms is not None:
+            _cascade_stats['escalated'] += 1
+            _cascade_stats['heavyMs'] += heavy_ms
+            if failed:
+                _cascade_stats['escalationErrors'] += 1
+
+def cascade_stats() -> Dict:
+    """Escalation rate and average latency per cascade stage"""
+    if not CASCADE_BACKEND:
+        return {'enabled': False}
+    heavy = get_cascade_detector()
+    with _cascade_stats_lock:
+        stats = dict(_cascade_stats)
+    images, escalated = stats['images'], stats['escalated']
+    return {
+        'enabled': True,
+        'fastModel': get_detector().model_id,
+        'heavyModel': heavy.model_id if heavy is not None else f"{CASCADE_BACKEND}:{CASCADE_MODEL}",
+        'heavyLoaded': heavy is not None,
+        'images': images,
+        'escalated': escalated,
+        'escalationErrors': stats['escalationErrors'],
+        'escalationRate': round(escalated / images, 3) if images else 0.0,
+        'avgFastMs': round(stats['fastMs'] / images, 1) if images else 0.0,
+        'avgHeavyMs': round(stats['heavyMs'] / escalated, 1) if escalated else 0.0
+    }
+
+def detect_tiled(image: DecodedImage, tiling: Dict, deadline: Optional[float] = None) -> TiledDetections:
+    """
+    Detect objects tile by tile; the merged result is cached as a whole
+    
+    A partial result (some tiles failed) is returned but never cached, so a
+    brief upstream error does not stick to the image for the cache TTL.
+    
+    Raises:
+        Exception: If the image cannot be decoded or every tile failed
+    """
+    cache_key = make_cache_key(
+        pipeline_id(get_detector()), str(PREPROCESS_MAX_SIDE), 'tiled',
+        str(tiling['tile_size']), str(tiling['overlap']),
+        f"full={TILE_INCLUDE_FULL}", f"merge={TILE_MERGE_THRESHOLD}", image.data
+    )
+    cached = detection_cache.get(cache_key)
+    if cached is not None:
+        return TiledDetections(cached, 0, 0)
+    
+    # Tiles skip near-duplicate matching: a match would reuse another tile's
+    # (or image's) boxes at this tile's offset
+    detect = functools.partial(run_detection, deadline=deadline, near_dup=False)
+    result = detect_tiles(image.image, tiling, detect, full_image_data=image.data)
+    if not result.partial:
+        detection_cache.set(cache_key, result.detections)
+    return result
+
+def find_near_duplicate(scope: str, fingerprint: Fingerprint) -> Optional[List[Dict]]:
+    """
+    Detections of a perceptually identical earlier image, in this image's size
+    
+    Args:
+        scope: Detector model and input size the result must come from
+        fingerprint: Perceptual hash and size of the new image
+        
+    Returns:
+        Rescaled detections, or None if there is no usable near-duplicate
+    """
+    match = near_duplicate_index.find(scope, fingerprint)
+    if match is None:
+        return None
+    
+    detections = detection_cache.get(match['cacheKey'], record_stats=False)
+    if detections is None:
+        # The result behind this entry has expired from the cache
+        near_duplicate_index.discard(scope, match['hash'])
+        return None
+    
+    near_duplicate_index.record_hit()
+    print(f"🔁 Near-duplicate hit (distance {match['distance']}): "
+          f"{match['width']}x{match['height']} -> {fingerprint.width}x{fingerprint.height}")
+    mapping = PreparedImage(
+        None, fingerprint.width, fingerprint.height,
+        fingerprint.width / match['width'], fingerprint.height / match['height']
+    )
+    return rescale_detections(detections, mapping)
 
 def generate_color(label: str) -> Tuple[int, int, int]:
-    """Generate a consistent color for each label"""
-    random.seed(hash(label))
-    return (random.randint(100, 255), random.randint(100, 255), random.randint(100, 255))
+    """Generate a consistent color for each label (stable across workers)"""
+    return label_color(label)
+
+ANNOTATION_FORMATS = {
+    'png': ('PNG', 'image/png'),
+    'jpeg': ('JPEG', 'image/jpeg'),
+    'webp': ('WEBP', 'image/webp')
+}
+
+# Per-format encode counters for this worker process
+_annotation_stats = {fmt: {'count': 0, 'bytes': 0, 'encodeMs': 0.0} for fmt in ANNOTATION_FORMATS}
+_annotation_stats_lock = threading.Lock()
+
+def annotation_stats() -> Dict:
+    """Average encode time and output size per annotation format"""
+    with _annotation_stats_lock:
+        stats = {fmt: dict(values) for fmt, values in _annotation_stats.items()}
+    for values in stats.values():
+        count = values['count']
+        values['avgBytes'] = round(values['bytes'] / count) if count else 0
+        values['avgEncodeMs'] = round(values['encodeMs'] / count, 1) if count else 0.0
+        values['encodeMs'] = round(values['encodeMs'], 1)
+    return stats
+
+def render_annotation(image: Image.Image, detections: List[Dict], fmt: str = 'png',
+                      quality: int = 85, max_side: Optional[int] = None) -> Dict:
+    """
+    Draw bounding boxes and encode the annotated image
+    
+    Args:
+        image: Decoded PIL image (drawn on in place unless it is downscaled first)
+        detections: List of detection dictionaries in image coordinates
+        fmt: Output format: png, jpeg or webp
+        quality: JPEG/WebP quality (1-100)
+        max_side: Optional thumbnail cap for the longest side
+        
+    Returns:
+        {"data": bytes, "mimetype", "format", "width", "height", "bytes", "encodeMs"}
+    """
+    pil_format, mimetype = ANNOTATION_FORMATS[fmt]
+    
+    # Shrink first so drawing and encoding both work on fewer pixels
+    scale = 1.0
+    if max_side and max(image.size) > max_side:
+        original_width = image.width
+        image = image.copy()
+        image.thumbnail((max_side, max_side), Image.BILINEAR, reducing_gap=2.0)
+        scale = image.width / original_width
+    
+    if pil_format != 'PNG' and image.mode not in ('RGB', 'L'):
+        image = image.convert('RGB')
+    
+    image = draw_detections(image, detections, scale)
+    
+    started = time.perf_counter()
+    buffered = BytesIO()
+    save_options = {'quality': quality} if pil_format != 'PNG' else {}
+    image.save(buffered, format=pil_format, **save_options)
+    encode_ms = (time.perf_counter() - started) * 1000
+    data = buffered.getvalue()
+    
+    with _annotation_stats_lock:
+        stats = _annotation_stats[fmt]
+        stats['count'] += 1
+        stats['bytes'] += len(data)
+        stats['encodeMs'] += encode_ms
+    
+    return {
+        'data': data,
+        'mimetype': mimetype,
+        'format': fmt,
+        'width': image.width,
+        'height': image.height,
+        'bytes': len(data),
+        'encodeMs': round(encode_ms, 1)
+    }
 
-def draw_bounding_boxes(image_base64: str, detections: List[Dict]) -> str:
+def draw_detections(image: Image.Image, detections: List[Dict], scale: float = 1.0) -> Image.Image:
+    """
+    Draw boxes and labels onto an image
+    
+    Args:
+        image: PIL image to draw on (in place when it is already RGB/RGBA)
+        detections: List of detection dictionaries
+        scale: Factor from detection coordinates to image coordinates
+        
+    Returns:
+        The image that was drawn on
+    """
+    return renderer.draw(image, detections, scale)
+
+def draw_bounding_boxes(image: Union[str, Image.Image], detections: List[Dict], fmt: str = 'png',
+                        quality: int = 85, max_side: Optional[int] = None) -> Optional[str]:
     """
     Draw bounding boxes on the image
     
     Args:
-        image_base64: Base64 encoded image string
+        image: Decoded PIL image (drawn on in place), or a base64 encoded image string
         detections: List of detection dictionaries
+        fmt: Output format: png, jpeg or webp
+        quality: JPEG/WebP quality (1-100)
+        max_side: Optional thumbnail cap for the longest side
         
     Returns:
-        Base64 encoded image with bounding boxes
+        Base64 data URL of the image with bounding boxes
     """
+    original = image
     try:
-        # Decode base64 image
-        image_data = base64.b64decode(image_base64.split(',')[1] if ',' in image_base64 else image_base64)
-        image = Image.open(BytesIO(image_data))
-        
-        # Create drawing object
-        draw = ImageDraw.Draw(image)
-        
-        # Try to load a font, fallback to default if not available
-        try:
-            font = ImageFont.truetype("arial.ttf", 20)
-        except:
-            font = ImageFont.load_default()
-        
-        # Draw each detection
-        for detection in detections:
-            label = detection.get('label', 'Unknown')
-            score = detection.get('score', 0.0)
-            bbox = detection.get('bbox', {})
-            
-            # Get coordinates
-            x = bbox.get('x', 0)
-            y = bbox.get('y', 0)
-            width = bbox.get('width', 0)
-            height = bbox.get('height', 0)
-            
-            # Calculate box coordinates
-            x1, y1 = int(x), int(y)
-            x2, y2 = int(x + width), int(y + height)
-            
-            # Generate color for this label
-            color = generate_color(label)
-            
-            # Draw bounding box with thicker line
-            for i in range(3):
-                draw.rectangle([x1-i, y1-i, x2+i, y2+i], outline=color, width=2)
-            
-            # Prepare label text
-            text = f"{label} ({score:.2f})"
-            
-            # Get text bounding box for background
-            bbox_text = draw.textbbox((x1, y1), text, font=font)
-            text_width = bbox_text[2] - bbox_text[0]
-            text_height = bbox_text[3] - bbox_text[1]
-            
-            # Draw background rectangle for text
-            draw.rectangle([x1, y1 - text_height - 8, x1 + text_width + 10, y1], fill=color)
-            
-            # Draw text
-            draw.text((x1 + 5, y1 - text_height - 4), text, fill='white', font=font)
+        if isinstance(image, str):
+            # Boxes are in EXIF-oriented coordinates, same as the detector input
+            image = DecodedImage.from_data_url(image).image
         
-        # Convert back to base64
-        buffered = BytesIO()
-        image.save(buffered, format="PNG")
-        img_str = base64.b64encode(buffered.getvalue()).decode()
+        annotation = render_annotation(image, detections, fmt, quality, max_side)
+        img_str = base64.b64encode(annotation.pop('data')).decode()
         
-        return f"data:image/png;base64,{img_str}"
+        return f"data:{annotation['mimetype']};base64,{img_str}"
         
     except Exception as e:
         print(f"⚠️ Error drawing bounding boxes: {str(e)}")
-        return image_base64
+        return original if isinstance(original, str) else None